@@ -3,17 +3,38 @@
 中央财经大学经济学院 - 经济学大模型聊天助手
 """
 
-import os
+import io
+import re
+import json
+import time
+import queue
+import contextvars
 import logging
 import threading
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_file
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from datetime import datetime, timedelta
+from flask import Flask, Response, g, request, jsonify, render_template, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 
-from config import get_config, ensure_directories, validate_config
+from config import (get_config, ensure_directories, validate_config, ModelConfig, ReportConfig, AdmissionConfig,
+                    SecurityConfig, LogConfig)
+from models.admission import (
+    AdmissionController, AdmissionRejected, AdmissionUnavailable, PRIORITY_BACKGROUND, estimate_work
+)
 from models.chatbot import QwenChatBot
+from models.model_server import RemoteChatBot
+from models.rate_limiter import ROUTE_POLICIES, client_address, create_rate_limiter, route_class
 from models.report_generator import ReportGenerator
-from utils.document_utils import create_word_document
+from utils.document_utils import create_markdown_document, render_word_document
+from utils.metrics import (
+    REGISTRY, CONTENT_TYPE, SCOPE_APP, LATENCY_BUCKETS, PHASE_BUCKETS, CallbackMetric, Counter, Gauge, Histogram
+)
+from utils.zip_stream import ZipStream
+from utils.security_scanner import SecurityScanner, load_rules
+from utils.tracing import record_generation, to_chrome_trace, trace_span
 from utils.text_utils import validate_input
 
 logging.basicConfig(
@@ -22,9 +43,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HTTP_REQUEST_SECONDS = Histogram(
+    'chatbot_http_request_duration_seconds', 'HTTP请求处理时长（秒），流式响应计到流结束', LATENCY_BUCKETS, ('endpoint',)
+)
+HTTP_REQUESTS = Counter('chatbot_http_requests_total', 'HTTP请求数', ('endpoint', 'method', 'status'))
+REPORT_PHASE_SECONDS = Histogram(
+    'chatbot_report_phase_duration_seconds', '报告生成各阶段耗时（秒）：大纲、单个章节（不含排队）、整份报告',
+    PHASE_BUCKETS, ('phase',)
+)
+REPORTS = Counter('chatbot_reports_total', '结束的报告生成任务数', ('status',))
+ACTIVE_GENERATIONS = Gauge('chatbot_active_generations', '正在生成的聊天请求和报告数', ('kind',))
+
+_OUTLINE_PHASE = REPORT_PHASE_SECONDS.labels('outline')
+_SECTION_PHASE = REPORT_PHASE_SECONDS.labels('section')
+_REPORT_PHASE = REPORT_PHASE_SECONDS.labels('report')
+_ACTIVE_CHATS = ACTIVE_GENERATIONS.labels('chat')
+_ACTIVE_REPORTS = ACTIVE_GENERATIONS.labels('report')
+
+SESSION_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+# 会话错误（chatbot 返回的 session_error）对应的HTTP状态码
+SESSION_ERROR_STATUS = {'not_found': 404, 'busy': 409}
+
 
 def create_app():
     """创建Flask应用"""
+    init_started = time.perf_counter()
     ensure_directories()
     validate_config()
 
@@ -34,54 +77,239 @@ def create_app():
 
     CORS(app)
 
-    chatbot = QwenChatBot()
+    if ModelConfig.MODEL_SERVER_SOCKET:
+        chatbot = RemoteChatBot(ModelConfig.MODEL_SERVER_SOCKET)
+    else:
+        chatbot = QwenChatBot()
     report_generator = ReportGenerator()
 
+    def load_failed():
+        """模型加载失败（不会再就绪）"""
+        return not chatbot.is_ready() and chatbot.load_error is not None
+
+    # 准入控制：按token工作量限制排队，模型加载期间请求排队等待而不是直接返回503；加载失败时立即返回503
+    admission = AdmissionController(
+        is_ready=chatbot.is_ready, is_failed=load_failed
+    ) if AdmissionConfig.ADMISSION_ENABLED else None
+    # 输入校验和模型输出共用一个合并规则的扫描器
+    security_scanner = SecurityScanner(load_rules(SecurityConfig.SECURITY_PATTERNS_FILE))
+    rate_limiter = create_rate_limiter() if SecurityConfig.RATE_LIMIT_ENABLED else None
+
     setup_cleanup_scheduler(report_generator)
+    register_app_metrics(report_generator, admission)
+    # (endpoint, method, status) -> (耗时直方图, 请求计数) 子指标
+    request_metrics = {}
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.before_request
+    def enforce_rate_limit():
+        """按客户端IP和路由类别限流，超出时返回429"""
+        if rate_limiter is None:
+            return None
+        route = route_class(request.path, request.method)
+        if route is None:
+            return None
+
+        client = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        result = rate_limiter.check(client, ROUTE_POLICIES[route])
+        g.rate_limit = result
+        if result.allowed:
+            return None
+
+        logger.warning(f"请求被限流 - 客户端: {client}, 类别: {route}, 路径: {request.path}")
+        return jsonify({
+            "error": "请求过于频繁，请稍后再试",
+            "retry_after": result.retry_after
+        }), 429
+
+    @app.after_request
+    def add_rate_limit_headers(response):
+        result = g.get('rate_limit')
+        if result is not None:
+            response.headers.update(result.headers())
+        return response
+
+    @app.after_request
+    def record_request_metrics(response):
+        """记录请求耗时；流式响应在流结束（响应关闭）时记录"""
+        started = g.get('request_started')
+        if started is None:
+            return response
+        key = (request.endpoint or 'unmatched', request.method, response.status_code)
+        metrics = request_metrics.get(key)
+        if metrics is None:
+            metrics = request_metrics.setdefault(key, (
+                HTTP_REQUEST_SECONDS.labels(key[0]), HTTP_REQUESTS.labels(*key)
+            ))
+
+        def record():
+            metrics[0].observe(time.perf_counter() - started)
+            metrics[1].inc()
+
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+        return response
 
     @app.route('/')
     def index():
         """主页"""
         return render_template('index.html')
 
+    def parse_chat_request():
+        """解析并校验聊天请求，返回 (参数字典, 错误响应)"""
+        data = request.get_json()
+
+        if not data or 'message' not in data:
+            return None, (jsonify({"error": "消息内容不能为空"}), 400)
+
+        user_message = data.get('message', '').strip()
+        if not user_message:
+            return None, (jsonify({"error": "消息内容不能为空"}), 400)
+
+        # 字符数只做粗略检查，token数和提示词预算由模型侧的上下文管理器检查
+        validation_error = validate_input(user_message, max_length=SecurityConfig.MAX_MESSAGE_LENGTH,
+                                          scanner=security_scanner)
+        if validation_error:
+            return None, (jsonify({"error": validation_error}), 400)
+
+        session_id = data.get('session_id')
+        if session_id is not None and (not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(session_id)):
+            return None, (jsonify({"error": "会话ID格式无效"}), 400)
+
+        if load_failed():
+            return None, load_failed_response()
+
+        if admission is None and not chatbot.is_ready():
+            return None, (jsonify({
+                "error": "模型正在加载中，请稍后再试...",
+                "loading": True
+            }), 503)
+
+        return {
+            "user_message": user_message,
+            "max_new_tokens": min(data.get('max_new_tokens', 1024), 4096),
+            "temperature": max(0.1, min(data.get('temperature', 0.7), 2.0)),
+            "enable_thinking": data.get('enable_thinking', True),
+            "use_cache": data.get('use_cache', True),
+            "session_id": session_id
+        }, None
+
+    def admit_chat_request(params):
+        """将聊天请求加入准入队列，返回 (凭证, 错误响应)；未启用准入控制时凭证为None"""
+        if admission is None:
+            return None, None
+        try:
+            ticket = admission.submit(estimate_work(params['user_message'], params['max_new_tokens']))
+        except AdmissionRejected as e:
+            logger.warning(f"聊天请求被拒绝: {e}")
+            response = jsonify({
+                "error": "当前请求过多，请稍后再试",
+                "retry_after": e.retry_after,
+                "queued_tokens": e.queued_tokens
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return None, (response, 429)
+        except AdmissionUnavailable:
+            return None, load_failed_response()
+        return ticket, None
+
+    def load_failed_response():
+        return jsonify({"error": f"模型加载失败: {chatbot.load_error}", "load_error": True}), 503
+
+    def queue_timeout_response():
+        retry_after = admission.retry_after()
+        response = jsonify({
+            "error": "排队等待超时，请稍后再试",
+            "loading": not chatbot.is_ready(),
+            "retry_after": retry_after
+        })
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 503
+
+    def queue_info(ticket):
+        if ticket is None:
+            return None
+        return {
+            "position": ticket.initial_position,
+            "waited_seconds": round(ticket.waited_seconds, 3)
+        }
+
+    def blocked_output(match, source):
+        """记录被拦截的模型输出，返回给客户端的错误信息"""
+        logger.warning(f"模型输出命中安全规则 {match.rule}，已拦截 - 来源: {source}, 位置: {match.start}")
+        return {"error": "回复包含不安全的内容，已拦截", "rule": match.rule}
+
     @app.route('/api/chat', methods=['POST'])
     def chat():
         """聊天API端点"""
         try:
-            data = request.get_json()
+            params, error_response = parse_chat_request()
+            if error_response:
+                return error_response
 
-            if not data or 'message' not in data:
-                return jsonify({"error": "消息内容不能为空"}), 400
+            ticket, error_response = admit_chat_request(params)
+            if error_response:
+                return error_response
 
-            user_message = data.get('message', '').strip()
-            if not user_message:
-                return jsonify({"error": "消息内容不能为空"}), 400
-
-            validation_error = validate_input(user_message, max_length=4000)
-            if validation_error:
-                return jsonify({"error": validation_error}), 400
+            try:
+                if ticket is not None and not ticket.wait(AdmissionConfig.QUEUE_TIMEOUT):
+                    admission.timed_out(ticket)
+                    return queue_timeout_response()
 
-            if not chatbot.is_ready():
+                _ACTIVE_CHATS.inc()
+                try:
+                    response = chatbot.generate_response(
+                        params['user_message'],
+                        max_new_tokens=params['max_new_tokens'],
+                        temperature=params['temperature'],
+                        enable_thinking=params['enable_thinking'],
+                        use_cache=params['use_cache'],
+                        semantic_cache=params['use_cache'],
+                        session_id=params['session_id']
+                    )
+                finally:
+                    _ACTIVE_CHATS.dec()
+            except AdmissionUnavailable:
+                return load_failed_response()
+            finally:
+                if ticket is not None:
+                    ticket.cancel()
+
+            if response.get("session_error"):
                 return jsonify({
-                    "error": "模型正在加载中，请稍后再试...",
-                    "loading": True
-                }), 503
-
-            max_new_tokens = min(data.get('max_new_tokens', 1024), 4096)
-            temperature = max(0.1, min(data.get('temperature', 0.7), 2.0))
-            enable_thinking = data.get('enable_thinking', True)
-
-            response = chatbot.generate_response(
-                user_message,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                enable_thinking=enable_thinking
-            )
+                    "error": response["content"],
+                    "session_expired": response["session_error"] == 'not_found'
+                }), SESSION_ERROR_STATUS.get(response["session_error"], 400)
+            if response.get("context_overflow"):
+                return jsonify({"error": response["content"], "context_overflow": True}), 413
+
+            if SecurityConfig.SECURITY_SCAN_OUTPUT:
+                match = (security_scanner.scan(response["content"])
+                         or security_scanner.scan(response.get("thinking")))
+                if match:
+                    blocked = blocked_output(match, 'chat')
+                    return jsonify({
+                        "message": "",
+                        "thinking": None,
+                        "success": False,
+                        "blocked": True,
+                        "error": blocked["error"],
+                        "rule": blocked["rule"],
+                        "timestamp": datetime.now().isoformat()
+                    })
 
             return jsonify({
                 "message": response["content"],
                 "thinking": response.get("thinking"),
                 "success": response["success"],
+                "cached": response.get("cached", False),
+                "session_id": response.get("session_id"),
+                "queue": queue_info(ticket),
                 "timestamp": datetime.now().isoformat()
             })
 
@@ -89,6 +317,150 @@ def create_app():
             logger.error(f"处理聊天请求时发生错误: {str(e)}")
             return jsonify({"error": f"服务器错误: {str(e)}"}), 500
 
+    @app.route('/api/chat/stream', methods=['POST'])
+    def chat_stream():
+        """流式聊天API端点（Server-Sent Events）"""
+        try:
+            params, error_response = parse_chat_request()
+            if error_response:
+                return error_response
+
+            ticket, error_response = admit_chat_request(params)
+            if error_response:
+                return error_response
+
+            def event_stream():
+                # 回答和思考过程分别增量扫描；两者在页面上都会按HTML插入
+                output_scans = {
+                    'answer': security_scanner.stream(SecurityConfig.SECURITY_STREAM_WINDOW),
+                    'thinking': security_scanner.stream(SecurityConfig.SECURITY_STREAM_WINDOW)
+                } if SecurityConfig.SECURITY_SCAN_OUTPUT else None
+                generating = False
+                events = None
+                try:
+                    if ticket is not None:
+                        # 排队期间定期推送位置和预计等待时间
+                        deadline = time.monotonic() + AdmissionConfig.QUEUE_TIMEOUT
+                        while not ticket.wait(AdmissionConfig.QUEUE_UPDATE_INTERVAL):
+                            if time.monotonic() >= deadline:
+                                admission.timed_out(ticket)
+                                yield format_sse('error', {
+                                    'type': 'error',
+                                    'content': '排队等待超时，请稍后再试',
+                                    'success': False,
+                                    'retry_after': admission.retry_after(),
+                                    'timestamp': datetime.now().isoformat()
+                                })
+                                return
+                            yield format_sse('queued', {
+                                'type': 'queued',
+                                'position': ticket.position(),
+                                'estimated_wait': ticket.estimated_wait(),
+                                'waited_seconds': round(ticket.waited_seconds, 1),
+                                'loading': not chatbot.is_ready()
+                            })
+
+                    _ACTIVE_CHATS.inc()
+                    generating = True
+                    events = chatbot.stream_response(
+                        params['user_message'],
+                        max_new_tokens=params['max_new_tokens'],
+                        temperature=params['temperature'],
+                        enable_thinking=params['enable_thinking'],
+                        use_cache=params['use_cache'],
+                        semantic_cache=params['use_cache'],
+                        session_id=params['session_id']
+                    )
+                    for event in events:
+                        if output_scans is not None:
+                            match = scan_stream_event(output_scans, event)
+                            if match:
+                                blocked = blocked_output(match, 'chat_stream')
+                                # 客户端收到error事件后会移除已显示的部分回复
+                                yield format_sse('error', {
+                                    'type': 'error',
+                                    'content': blocked['error'],
+                                    'rule': blocked['rule'],
+                                    'blocked': True,
+                                    'success': False,
+                                    'timestamp': datetime.now().isoformat()
+                                })
+                                return
+                        if event['type'] in ('done', 'error'):
+                            event['timestamp'] = datetime.now().isoformat()
+                        if event.get('session_error'):
+                            event['session_expired'] = event['session_error'] == 'not_found'
+                        if event['type'] == 'done' and ticket is not None:
+                            event['queue'] = queue_info(ticket)
+                        yield format_sse(event['type'], event)
+                except AdmissionUnavailable:
+                    yield format_sse('error', {
+                        'type': 'error',
+                        'content': f'模型加载失败: {chatbot.load_error}',
+                        'load_error': True,
+                        'success': False,
+                        'timestamp': datetime.now().isoformat()
+                    })
+                finally:
+                    # 输出被拦截或客户端断开时关闭生成器，取消模型端仍在进行的生成
+                    if events is not None:
+                        events.close()
+                    if generating:
+                        _ACTIVE_CHATS.dec()
+                    if ticket is not None:
+                        ticket.cancel()
+
+            response = Response(
+                stream_with_context(event_stream()),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            if ticket is not None:
+                # 客户端在流开始前断开时生成器不会执行，需在响应关闭时移出队列
+                response.call_on_close(ticket.cancel)
+            return response
+
+        except Exception as e:
+            logger.error(f"处理流式聊天请求时发生错误: {str(e)}")
+            return jsonify({"error": f"服务器错误: {str(e)}"}), 500
+
+    @app.route('/api/chat/session', methods=['POST'])
+    def create_chat_session():
+        """新建多轮对话会话；之后的聊天请求带上 session_id 即可接续对话"""
+        try:
+            if not chatbot.is_ready():
+                return jsonify({"error": "模型正在加载中，请稍后再试...", "loading": True}), 503
+            return jsonify(chatbot.create_session()), 201
+
+        except Exception as e:
+            logger.error(f"创建会话失败: {str(e)}")
+            return jsonify({"error": f"创建会话失败: {str(e)}"}), 500
+
+    @app.route('/api/chat/session/<session_id>', methods=['GET'])
+    def get_chat_session(session_id):
+        """获取会话的历史消息"""
+        try:
+            session = chatbot.get_session(session_id) if SESSION_ID_PATTERN.fullmatch(session_id) else None
+            if session is None:
+                return jsonify({"error": "会话不存在或已过期", "session_expired": True}), 404
+            return jsonify(session)
+
+        except Exception as e:
+            logger.error(f"获取会话失败: {str(e)}")
+            return jsonify({"error": f"获取会话失败: {str(e)}"}), 500
+
+    @app.route('/api/chat/session/<session_id>', methods=['DELETE'])
+    def delete_chat_session(session_id):
+        """结束会话，释放其历史和KV缓存"""
+        try:
+            if not SESSION_ID_PATTERN.fullmatch(session_id) or not chatbot.delete_session(session_id):
+                return jsonify({"error": "会话不存在或已过期"}), 404
+            return jsonify({"success": True})
+
+        except Exception as e:
+            logger.error(f"删除会话失败: {str(e)}")
+            return jsonify({"error": f"删除会话失败: {str(e)}"}), 500
+
     @app.route('/api/report/generate', methods=['POST'])
     def generate_report():
         """生成报告API"""
@@ -104,12 +476,12 @@ def create_app():
             if not topic:
                 return jsonify({"error": "报告主题不能为空"}), 400
 
-            topic_error = validate_input(topic, max_length=200)
+            topic_error = validate_input(topic, max_length=200, scanner=security_scanner)
             if topic_error:
                 return jsonify({"error": f"主题{topic_error}"}), 400
 
             if requirements:
-                req_error = validate_input(requirements, max_length=2000)
+                req_error = validate_input(requirements, max_length=2000, scanner=security_scanner)
                 if req_error:
                     return jsonify({"error": f"要求{req_error}"}), 400
 
@@ -124,7 +496,7 @@ def create_app():
 
             generation_thread = threading.Thread(
                 target=generate_report_async,
-                args=(report_id, topic, requirements, chatbot, report_generator),
+                args=(report_id, topic, requirements, chatbot, report_generator, admission),
                 daemon=True
             )
             generation_thread.start()
@@ -148,22 +520,79 @@ def create_app():
             if not report_status:
                 return jsonify({"error": "报告不存在"}), 404
 
-            return jsonify({
-                "report_id": report_id,
-                "status": report_status['status'],
-                "progress": report_status['progress'],
-                "outline": report_status.get('outline'),
-                "error": report_status.get('error'),
-                "sections_completed": len(report_status.get('sections', {})),
-                "total_sections": len(report_status.get('outline', {}).get('sections', [])) if report_status.get(
-                    'outline') else 0,
-                "created_at": report_status.get('created_at').isoformat() if report_status.get('created_at') else None
-            })
+            return jsonify(build_report_status_payload(report_id, report_status))
 
         except Exception as e:
             logger.error(f"获取报告状态失败: {str(e)}")
             return jsonify({"error": f"获取状态失败: {str(e)}"}), 500
 
+    @app.route('/api/report/events/<report_id>', methods=['GET'])
+    def report_events(report_id):
+        """推送报告生成事件（Server-Sent Events）
+
+        连接建立后先发送一次 snapshot（完整状态），之后推送 progress / section 事件，
+        报告完成或失败时发送 completed / failed（附完整状态）并结束。
+        """
+        if not report_generator.get_report_status(report_id):
+            return jsonify({"error": "报告不存在"}), 404
+
+        # 先订阅再取快照，避免两者之间的事件丢失
+        subscription = report_generator.subscribe(report_id)
+
+        def event_stream():
+            try:
+                report_status = report_generator.get_report_status(report_id)
+                if not report_status:
+                    return
+                snapshot = build_report_status_payload(report_id, report_status)
+                yield format_sse('snapshot', snapshot)
+                if snapshot['status'] in ('completed', 'error'):
+                    return
+
+                # 报告可能由其他工作进程生成，本进程收不到事件时按存储中的版本号轮询
+                last_version = report_status.get('version')
+                last_sent = time.monotonic()
+                while True:
+                    try:
+                        event_type, data = subscription.get(timeout=ReportConfig.EVENT_STORE_POLL_INTERVAL)
+                    except queue.Empty:
+                        version, status = report_generator.store.get_version(report_id)
+                        if version is None:
+                            yield format_sse('failed', {'status': 'error', 'error': '报告不存在'})
+                            return
+                        if version != last_version:
+                            last_version = version
+                            report_status = report_generator.get_report_status(report_id)
+                            payload = build_report_status_payload(report_id, report_status)
+                            if status in ('completed', 'error'):
+                                yield format_sse('completed' if status == 'completed' else 'failed', payload)
+                                return
+                            yield format_sse('snapshot', payload)
+                            last_sent = time.monotonic()
+                        elif time.monotonic() - last_sent >= ReportConfig.EVENT_KEEPALIVE_INTERVAL:
+                            yield ": keepalive\n\n"
+                            last_sent = time.monotonic()
+                        continue
+
+                    if event_type in ('completed', 'failed'):
+                        report_status = report_generator.get_report_status(report_id)
+                        if report_status:
+                            data = build_report_status_payload(report_id, report_status)
+                        yield format_sse(event_type, data)
+                        return
+
+                    yield format_sse(event_type, data)
+                    last_version = report_generator.store.get_version(report_id)[0]
+                    last_sent = time.monotonic()
+            finally:
+                report_generator.unsubscribe(report_id, subscription)
+
+        return Response(
+            stream_with_context(event_stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     @app.route('/api/report/summary/<report_id>', methods=['GET'])
     def get_report_summary(report_id):
         """获取报告摘要信息"""
@@ -189,11 +618,32 @@ def create_app():
             logger.error(f"获取报告摘要失败: {str(e)}")
             return jsonify({"error": f"获取摘要失败: {str(e)}"}), 500
 
-    @app.route('/api/report/download/<report_id>/docx', methods=['GET'])
-    def download_report_word(report_id):
-        """下载Word报告"""
+    @app.route('/api/report/trace/<report_id>', methods=['GET'])
+    def get_report_trace(report_id):
+        """报告生成的执行时间线（Chrome trace-event JSON，可在 Perfetto 或 chrome://tracing 中打开）"""
+        try:
+            trace_data = report_generator.get_trace(report_id)
+            if trace_data is None:
+                if report_generator.get_report_status(report_id) is None:
+                    return jsonify({"error": "报告不存在"}), 404
+                return jsonify({"error": "该报告没有执行时间线（未开启追踪，或正在其他工作进程中生成）"}), 404
+
+            response = jsonify(to_chrome_trace(trace_data))
+            if request.args.get('download'):
+                response.headers['Content-Disposition'] = f'attachment; filename="report_{report_id}_trace.json"'
+            return response
+
+        except Exception as e:
+            logger.error(f"获取报告执行时间线失败: {str(e)}")
+            return jsonify({"error": f"获取执行时间线失败: {str(e)}"}), 500
+
+    def send_report_export(report_id, fmt):
+        """发送报告的导出文件
+
+        渲染结果按报告内容摘要缓存，ETag 即该摘要；支持 If-None-Match（304）和 Range（206）。
+        """
         try:
-            logger.info(f"收到下载请求 - Report ID: {report_id}")
+            logger.info(f"收到下载请求 - Report ID: {report_id}, 格式: {fmt}")
 
             report_status = report_generator.get_report_status(report_id)
 
@@ -205,34 +655,91 @@ def create_app():
                 logger.error(f"报告未完成: {report_id}, status: {report_status['status']}")
                 return jsonify({"error": "报告未完成"}), 400
 
-            logger.info(f"报告状态验证通过 - Report ID: {report_id}")
+            artifact = report_generator.export_cache.get_or_render(
+                report_id, fmt, report_status, lambda data: render_report_export(data, fmt)
+            )
 
-            report_generator.increment_download_count(report_id)
+            response = send_file(
+                io.BytesIO(artifact.data),
+                as_attachment=True,
+                download_name=export_filename(report_status, fmt),
+                mimetype=EXPORT_MIMETYPES[fmt],
+                etag=artifact.etag,
+                conditional=True,
+                max_age=0
+            )
 
-            document = create_word_document(report_status)
+            # 304 和续传的分段请求不计入下载次数
+            range_start = request.range.ranges[0][0] if request.range and request.range.ranges else 0
+            if response.status_code == 200 or (response.status_code == 206 and range_start == 0):
+                report_generator.increment_download_count(report_id)
 
-            safe_topic = ''.join(
-                c for c in report_status.get('topic', 'report') if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            safe_topic = safe_topic[:30]  # 限制长度
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"report_{safe_topic}_{timestamp}.docx"
+            return response
 
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp_file:
-                document.save(tmp_file.name)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"下载报告失败 - Report ID: {report_id}, Error: {str(e)}", exc_info=True)
+            return jsonify({"error": f"下载失败: {str(e)}"}), 500
 
-                threading.Timer(10.0, lambda: cleanup_temp_file(tmp_file.name)).start()
+    @app.route('/api/report/download/<report_id>/docx', methods=['GET'])
+    def download_report_word(report_id):
+        """下载Word报告"""
+        return send_report_export(report_id, 'docx')
 
-                return send_file(
-                    tmp_file.name,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                )
+    @app.route('/api/report/download/<report_id>/md', methods=['GET'])
+    def download_report_markdown(report_id):
+        """下载Markdown报告"""
+        return send_report_export(report_id, 'md')
+
+    @app.route('/api/report/export', methods=['GET'])
+    def export_reports():
+        """批量导出报告为ZIP
+
+        查询参数：status（默认 completed，all 表示不限）、start / end（YYYY-MM-DD，按创建日期，含两端）、
+        format（docx / md / all，默认 docx）。归档边渲染边以分块传输输出。
+        """
+        try:
+            status = request.args.get('status', 'completed')
+            if status not in ('completed', 'error', 'all'):
+                return jsonify({"error": "status 只能为 completed、error 或 all"}), 400
+
+            fmt = request.args.get('format', 'docx')
+            if fmt not in ('docx', 'md', 'all'):
+                return jsonify({"error": "format 只能为 docx、md 或 all"}), 400
+            formats = list(EXPORT_MIMETYPES) if fmt == 'all' else [fmt]
+
+            try:
+                start = request.args.get('start')
+                end = request.args.get('end')
+                created_after = datetime.strptime(start, '%Y-%m-%d').timestamp() if start else None
+                created_before = (datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)).timestamp() if end else None
+            except ValueError:
+                return jsonify({"error": "日期格式应为 YYYY-MM-DD"}), 400
+
+            report_ids = report_generator.store.list_ids(
+                status=None if status == 'all' else status,
+                created_after=created_after,
+                created_before=created_before
+            )
+            if not report_ids:
+                return jsonify({"error": "没有符合条件的报告"}), 404
+
+            logger.info(f"批量导出 {len(report_ids)} 份报告，格式: {formats}")
+            archive_name = f"reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+            return Response(
+                stream_with_context(stream_reports_archive(report_generator, report_ids, formats)),
+                mimetype='application/zip',
+                headers={
+                    'Content-Disposition': f'attachment; filename="{archive_name}"',
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
 
         except Exception as e:
-            logger.error(f"下载报告失败 - Report ID: {report_id}, Error: {str(e)}", exc_info=True)
-            return jsonify({"error": f"下载失败: {str(e)}"}), 500
+            logger.error(f"批量导出报告失败: {str(e)}", exc_info=True)
+            return jsonify({"error": f"导出失败: {str(e)}"}), 500
 
     @app.route('/api/report/list', methods=['GET'])
     def list_reports():
@@ -271,15 +778,36 @@ def create_app():
     @app.route('/api/status', methods=['GET'])
     def status():
         """获取服务状态"""
+        model_status = chatbot.get_status(detailed=True)
         return jsonify({
             "status": "ready" if chatbot.is_ready() else "loading",
             "model_name": chatbot.model_name,
             "device": getattr(chatbot, 'device', None),
             "loading": chatbot.is_loading,
+            "load_progress": model_status["load_progress"],
+            "runtime": model_status["runtime"],
+            "scheduler": chatbot.get_scheduler_stats(),
+            "response_cache": chatbot.get_response_cache_stats(),
+            "semantic_cache": chatbot.get_semantic_cache_stats(),
+            "sessions": chatbot.get_session_stats(),
+            "export_cache": report_generator.export_cache.get_stats(),
+            "admission": admission.get_stats() if admission is not None else None,
+            "rate_limit": rate_limiter.get_stats() if rate_limiter is not None else None,
+            "startup": {
+                "app_init": app_init_seconds,
+                "model": chatbot.get_startup_timings()
+            },
             "active_reports": report_generator.get_active_count(),
             "completed_reports": report_generator.get_completed_count()
         })
 
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus 指标；模型在独立进程中运行时，推理侧指标从模型服务获取"""
+        if not LogConfig.METRICS_ENABLED:
+            return jsonify({"error": "API端点不存在"}), 404
+        return Response(REGISTRY.render(SCOPE_APP) + chatbot.get_metrics(), content_type=CONTENT_TYPE)
+
     @app.route('/api/health', methods=['GET'])
     def health():
         """健康检查"""
@@ -298,24 +826,94 @@ def create_app():
         logger.error(f"服务器内部错误: {str(error)}")
         return jsonify({"error": "服务器内部错误"}), 500
 
+    app_init_seconds = round(time.perf_counter() - init_started, 3)
+    logger.info(f"应用初始化完成，耗时 {app_init_seconds}s（模型在后台加载）")
     return app
 
 
-def generate_report_async(report_id, topic, requirements, chatbot, report_generator):
-    """异步生成报告"""
+def register_app_metrics(report_generator, admission):
+    """注册采集时计算的应用侧指标（导出缓存命中、准入队列、报告数）"""
+    def export_cache_requests():
+        stats = report_generator.export_cache.get_stats()
+        return {
+            ('hit',): stats['hits'],
+            ('disk_hit',): stats['disk_hits'],
+            ('miss',): max(0, stats['misses'] - stats['disk_hits'])
+        }
+
+    def admission_queued():
+        if admission is None:
+            return None
+        return {(priority,): count for priority, count in admission.get_stats()['queued'].items()}
+
+    CallbackMetric('chatbot_export_cache_requests_total', '导出缓存查询次数（内存命中、磁盘命中、重新渲染）',
+                   'counter', export_cache_requests, ('result',))
+    CallbackMetric('chatbot_admission_queued_requests', '准入队列中等待的请求数', 'gauge',
+                   admission_queued, ('priority',))
+    CallbackMetric('chatbot_reports_in_progress', '状态为生成中的报告数', 'gauge', report_generator.get_active_count)
+
+
+def run_background(admission, work, func, *args, phase=None):
+    """以后台优先级经准入队列执行推理调用（让位于交互式聊天）；phase 为记录执行耗时（不含排队）的直方图"""
+    if admission is None:
+        return traced_call(phase, func, *args)
+    with admission.submit(work, PRIORITY_BACKGROUND) as ticket:
+        with trace_span('admission_wait', 'queue', work=work):
+            ticket.wait()
+        return traced_call(phase, func, *args)
+
+
+def traced_call(histogram, func, *args):
+    """执行推理调用，记录耗时；在报告时间线中记录token数以及排队、预填充、解码子span"""
+    with trace_span(func.__name__, 'inference') as span:
+        started = time.perf_counter()
+        try:
+            response = func(*args)
+        finally:
+            if histogram is not None:
+                histogram.observe(time.perf_counter() - started)
+        if isinstance(response, dict):
+            record_generation(span, response.get('usage'))
+        return response
+
+
+def generate_report_async(report_id, topic, requirements, chatbot, report_generator, admission=None):
+    """异步生成报告，记录耗时指标和执行时间线"""
+    started = time.perf_counter()
+    _ACTIVE_REPORTS.inc()
+    trace = report_generator.start_trace(report_id)
     try:
-        logger.info(f"开始生成报告 - Report ID: {report_id}")
+        with trace.span('report', topic=topic) if trace is not None else nullcontext():
+            build_report(report_id, topic, requirements, chatbot, report_generator, admission)
+        _REPORT_PHASE.observe(time.perf_counter() - started)
+        REPORTS.labels('completed').inc()
+
+    except Exception as e:
+        logger.error(f"报告生成失败 - Report ID: {report_id}, Error: {str(e)}", exc_info=True)
+        REPORTS.labels('failed').inc()
+        report_generator.update_report_progress(report_id, 'error', error=str(e))
+    finally:
+        _ACTIVE_REPORTS.dec()
+        report_generator.finish_trace(report_id)
+
 
-        logger.info(f"开始生成报告大纲 - Report ID: {report_id}")
-        report_generator.update_report_progress(report_id, 'generating_outline', 10)
+def build_report(report_id, topic, requirements, chatbot, report_generator, admission):
+    """生成大纲和各章节并完成报告，失败时抛出异常"""
+    logger.info(f"开始生成报告 - Report ID: {report_id}")
 
-        outline_response = chatbot.generate_report_outline(topic, requirements)
-        if not outline_response['success']:
-            raise Exception("生成大纲失败")
+    logger.info(f"开始生成报告大纲 - Report ID: {report_id}")
+    report_generator.update_report_progress(report_id, 'generating_outline', 10)
 
+    with trace_span('outline'):
+        outline_response = run_background(
+            admission, estimate_work(topic + requirements, 1500),
+            chatbot.generate_report_outline, topic, requirements, phase=_OUTLINE_PHASE
+        )
+    if not outline_response['success']:
+        raise Exception("生成大纲失败")
+
+    with trace_span('parse_outline', chars=len(outline_response['content'] or '')):
         try:
-            import re
-            import json
             content = outline_response['content']
             json_match = re.search(r'\{.*\}', content, re.DOTALL)
             if json_match:
@@ -326,58 +924,212 @@ def generate_report_async(report_id, topic, requirements, chatbot, report_genera
             logger.error(f"解析大纲失败: {e}")
             raise Exception("大纲格式解析失败")
 
-        if not outline_data.get('sections'):
-            raise Exception("大纲中缺少章节信息")
+    if not outline_data.get('sections'):
+        raise Exception("大纲中缺少章节信息")
 
-        report_generator.update_report_progress(report_id, 'generating_sections', 20, outline=outline_data)
-        logger.info(f"大纲生成完成，共{len(outline_data['sections'])}个章节")
+    report_generator.update_report_progress(report_id, 'generating_sections', 20, outline=outline_data)
+    logger.info(f"大纲生成完成，共{len(outline_data['sections'])}个章节")
 
-        sections = outline_data.get('sections', [])
-        total_sections = len(sections)
+    sections = outline_data.get('sections', [])
+    total_sections = len(sections)
+    context = f"报告主题：{topic}\n报告要求：{requirements}"
 
-        for i, section in enumerate(sections):
-            logger.info(f"生成章节 {i + 1}/{total_sections} - {section.get('title', '')}")
-
-            progress = 20 + int((i / total_sections) * 60)
-            report_generator.update_report_progress(
-                report_id,
-                'generating_sections',
-                progress,
-                sections_completed=i,
-                total_sections=total_sections
-            )
-
-            section_response = chatbot.generate_section_content(
+    def generate_section(section):
+        with trace_span('section', section_id=section.get('id'), title=section.get('title', '')):
+            return run_background(
+                admission,
+                estimate_work(section.get('title', '') + section.get('description', '') + context, 2000),
+                chatbot.generate_section_content,
                 section.get('title', ''),
                 section.get('description', ''),
-                f"报告主题：{topic}\n报告要求：{requirements}"
+                context,
+                phase=_SECTION_PHASE
             )
 
-            if section_response['success']:
-                report_generator.add_section_content(report_id, section['id'], {
-                    'title': section['title'],
-                    'content': section_response['content'],
-                    'generated_at': datetime.now().isoformat()
-                })
-                logger.info(f"章节 {i + 1} 生成完成")
-            else:
-                logger.error(f"生成章节内容失败: {section.get('title', '')}")
-                report_generator.add_section_content(report_id, section['id'], {
-                    'title': section.get('title', ''),
-                    'content': f"本章节内容生成时遇到技术问题，建议手动补充关于\"{section.get('title', '')}\"的相关内容。",
-                    'generated_at': datetime.now().isoformat(),
-                    'error': True
-                })
+    # 各章节同时提交给推理调度器，由其合并为动态批次；并发数限制单个报告占用的批次位置
+    max_workers = max(1, min(ReportConfig.SECTION_CONCURRENCY, total_sections))
+    with trace_span('sections', total=total_sections), \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"report-{report_id[:8]}") as executor:
+        futures = {}
+        for section in sections:
+            logger.info(f"提交章节生成 - {section.get('title', '')}")
+            # 每个任务复制一份上下文，使章节的 span 记入当前报告的时间线
+            future = executor.submit(contextvars.copy_context().run, generate_section, section)
+            futures[future] = section
+
+        for completed, future in enumerate(as_completed(futures), start=1):
+            section = futures[future]
+            try:
+                section_response = future.result()
+            except Exception as e:
+                logger.error(f"生成章节内容异常: {section.get('title', '')}, Error: {e}")
+                section_response = {'success': False}
+
+            with trace_span('save_section', section_id=section.get('id')):
+                if section_response['success']:
+                    report_generator.add_section_content(report_id, section['id'], {
+                        'title': section['title'],
+                        'content': section_response['content'],
+                        'generated_at': datetime.now().isoformat()
+                    })
+                    logger.info(f"章节生成完成 ({completed}/{total_sections}) - {section.get('title', '')}")
+                else:
+                    logger.error(f"生成章节内容失败: {section.get('title', '')}")
+                    report_generator.add_section_content(report_id, section['id'], {
+                        'title': section.get('title', ''),
+                        'content': f"本章节内容生成时遇到技术问题，建议手动补充关于\"{section.get('title', '')}\"的相关内容。",
+                        'generated_at': datetime.now().isoformat(),
+                        'error': True
+                    })
 
-        logger.info(f"完成报告生成 - Report ID: {report_id}")
-        report_generator.update_report_progress(report_id, 'finalizing', 90)
+                report_generator.update_report_progress(
+                    report_id,
+                    'generating_sections',
+                    20 + int((completed / total_sections) * 60),
+                    sections_completed=completed,
+                    total_sections=total_sections
+                )
 
+    logger.info(f"完成报告生成 - Report ID: {report_id}")
+    report_generator.update_report_progress(report_id, 'finalizing', 90)
+
+    with trace_span('complete_report'):
         report_generator.complete_report(report_id)
-        logger.info(f"报告生成完成 - Report ID: {report_id}")
+    logger.info(f"报告生成完成 - Report ID: {report_id}")
+
+
+EXPORT_MIMETYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'md': 'text/markdown; charset=utf-8'
+}
+
+
+def render_report_export(report_data, fmt):
+    """渲染报告导出文件的字节内容；生成时间取报告完成时间，使同一内容的渲染结果保持一致"""
+    generated_at = report_data.get('completed_at')
+    if fmt == 'md':
+        return create_markdown_document(report_data, generated_at=generated_at).encode('utf-8')
+    return render_word_document(
+        report_data,
+        generated_at=generated_at,
+        streaming_sections=ReportConfig.DOCX_STREAMING_SECTIONS
+    )
+
+
+def export_filename(report_data, fmt, timestamp=None):
+    """导出文件名"""
+    safe_topic = ''.join(
+        c for c in report_data.get('topic', 'report') if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    safe_topic = safe_topic[:30]  # 限制长度
+    timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"report_{safe_topic}_{timestamp}.{fmt}"
+
+
+def stream_reports_archive(report_generator, report_ids, formats):
+    """逐份渲染报告并写入流式ZIP，按块产出归档数据
+
+    渲染在线程池中进行，同时最多有 EXPORT_WORKERS * 2 份报告在渲染或等待写入，
+    内存占用与报告总数无关。客户端断开时取消尚未开始的渲染。
+    """
+    workers = max(1, ReportConfig.EXPORT_WORKERS)
+    archive = ZipStream()
+    manifest = {'exported': [], 'failed': []}
+
+    def render(report_id):
+        report_data = report_generator.get_report_status(report_id)
+        if not report_data:
+            return report_id, None, []
+        files = []
+        for fmt in formats:
+            artifact = report_generator.export_cache.get_or_render(
+                report_id, fmt, report_data, lambda data: render_report_export(data, fmt), store=False
+            )
+            files.append((fmt, artifact.data))
+        return report_id, report_data, files
 
-    except Exception as e:
-        logger.error(f"报告生成失败 - Report ID: {report_id}, Error: {str(e)}", exc_info=True)
-        report_generator.update_report_progress(report_id, 'error', error=str(e))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-export')
+    try:
+        pending = deque()
+        remaining = iter(report_ids)
+        for report_id in remaining:
+            pending.append((report_id, executor.submit(render, report_id)))
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            report_id, future = pending.popleft()
+            next_id = next(remaining, None)
+            if next_id is not None:
+                pending.append((next_id, executor.submit(render, next_id)))
+
+            try:
+                report_id, report_data, files = future.result()
+            except Exception as e:
+                logger.error(f"导出报告失败 - Report ID: {report_id}, Error: {e}")
+                manifest['failed'].append({'id': report_id, 'error': str(e)})
+                continue
+            if report_data is None:
+                continue
+
+            created_at = report_data.get('created_at') or datetime.now()
+            folder = created_at.strftime('%Y-%m-%d')
+            for fmt, data in files:
+                name = export_filename(report_data, fmt, timestamp=report_id[:8])
+                archive.add(f"{folder}/{name}", data, date_time=created_at.timetuple()[:6])
+            manifest['exported'].append({
+                'id': report_id,
+                'topic': report_data.get('topic'),
+                'status': report_data.get('status'),
+                'created_at': created_at.isoformat()
+            })
+            yield archive.drain()
+
+        archive.add('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        yield archive.close()
+        logger.info(f"批量导出完成：{len(manifest['exported'])} 份成功，{len(manifest['failed'])} 份失败")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def build_report_status_payload(report_id, report_status):
+    """构造报告状态响应数据"""
+    return {
+        "report_id": report_id,
+        "status": report_status['status'],
+        "progress": report_status['progress'],
+        "outline": report_status.get('outline'),
+        "error": report_status.get('error'),
+        "sections_completed": len(report_status.get('sections', {})),
+        "completed_section_ids": list(report_status.get('sections', {}).keys()),
+        "total_sections": len(report_status.get('outline', {}).get('sections', [])) if report_status.get(
+            'outline') else 0,
+        "created_at": report_status.get('created_at').isoformat() if report_status.get('created_at') else None
+    }
+
+
+def format_sse(event_type, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def scan_stream_event(output_scans, event):
+    """增量扫描一条流式事件，返回第一处命中
+
+    answer / thinking 事件的文本送入对应的增量扫描器。done 事件中未经流式输出的部分
+    （如缓存命中时直接返回的完整回复），以及超过扫描窗口、可能有跨窗口匹配未被发现的部分，整体再扫描一次。
+    """
+    if event['type'] in output_scans:
+        found = output_scans[event['type']].feed(event.get('text'))
+        return found[0] if found else None
+
+    if event['type'] == 'done':
+        for field, stream_type in (('content', 'answer'), ('thinking', 'thinking')):
+            stream_scan = output_scans[stream_type]
+            if stream_scan.total_chars == 0 or stream_scan.total_chars > stream_scan.window:
+                match = stream_scan.scanner.scan(event.get(field))
+                if match:
+                    return match
+    return None
 
 
 def setup_cleanup_scheduler(report_generator):
@@ -397,16 +1149,6 @@ def setup_cleanup_scheduler(report_generator):
     logger.info("启动定期清理任务")
 
 
-def cleanup_temp_file(file_path):
-    """清理临时文件"""
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"临时文件已清理: {file_path}")
-    except Exception as e:
-        logger.warning(f"清理临时文件失败: {e}")
-
-
 if __name__ == '__main__':
     print("=== CUFE经济学大模型聊天应用 ===")
     print("正在启动服务器...")
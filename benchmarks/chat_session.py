@@ -0,0 +1,101 @@
+"""
+多轮对话基准：比较保留会话KV缓存与每轮重新预填充完整对话时各轮的预填充耗时
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/chat_session.py --turns 8 --tokens 128
+
+先通过会话接口进行多轮对话，记录每轮的提示词token数、复用的token数和预填充耗时；
+再用相同的各轮提示词（由记录下的会话历史渲染）不带会话重新提交，作为每轮完整预填充的对照。
+模型路径等沿用 MODEL_PATH / DEVICE 等环境变量。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "请简要解释通货膨胀对居民消费和储蓄行为的影响。",
+    "这种影响在不同收入群体之间有什么差异？",
+    "央行通常用哪些政策工具应对？",
+    "提高利率的副作用有哪些？",
+    "能结合近年的实际情况举个例子吗？",
+    "如果同时出现经济下行，政策应如何权衡？",
+    "财政政策在其中可以发挥什么作用？",
+    "请把以上讨论总结成三点。"
+]
+
+
+def prefill_ms(usage):
+    return round((usage['first_token_at'] - usage['started_at']) * 1000, 2)
+
+
+def run(turns, tokens, enable_thinking):
+    sys.path.insert(0, ROOT_DIR)
+    from models.chatbot import QwenChatBot
+
+    chatbot = QwenChatBot()
+    chatbot.load_thread.join()
+    if not chatbot.is_ready():
+        raise SystemExit(f"模型加载失败: {chatbot.load_error}")
+
+    session_id = chatbot.create_session()['session_id']
+    rounds = []
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        history = chatbot.sessions.get(session_id).history()
+        response = chatbot.generate_response(
+            question, max_new_tokens=tokens, enable_thinking=enable_thinking, session_id=session_id
+        )
+        if not response['success']:
+            raise SystemExit(f"第 {turn + 1} 轮生成失败: {response['content']}")
+        rounds.append({'question': question, 'history': history, 'session': response['usage']})
+
+    # 对照：相同的提示词不带会话提交，每轮都完整预填充
+    for item in rounds:
+        input_ids, _ = chatbot._prepare_generation(item['question'], enable_thinking, history=item['history'])
+        request = chatbot.scheduler.submit(input_ids, 1, 0.7)
+        request.result()
+        item['full'] = request.usage()
+
+    chatbot.cleanup()
+    return [
+        {
+            'turn': index + 1,
+            'prompt_tokens': item['session']['prompt_tokens'],
+            'cached_tokens': item['session']['cached_tokens'],
+            'session_prefill_ms': prefill_ms(item['session']),
+            'full_prefill_ms': prefill_ms(item['full'])
+        }
+        for index, item in enumerate(rounds)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多轮对话会话KV缓存性能对比')
+    parser.add_argument('--turns', type=int, default=8, help='对话轮数')
+    parser.add_argument('--tokens', type=int, default=128, help='每轮最多生成的token数')
+    parser.add_argument('--thinking', action='store_true', help='开启思维模式')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = run(args.turns, args.tokens, args.thinking)
+
+    print(f"{'轮次':<6}{'提示词tokens':>14}{'复用tokens':>12}{'会话预填充(ms)':>16}{'完整预填充(ms)':>16}")
+    for result in results:
+        print(f"{result['turn']:<6}{result['prompt_tokens']:>14}{result['cached_tokens']:>12}"
+              f"{result['session_prefill_ms']:>16}{result['full_prefill_ms']:>16}")
+    print(f"总耗时 {time.perf_counter() - started:.1f}s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+CPU推理性能基准：比较 fp32 / bf16 / int8 模式下的生成速度
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/cpu_inference.py --modes fp32,bf16,int8 --tokens 64 --batch 1,4
+
+每种模式在独立子进程中运行（线程数等设置每个进程只能设置一次），
+线程数与核心绑定沿用 CPU_THREADS / CPU_INTEROP_THREADS / CPU_AFFINITY 环境变量。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPT = "请简要解释通货膨胀对居民消费和储蓄行为的影响。"
+
+
+def run_single(mode, tokens, batch_sizes, rounds):
+    """在当前进程中加载模型并测量各批大小下的生成速度"""
+    sys.path.insert(0, ROOT_DIR)
+    from models.chatbot import QwenChatBot
+
+    started = time.perf_counter()
+    chatbot = QwenChatBot()
+    chatbot.load_thread.join()
+    if not chatbot.is_ready():
+        return {'mode': mode, 'error': chatbot.load_error}
+    load_seconds = time.perf_counter() - started
+
+    input_ids, _ = chatbot._prepare_generation(PROMPT, enable_thinking=False)
+    results = []
+    for batch_size in batch_sizes:
+        generated, elapsed, first_token = 0, 0.0, []
+        for _ in range(rounds):
+            requests = []
+            round_started = time.perf_counter()
+            for _ in range(batch_size):
+                requests.append(chatbot.scheduler.submit(input_ids, tokens, 0.7, stream=True))
+
+            def wait_first(request):
+                for _ in request.iter_tokens():
+                    first_token.append(time.perf_counter() - round_started)
+                    break
+
+            waiters = [threading.Thread(target=wait_first, args=(request,)) for request in requests]
+            for waiter in waiters:
+                waiter.start()
+            outputs = [request.result() for request in requests]
+            elapsed += time.perf_counter() - round_started
+            generated += sum(len(output) for output in outputs)
+            for waiter in waiters:
+                waiter.join()
+
+        results.append({
+            'batch_size': batch_size,
+            'generated_tokens': generated,
+            'tokens_per_second': round(generated / elapsed, 2) if elapsed else 0.0,
+            'avg_ttft_ms': round(sum(first_token) / len(first_token) * 1000, 1) if first_token else None
+        })
+
+    runtime = chatbot.get_status(detailed=True)['runtime']
+    dtype = str(next(chatbot.model.parameters()).dtype)
+    chatbot.cleanup()
+    return {
+        'mode': mode,
+        'load_seconds': round(load_seconds, 2),
+        'dtype': dtype,
+        'runtime': runtime,
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU推理模式性能对比')
+    parser.add_argument('--modes', default='fp32,bf16,int8', help='逗号分隔的精度模式')
+    parser.add_argument('--tokens', type=int, default=64, help='每个请求生成的token数')
+    parser.add_argument('--batch', default='1,4', help='逗号分隔的并发请求数')
+    parser.add_argument('--rounds', type=int, default=3, help='每个批大小重复的轮数')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    parser.add_argument('--single', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch.split(',') if size]
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.tokens, batch_sizes, args.rounds), ensure_ascii=False))
+        return
+
+    reports = []
+    for mode in [mode.strip() for mode in args.modes.split(',') if mode.strip()]:
+        env = dict(os.environ, DEVICE='cpu', CPU_PRECISION=mode, CHECKPOINT_CACHE_DIR='')
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', mode, '--tokens', str(args.tokens),
+             '--batch', args.batch, '--rounds', str(args.rounds)],
+            env=env, capture_output=True, text=True
+        )
+        lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+        if completed.returncode != 0 or not lines:
+            reports.append({'mode': mode, 'error': completed.stderr.strip().splitlines()[-1:]})
+        else:
+            reports.append(json.loads(lines[-1]))
+
+    print(f"{'模式':<8}{'批大小':>8}{'tokens/s':>12}{'TTFT(ms)':>12}{'加载(s)':>10}")
+    for report in reports:
+        if 'error' in report:
+            print(f"{report['mode']:<8} 失败: {report['error']}")
+            continue
+        for result in report['results']:
+            print(f"{report['mode']:<8}{result['batch_size']:>8}{result['tokens_per_second']:>12}"
+                  f"{str(result['avg_ttft_ms']):>12}{report['load_seconds']:>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
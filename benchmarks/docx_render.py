@@ -0,0 +1,184 @@
+"""
+Word导出性能基准：比较逐run设置字体的旧实现与基于样式的渲染
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/docx_render.py --sections 10,50,200 --rounds 3
+
+对每种章节数分别测量：旧实现（逐run设置字体）、样式渲染（python-docx）、样式渲染（直接流式写入XML）
+的平均耗时、生成的文件大小以及未压缩的 document.xml 大小。
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utils.document_utils import build_report_blocks, clean_text_for_word, set_font_style  # noqa: E402
+from utils.docx_renderer import build_document, get_template, write_document  # noqa: E402
+
+PARAGRAPH = ("通货膨胀会通过实际购买力和预期两个渠道影响居民行为。「实际利率下降」时储蓄意愿减弱，"
+             "消费可能提前；而当通胀预期不稳定时，居民往往增加预防性储蓄。")
+
+
+def make_report(num_sections, paragraphs_per_section=6):
+    """构造指定章节数的示例报告"""
+    outline = {
+        'title': '通货膨胀对居民消费与储蓄的影响',
+        'abstract': '本报告从理论与实证两方面分析通货膨胀对居民消费和储蓄行为的影响。',
+        'sections': [{'id': i, 'title': f'第{i}部分', 'description': ''} for i in range(1, num_sections + 1)]
+    }
+    sections = {
+        i: {'title': f'第{i}部分', 'content': '\n\n'.join([PARAGRAPH] * paragraphs_per_section)}
+        for i in range(1, num_sections + 1)
+    }
+    return {'id': 'benchmark', 'topic': '通货膨胀', 'outline': outline, 'sections': sections}
+
+
+def legacy_render(report_data, generated_at):
+    """旧实现：每个run单独设置字体、字号、加粗和东亚字体"""
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    doc = Document()
+    outline = report_data['outline']
+    sections = report_data.get('sections', {})
+
+    style = doc.styles['Normal']
+    style.font.name = 'SimSun'
+    style.font.size = Pt(12)
+
+    title = doc.add_heading(outline.get('title') or '经济学报告', 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    for run in title.runs:
+        set_font_style(run, "SimSun", 18, bold=True)
+
+    info_para = doc.add_paragraph()
+    info_run = info_para.add_run(f"生成时间：{generated_at.strftime('%Y年%m月%d日 %H:%M')}")
+    set_font_style(info_run, "SimSun", 10)
+    info_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+
+    table = doc.add_table(rows=3, cols=2)
+    table.style = 'Table Grid'
+    for i, row_data in enumerate([('报告主题', report_data.get('topic', '未指定')),
+                                  ('章节数量', str(len(sections))),
+                                  ('生成系统', 'CUFE经济学大模型')]):
+        for j, cell_data in enumerate(row_data):
+            cell = table.cell(i, j)
+            cell.text = cell_data
+            for paragraph in cell.paragraphs:
+                for run in paragraph.runs:
+                    set_font_style(run, "SimSun", 11, bold=(i == 0))
+    doc.add_paragraph()
+
+    heading = doc.add_heading('摘要', level=1)
+    for run in heading.runs:
+        set_font_style(run, "SimSun", 16, bold=True)
+    set_font_style(doc.add_paragraph().add_run(clean_text_for_word(outline['abstract'])), "SimSun", 12)
+
+    heading = doc.add_heading('目录', level=1)
+    for run in heading.runs:
+        set_font_style(run, "SimSun", 16, bold=True)
+    for section in outline['sections']:
+        for run in doc.add_paragraph(f"{section['id']}. {section['title']}").runs:
+            set_font_style(run, "SimSun", 12)
+    doc.add_page_break()
+
+    for section in outline['sections']:
+        heading = doc.add_heading(f"{section['id']}. {section['title']}", level=1)
+        for run in heading.runs:
+            set_font_style(run, "SimSun", 16, bold=True)
+        content = clean_text_for_word(sections[section['id']]['content'])
+        for para_text in content.split('\n\n'):
+            paragraph = doc.add_paragraph()
+            for i, part in enumerate(re.split(r'[「」]', para_text)):
+                if part:
+                    set_font_style(paragraph.add_run(part), "SimSun", 12, bold=(i % 2 == 1))
+
+    doc.add_page_break()
+    heading = doc.add_heading('生成信息', level=1)
+    for run in heading.runs:
+        set_font_style(run, "SimSun", 16, bold=True)
+    footer = doc.add_paragraph()
+    set_font_style(footer.add_run(f"本报告由CUFE经济学大模型自动生成\n报告ID：{report_data['id']}"), "SimSun", 10)
+    footer.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def styled_render(report_data, generated_at):
+    buffer = io.BytesIO()
+    build_document(build_report_blocks(report_data, generated_at)).save(buffer)
+    return buffer.getvalue()
+
+
+def streaming_render(report_data, generated_at):
+    buffer = io.BytesIO()
+    write_document(build_report_blocks(report_data, generated_at), buffer)
+    return buffer.getvalue()
+
+
+RENDERERS = [('legacy', legacy_render), ('styled', styled_render), ('streaming', streaming_render)]
+
+
+def measure(render, report_data, rounds):
+    generated_at = datetime.now()
+    render(report_data, generated_at)  # 预热（导入python-docx、构建模板）
+    elapsed = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        data = render(report_data, generated_at)
+        elapsed.append(time.perf_counter() - started)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        document_xml_bytes = archive.getinfo('word/document.xml').file_size
+    return {
+        'avg_ms': round(sum(elapsed) / len(elapsed) * 1000, 1),
+        'bytes': len(data),
+        'document_xml_bytes': document_xml_bytes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Word导出渲染性能对比')
+    parser.add_argument('--sections', default='10,50,200', help='逗号分隔的章节数')
+    parser.add_argument('--rounds', type=int, default=3, help='每种配置重复的次数')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    get_template()
+    results = []
+    for num_sections in [int(n) for n in args.sections.split(',') if n]:
+        report_data = make_report(num_sections)
+        for name, render in RENDERERS:
+            result = measure(render, report_data, args.rounds)
+            result.update({'sections': num_sections, 'renderer': name})
+            results.append(result)
+
+    print(f"{'章节数':<8}{'渲染方式':<12}{'耗时(ms)':>12}{'大小(KB)':>12}{'document.xml(KB)':>18}{'加速比':>10}")
+    baseline = {}
+    for result in results:
+        if result['renderer'] == 'legacy':
+            baseline[result['sections']] = result['avg_ms']
+        speedup = baseline[result['sections']] / result['avg_ms'] if result['avg_ms'] else 0.0
+        result['speedup'] = round(speedup, 2)
+        print(f"{result['sections']:<8}{result['renderer']:<12}{result['avg_ms']:>12}"
+              f"{result['bytes'] / 1024:>12.1f}{result['document_xml_bytes'] / 1024:>18.1f}{speedup:>10.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
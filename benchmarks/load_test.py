@@ -0,0 +1,643 @@
+"""
+服务负载测试
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/load_test.py --scenarios chat,chat_stream,report --concurrency 1,8,32 --requests 64
+    python benchmarks/load_test.py --backend tiny --model-path /tmp/tiny-qwen --build-tiny-model
+    python benchmarks/load_test.py --compare results/before.json --output results/after.json
+
+在子进程中启动完整的 Flask 应用（默认关闭限流，准入控制、缓存、导出等环节照常工作），模型可以是：
+- stub：确定性的假 QwenChatBot，按 --token-latency-ms 逐token耗时，--stub-slots 限制同时生成的请求数
+  （近似推理调度器的批大小），不需要模型和GPU；
+- tiny：真实的 QwenChatBot 加载随机权重的小模型，在CPU上运行（--build-tiny-model 可生成该模型）；
+  随机权重生成不出合法的大纲JSON，报告场景会全部计为错误，只适合测聊天场景。
+各并发级别分别统计 p50/p95/p99 延迟、吞吐量、错误率，以及服务进程的CPU和内存占用，结果保存为JSON，
+附带当前 git 提交，便于比较不同提交的表现。
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ('chat', 'chat_stream', 'report')
+
+STUB_TEXT = ("通货膨胀会通过实际购买力和通胀预期两个渠道影响居民行为。当实际利率下降时储蓄意愿减弱，消费可能提前；"
+             "而当通胀预期不稳定时，居民往往增加预防性储蓄。")
+
+
+# ---- 假模型 ----
+
+class StubChatBot:
+    """确定性的假 QwenChatBot：相同参数总是返回相同文本，耗时 = 预填充耗时 + token数 × 每token耗时"""
+
+    def __init__(self, token_latency_ms=5.0, prefill_ms=20.0, slots=8, answer_tokens=64, sections=4,
+                 section_tokens=128):
+        self.model_name = 'stub'
+        self.device = 'cpu'
+        self.is_loading = False
+        self.token_latency = token_latency_ms / 1000.0
+        self.prefill = prefill_ms / 1000.0
+        self.answer_tokens = answer_tokens
+        self.sections = sections
+        self.section_tokens = section_tokens
+        self._slots = threading.BoundedSemaphore(slots)
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+
+    def is_ready(self):
+        return True
+
+    def get_status(self, detailed=False):
+        if detailed:
+            return {'status': 'ready', 'load_progress': None, 'runtime': {'backend': 'stub', 'device': 'cpu'}}
+        return 'ready'
+
+    @staticmethod
+    def _text(tokens):
+        return (STUB_TEXT * (tokens // len(STUB_TEXT) + 1))[:tokens]
+
+    def _generate(self, tokens, stream=False):
+        """占用一个生成槽位，依次产出每个token"""
+        with self._slots:
+            time.sleep(self.prefill)
+            text = self._text(tokens)
+            for char in text:
+                time.sleep(self.token_latency)
+                if stream:
+                    yield char
+            with self._stats_lock:
+                self.requests += 1
+                self.tokens += tokens
+            if not stream:
+                yield text
+
+    def generate_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                          **kwargs):
+        tokens = min(self.answer_tokens, max_new_tokens or self.answer_tokens)
+        content = ''.join(self._generate(tokens))
+        return {'content': content, 'thinking': None, 'success': True}
+
+    def stream_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                        **kwargs):
+        tokens = min(self.answer_tokens, max_new_tokens or self.answer_tokens)
+        for char in self._generate(tokens, stream=True):
+            yield {'type': 'answer', 'text': char}
+        yield {'type': 'done', 'content': self._text(tokens), 'thinking': None, 'success': True}
+
+    def generate_report_outline(self, topic, requirements):
+        ''.join(self._generate(self.section_tokens))
+        outline = {
+            'title': f'{topic}研究报告',
+            'abstract': self._text(60),
+            'sections': [
+                {'id': index + 1, 'title': f'第{index + 1}部分', 'description': self._text(30)}
+                for index in range(self.sections)
+            ]
+        }
+        return {'content': json.dumps(outline, ensure_ascii=False), 'thinking': None, 'success': True}
+
+    def generate_section_content(self, section_title, section_description, context):
+        content = ''.join(self._generate(self.section_tokens))
+        return {'content': f'## {section_title}\n\n**要点**：{content}', 'thinking': None, 'success': True}
+
+    def get_scheduler_stats(self):
+        with self._stats_lock:
+            return {'backend': 'stub', 'requests': self.requests, 'tokens': self.tokens}
+
+    def get_response_cache_stats(self):
+        return None
+
+    def get_semantic_cache_stats(self):
+        return None
+
+    def get_startup_timings(self):
+        return {}
+
+    def get_metrics(self):
+        return ''
+
+    def get_session_stats(self):
+        return None
+
+
+def build_tiny_model(path):
+    """生成随机权重的小型 Qwen3 模型（字节级分词器），用于在CPU上测试真实推理路径"""
+    import torch
+    from tokenizers import AddedToken, Tokenizer, decoders, models
+    from tokenizers.pre_tokenizers import ByteLevel
+    from transformers import PreTrainedTokenizerFast, Qwen3Config, Qwen3ForCausalLM
+
+    os.makedirs(path, exist_ok=True)
+    vocab = {char: index for index, char in enumerate(sorted(ByteLevel.alphabet()))}
+    specials = {'<|endoftext|>': 151643, '<|im_start|>': 151644, '<|im_end|>': 151645,
+                '<think>': 151667, '</think>': 151668}
+    vocab.update(specials)
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tokenizer.pre_tokenizer = ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.add_special_tokens([AddedToken(token, special=True) for token in specials])
+    chat_template = (
+        "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+        "{% if add_generation_prompt %}<|im_start|>assistant\n"
+        "{% if enable_thinking is defined and not enable_thinking %}<think>\n\n</think>\n\n{% endif %}{% endif %}"
+    )
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token='<|im_end|>', pad_token='<|endoftext|>',
+                            chat_template=chat_template).save_pretrained(path)
+
+    config = Qwen3Config(vocab_size=151936, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, head_dim=16, max_position_embeddings=4096,
+                         eos_token_id=151645, pad_token_id=151643, bos_token_id=151643, torch_dtype='float32',
+                         tie_word_embeddings=False)
+    torch.manual_seed(0)
+    model = Qwen3ForCausalLM(config)
+    with torch.no_grad():
+        # 让输出集中在字节token上，解码结果是可读的文本而不是未登录的ID
+        model.lm_head.weight[256:151643] = 0
+        model.lm_head.weight[:256] *= 30
+        model.lm_head.weight[151646:] = 0
+    model.save_pretrained(path)
+    return path
+
+
+# ---- 服务进程 ----
+
+def serve(args):
+    """子进程入口：启动应用，就绪后在标准输出打印端口"""
+    sys.path.insert(0, ROOT_DIR)
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    if args.backend == 'stub':
+        stub = StubChatBot(args.token_latency_ms, args.prefill_ms, args.stub_slots, args.answer_tokens,
+                           args.sections, args.section_tokens)
+        app_module.QwenChatBot = lambda: stub
+
+    server = make_server('127.0.0.1', 0, app_module.create_app(), threaded=True)
+    print(f'PORT {server.server_port}', flush=True)
+    server.serve_forever()
+
+
+def start_server(args, workdir):
+    env = dict(os.environ)
+    env.update({
+        'REPORT_DB_PATH': os.path.join(workdir, 'reports.db'),
+        'EXPORT_CACHE_DIR': os.path.join(workdir, 'exports'),
+        'RATE_LIMIT_DB_PATH': os.path.join(workdir, 'ratelimit.db'),
+        'PYTHONPATH': ROOT_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+    })
+    if not args.rate_limit:
+        # 压测流量都来自同一个IP，默认关闭限流
+        env['RATE_LIMIT_ENABLED'] = 'false'
+    if args.backend == 'stub':
+        # 配置校验要求模型目录存在，假模型用工作目录代替
+        env['MODEL_PATH'] = workdir
+    elif args.model_path:
+        env['MODEL_PATH'] = args.model_path
+        env.setdefault('DEVICE', 'cpu')
+
+    command = [sys.executable, os.path.abspath(__file__), '--serve'] + sys.argv[1:]
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=log, text=True, cwd=workdir)
+    line = process.stdout.readline()
+    if not line.startswith('PORT '):
+        process.kill()
+        with open(log_path, 'r') as log:
+            raise RuntimeError(f"服务启动失败:\n{log.read()[-2000:]}")
+    return process, f'http://127.0.0.1:{int(line.split()[1])}'
+
+
+def wait_ready(base_url, timeout):
+    client = HttpClient(base_url, timeout=5)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, body = client.request('GET', '/api/health')
+            if status == 200 and json.loads(body).get('model_ready'):
+                return True
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        time.sleep(0.5)
+    return False
+
+
+# ---- 服务进程资源采样（Linux /proc） ----
+
+class ProcessSampler:
+    """定期采样进程的CPU占用（相对单核的百分比）和常驻内存"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+            with open(f'/proc/{self.pid}/status') as f:
+                rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration, IndexError, ValueError):
+            return None
+        return time.monotonic(), cpu_seconds, rss_kb / 1024
+
+    def _run(self):
+        previous = self._read()
+        while not self._stop.wait(self.interval):
+            current = self._read()
+            if previous is None or current is None:
+                previous = current
+                continue
+            elapsed = current[0] - previous[0]
+            if elapsed > 0:
+                self.samples.append(((current[1] - previous[1]) / elapsed * 100, current[2]))
+            previous = current
+
+    def __enter__(self):
+        self.samples = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [sample[0] for sample in self.samples]
+        rss = [sample[1] for sample in self.samples]
+        return {
+            'cpu_percent_avg': round(sum(cpu) / len(cpu), 1),
+            'cpu_percent_max': round(max(cpu), 1),
+            'rss_mb_avg': round(sum(rss) / len(rss), 1),
+            'rss_mb_max': round(max(rss), 1)
+        }
+
+
+# ---- 负载 ----
+
+def percentile(values, q):
+    """线性插值的分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return None
+    return {
+        'p50': round(percentile(seconds, 0.50) * 1000, 2),
+        'p95': round(percentile(seconds, 0.95) * 1000, 2),
+        'p99': round(percentile(seconds, 0.99) * 1000, 2),
+        'mean': round(sum(seconds) / len(seconds) * 1000, 2),
+        'max': round(max(seconds) * 1000, 2)
+    }
+
+
+class Recorder:
+    """线程安全地收集各请求的耗时和错误"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.completed = 0
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, reason):
+        with self._lock:
+            self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def done(self):
+        with self._lock:
+            self.completed += 1
+
+
+class HttpClient:
+    """每个压测线程一个保持连接的 HTTP 客户端（只用标准库，不依赖 requests）"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def open(self, method, path, payload=None):
+        """发送请求并返回未读取正文的响应；连接被服务端关闭时重连一次"""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=body, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt:
+                    raise
+
+    def request(self, method, path, payload=None):
+        response = self.open(method, path, payload)
+        data = response.read()
+        if response.will_close:
+            self.close()
+        return response.status, data
+
+
+def chat_request(client, index, args, recorder):
+    started = time.perf_counter()
+    status, body = client.request('POST', '/api/chat', {
+        'message': f'请解释通货膨胀对居民消费的影响（请求 {index}）',
+        'max_new_tokens': args.max_new_tokens,
+        'enable_thinking': False,
+        'use_cache': args.use_cache
+    })
+    if status != 200 or not json.loads(body).get('success'):
+        recorder.error(f'chat_{status}')
+        return
+    recorder.record('request', time.perf_counter() - started)
+    recorder.done()
+
+
+def chat_stream_request(client, index, args, recorder):
+    started = time.perf_counter()
+    first_token = None
+    event_type = None
+    response = client.open('POST', '/api/chat/stream', {
+        'message': f'请解释通货膨胀对居民消费的影响（请求 {index}）',
+        'max_new_tokens': args.max_new_tokens,
+        'enable_thinking': False,
+        'use_cache': args.use_cache
+    })
+    try:
+        if response.status != 200:
+            response.read()
+            recorder.error(f'chat_stream_{response.status}')
+            return
+        for line in response:
+            if line.startswith(b'event: '):
+                event_type = line[7:].strip().decode()
+                if event_type in ('answer', 'thinking') and first_token is None:
+                    first_token = time.perf_counter() - started
+    finally:
+        if response.will_close:
+            client.close()
+    if event_type != 'done':
+        recorder.error(f'chat_stream_{event_type or "incomplete"}')
+        return
+    if first_token is not None:
+        recorder.record('first_token', first_token)
+    recorder.record('request', time.perf_counter() - started)
+    recorder.done()
+
+
+def report_request(client, index, args, recorder):
+    """生成报告 → 轮询状态直至完成 → 下载 Word 和 Markdown"""
+    started = time.perf_counter()
+    status, body = client.request('POST', '/api/report/generate', {
+        'topic': f'通货膨胀与居民消费 {index}',
+        'requirements': '结合近年数据分析'
+    })
+    if status != 200:
+        recorder.error(f'report_generate_{status}')
+        return
+    recorder.record('generate_call', time.perf_counter() - started)
+    report_id = json.loads(body)['report_id']
+
+    deadline = time.monotonic() + args.timeout
+    while True:
+        status, body = client.request('GET', f'/api/report/status/{report_id}')
+        report_status = json.loads(body).get('status') if status == 200 else None
+        if report_status == 'completed':
+            break
+        if report_status in ('error', None) or time.monotonic() > deadline:
+            recorder.error(f'report_{report_status or status}')
+            return
+        time.sleep(args.poll_interval)
+    recorder.record('generation', time.perf_counter() - started)
+
+    for fmt in ('docx', 'md'):
+        download_started = time.perf_counter()
+        status, body = client.request('GET', f'/api/report/download/{report_id}/{fmt}')
+        if status != 200 or not body:
+            recorder.error(f'download_{fmt}_{status}')
+            return
+        recorder.record(f'download_{fmt}', time.perf_counter() - download_started)
+    recorder.record('request', time.perf_counter() - started)
+    recorder.done()
+
+
+SCENARIO_FUNCS = {
+    'chat': chat_request,
+    'chat_stream': chat_stream_request,
+    'report': report_request,
+}
+
+
+def run_level(scenario, concurrency, total, base_url, args, sampler):
+    """以固定并发数发送 total 个请求"""
+    recorder = Recorder()
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+
+    def worker():
+        client = HttpClient(base_url, args.timeout)
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                client.close()
+                return
+            try:
+                SCENARIO_FUNCS[scenario](client, index, args, recorder)
+            except Exception as e:
+                client.close()
+                recorder.error(type(e).__name__)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    with sampler:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    errors = sum(recorder.errors.values())
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': total,
+        'completed': recorder.completed,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'error_kinds': recorder.errors,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(recorder.completed / elapsed, 3) if elapsed else 0.0,
+        'latency_ms': {name: latency_summary(values) for name, values in sorted(recorder.latencies.items())},
+        'server': sampler.summary()
+    }
+
+
+def print_result(result):
+    latency = result['latency_ms'].get('request') or {}
+    server = result['server'] or {}
+    print(f"{result['scenario']:<12}{result['concurrency']:>6}{result['throughput_rps']:>10.2f}"
+          f"{latency.get('p50', 0):>10.1f}{latency.get('p95', 0):>10.1f}{latency.get('p99', 0):>10.1f}"
+          f"{result['error_rate'] * 100:>8.1f}%{server.get('cpu_percent_avg', 0):>8.0f}%"
+          f"{server.get('rss_mb_max', 0):>9.0f}")
+
+
+def compare(previous_path, results):
+    """与之前保存的结果对比吞吐量和 p95 延迟"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    baseline = {(item['scenario'], item['concurrency']): item for item in previous['results']}
+    print(f"\n与 {previous_path}（提交 {previous['meta'].get('git_commit')}）对比:")
+    print(f"{'场景':<12}{'并发':>6}{'吞吐量变化':>12}{'p95变化':>12}")
+    matched = 0
+    for result in results:
+        old = baseline.get((result['scenario'], result['concurrency']))
+        if not old or not old['throughput_rps']:
+            continue
+        matched += 1
+        old_p95 = (old['latency_ms'].get('request') or {}).get('p95')
+        new_p95 = (result['latency_ms'].get('request') or {}).get('p95')
+        throughput_change = (result['throughput_rps'] / old['throughput_rps'] - 1) * 100
+        p95_change = (new_p95 / old_p95 - 1) * 100 if old_p95 and new_p95 else 0.0
+        print(f"{result['scenario']:<12}{result['concurrency']:>6}{throughput_change:>+11.1f}%{p95_change:>+11.1f}%")
+    if not matched:
+        print("没有场景和并发级别都相同的结果可供对比")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='聊天与报告接口的并发负载测试')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--backend', choices=('stub', 'tiny'), default='stub', help='模型后端')
+    parser.add_argument('--model-path', default='', help='tiny 后端使用的模型目录')
+    parser.add_argument('--build-tiny-model', action='store_true', help='先在 --model-path 生成随机权重小模型')
+    parser.add_argument('--scenarios', default='chat,chat_stream,report', help='测试场景，逗号分隔')
+    parser.add_argument('--concurrency', default='1,4,16', help='并发级别，逗号分隔')
+    parser.add_argument('--requests', type=int, default=32, help='每个并发级别的请求数（报告场景为报告数）')
+    parser.add_argument('--max-new-tokens', type=int, default=64, help='聊天请求的最大生成长度')
+    parser.add_argument('--use-cache', action='store_true', help='允许命中回复缓存（默认关闭以测量真实生成）')
+    parser.add_argument('--rate-limit', action='store_true', help='保留限流（默认关闭）')
+    parser.add_argument('--token-latency-ms', type=float, default=5.0, help='stub：每个token的耗时')
+    parser.add_argument('--prefill-ms', type=float, default=20.0, help='stub：每个请求的预填充耗时')
+    parser.add_argument('--stub-slots', type=int, default=8, help='stub：同时生成的请求数上限')
+    parser.add_argument('--answer-tokens', type=int, default=64, help='stub：聊天回复的token数')
+    parser.add_argument('--sections', type=int, default=4, help='stub：报告章节数')
+    parser.add_argument('--section-tokens', type=int, default=128, help='stub：每个章节的token数')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='报告状态轮询间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=600, help='单个请求的超时（秒）')
+    parser.add_argument('--ready-timeout', type=float, default=600, help='等待模型加载的最长时间（秒）')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    parser.add_argument('--compare', default='', help='与之前保存的结果JSON对比')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    if args.backend == 'tiny':
+        if not args.model_path:
+            sys.exit('tiny 后端需要 --model-path')
+        if args.build_tiny_model:
+            build_tiny_model(args.model_path)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"未知场景: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+
+    with tempfile.TemporaryDirectory(prefix='load-test-') as workdir:
+        process, base_url = start_server(args, workdir)
+        try:
+            if not wait_ready(base_url, args.ready_timeout):
+                sys.exit('模型未能在限定时间内就绪')
+            sampler = ProcessSampler(process.pid)
+            print(f"服务: {base_url}（{args.backend}）")
+            print(f"{'场景':<12}{'并发':>6}{'吞吐(/s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+                  f"{'错误率':>9}{'CPU':>9}{'RSS(MB)':>9}")
+            results = []
+            for scenario in scenarios:
+                for concurrency in levels:
+                    result = run_level(scenario, concurrency, args.requests, base_url, args, sampler)
+                    results.append(result)
+                    print_result(result)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        'meta': {
+            'git_commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('serve', 'output', 'compare')}
+        },
+        'results': results
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+安全扫描吞吐量基准与一致性检查
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/security_scan.py --cases 20000 --size-kb 1024 --rounds 10
+
+先用随机文本检查：合并规则的扫描器与原来逐条正则的判断结果一致；把同一文本随机切块后增量扫描，
+是否命中与整段扫描一致且发现得不晚于整段扫描。然后测量整段扫描和不同分块大小下流式扫描的吞吐量（MB/s）。
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utils.security_scanner import DEFAULT_RULES, DEFAULT_STREAM_WINDOW, SecurityScanner  # noqa: E402
+
+
+# ---- 旧实现（逐条正则），作为对照 ----
+
+LEGACY_PATTERNS = list(DEFAULT_RULES.values())
+
+
+def legacy_contains(text):
+    for pattern in LEGACY_PATTERNS:
+        if re.search(pattern, text, re.IGNORECASE):
+            return True
+    return False
+
+
+# ---- 随机输入 ----
+
+ATOMS = [
+    '<script>', '</script>', '<SCRIPT src=x>', '<', '>', '/', 'java', 'script', 'javascript:', 'JaVaScRiPt:',
+    'vbscript:', ':', 'on', 'load', 'error', 'onload', 'onerror', '=', ' = ', 'eval', 'EVAL', '(', 'e', 'v',
+    'ſ', 'K', ' ', '\n', '\t', 'a', '通胀', '。',
+]
+
+
+def random_text(rng, max_atoms):
+    return ''.join(rng.choice(ATOMS) for _ in range(rng.randint(0, max_atoms)))
+
+
+def random_chunks(rng, text):
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+def check(cases, seed, window):
+    rng = random.Random(seed)
+    scanner = SecurityScanner()
+    failures = 0
+    for case in range(cases):
+        text = random_text(rng, 40)
+
+        if scanner.contains(text) != legacy_contains(text):
+            failures += 1
+            if failures <= 10:
+                print(f"[不一致] 整段扫描 (case {case}) 输入: {text!r}")
+            continue
+
+        # 流式扫描在 <script> 块闭合前就会报告其中的其他命中，因此不要求命中列表相同，而是要求：
+        # 是否命中与整段扫描一致、第一处命中不晚于整段扫描、报告的每一处都是真实的匹配
+        first = scanner.scan(text)
+        stream = scanner.stream(window)
+        for chunk in random_chunks(rng, text):
+            stream.feed(chunk)
+        problems = []
+        if stream.triggered != (first is not None):
+            problems.append('命中判断不一致')
+        elif first is not None and stream.matches[0].end > first.end:
+            problems.append(f'发现晚于整段扫描: {stream.matches[0]} / {first}')
+        for match in stream.matches:
+            if text[match.start:match.end] != match.text or not scanner.pattern.fullmatch(match.text):
+                problems.append(f'无效命中: {match}')
+        if problems:
+            failures += 1
+            if failures <= 10:
+                print(f"[不一致] 流式扫描 (case {case}) 输入: {text!r}\n  " + '\n  '.join(problems))
+    return failures
+
+
+# ---- 性能 ----
+
+MODEL_OUTPUT = ("通货膨胀会通过实际购买力和通胀预期两个渠道影响居民行为。当实际利率下降时储蓄意愿减弱，消费可能提前；"
+                "而当通胀预期不稳定时，居民往往增加预防性储蓄（see the evaluation of CPI and PPI, loaded on demand）。\n"
+                "- **收入效应**：名义收入调整滞后于物价\n- **替代效应**：实际利率变化改变跨期选择\n"
+                "```python\ncpi = prices / base_prices * 100\n```\n")
+
+
+def make_body(size_kb):
+    repeats = size_kb * 1024 // len(MODEL_OUTPUT.encode('utf-8')) + 1
+    return MODEL_OUTPUT * repeats
+
+
+def best_of(func, rounds):
+    func()
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark(size_kb, rounds, window, chunk_sizes):
+    scanner = SecurityScanner()
+    body = make_body(size_kb)
+    megabytes = len(body.encode('utf-8')) / 1024 / 1024
+    print(f"\n文本: {megabytes:.2f} MB, {len(body)} 字符, 每项 {rounds} 次取最短耗时")
+    print(f"{'方式':<28}{'耗时(ms)':>12}{'吞吐量(MB/s)':>16}{'每次feed(us)':>16}")
+
+    def report(name, seconds, feeds=None, **extra):
+        throughput = megabytes / seconds if seconds else 0.0
+        per_feed = seconds / feeds * 1e6 if feeds else None
+        per_feed_text = f"{per_feed:>16.2f}" if per_feed is not None else f"{'-':>16}"
+        print(f"{name:<28}{seconds * 1000:>12.2f}{throughput:>16.1f}{per_feed_text}")
+        result = {'mode': name, 'ms': round(seconds * 1000, 3), 'mb_per_s': round(throughput, 1)}
+        if per_feed is not None:
+            result['us_per_feed'] = round(per_feed, 2)
+        result.update(extra)
+        return result
+
+    results = [
+        report('legacy (6 regexes)', best_of(lambda: legacy_contains(body), rounds)),
+        report('combined scan', best_of(lambda: scanner.contains(body), rounds)),
+    ]
+
+    for chunk_size in chunk_sizes:
+        chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+        def run_stream():
+            stream = scanner.stream(window)
+            for chunk in chunks:
+                stream.feed(chunk)
+
+        # 模型逐token输出时每次 feed 只有几个字符，此时每次 feed 的耗时比吞吐量更有参考意义
+        results.append(report(f'stream chunk={chunk_size}', best_of(run_stream, rounds), feeds=len(chunks),
+                              chunk_chars=chunk_size, window=window))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='安全扫描一致性检查与吞吐量测试')
+    parser.add_argument('--cases', type=int, default=20000, help='随机一致性检查的用例数（0 表示跳过）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--size-kb', type=int, default=1024, help='吞吐量测试的文本大小（KB）')
+    parser.add_argument('--rounds', type=int, default=10, help='每种方式重复的次数')
+    parser.add_argument('--window', type=int, default=DEFAULT_STREAM_WINDOW, help='流式扫描保留的字符数')
+    parser.add_argument('--chunk-sizes', default='4,16,256,4096', help='流式扫描的分块大小（字符），逗号分隔')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    if args.cases:
+        started = time.perf_counter()
+        failures = check(args.cases, args.seed, args.window)
+        print(f"一致性检查: {args.cases} 组随机输入, {failures} 处不一致, "
+              f"耗时 {time.perf_counter() - started:.1f}s")
+        if failures:
+            sys.exit(1)
+
+    chunk_sizes = [int(size) for size in args.chunk_sizes.split(',') if size]
+    results = benchmark(args.size_kb, args.rounds, args.window, chunk_sizes)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+文本清理性能基准与一致性检查
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+用法:
+    python benchmarks/text_cleaning.py --cases 20000 --size-kb 100 --rounds 20
+
+先用随机生成的文本（大量嵌套、未闭合、跨行的标记以及各种Unicode空白）逐一比较新旧实现的输出，
+任何不一致都会打印出来并以非零状态退出；全部一致后再在 100KB 的报告正文上测量各函数的耗时。
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utils.document_utils import clean_text_for_word  # noqa: E402
+from utils.text_utils import clean_markdown_for_word, contains_malicious_content, normalize_whitespace  # noqa: E402
+
+
+# ---- 旧实现（逐条正则替换），作为对照 ----
+
+def legacy_clean_text_for_word(text):
+    if not text:
+        return ""
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'#{1,6}\s*', '', text)
+    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`([^`]*)`', r'\1', text)
+    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
+    return text.strip()
+
+
+def legacy_clean_markdown_for_word(text):
+    if not text:
+        return text
+    text = re.sub(r'^#{1,6}\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'^\s*[-\*\+]\s*', '• ', text, flags=re.MULTILINE)
+    text = re.sub(r'\[([^\]]*)\]\([^\)]*\)', r'\1', text)
+    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`([^`]*)`', r'\1', text)
+    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
+    return text.strip()
+
+
+def legacy_normalize_whitespace(text):
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def legacy_contains_malicious_content(text):
+    malicious_patterns = [
+        r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>',
+        r'javascript:',
+        r'vbscript:',
+        r'onload\s*=',
+        r'onerror\s*=',
+        r'eval\s*\(',
+    ]
+    for pattern in malicious_patterns:
+        if re.search(pattern, text, re.IGNORECASE):
+            return True
+    return False
+
+
+PAIRS = [
+    ('clean_text_for_word', clean_text_for_word, legacy_clean_text_for_word),
+    ('clean_markdown_for_word', clean_markdown_for_word, legacy_clean_markdown_for_word),
+    ('normalize_whitespace', normalize_whitespace, legacy_normalize_whitespace),
+    ('contains_malicious_content', contains_malicious_content, legacy_contains_malicious_content),
+]
+
+
+# ---- 随机输入 ----
+
+MARKUP_ATOMS = [
+    '*', '**', '***', '#', '##', '#######', '`', '```', '````', '[', ']', '(', ')', '](', '-', '+', '• ',
+    ' ', '  ', '\t', '\n', '\n\n', '\n\n\n', '\r\n', '\x0b', '\x0c', '\x1c', '\x85', '　', ' ', '​',
+    'a', 'b', 'x-y', '中文', '。', '「', '」', '1.', 'ſ', 'K',
+]
+SECURITY_ATOMS = [
+    '<script>', '</script>', '<SCRIPT src=x>', '<', '>', 'java', 'javascript:', 'JaVaScRiPt:', 'vbscript:',
+    'on', 'load', 'onload', 'onerror', '=', ' = ', 'eval', 'EVAL', '(', 'e', 'v', 'ſ', ' ', '\n', 'a',
+]
+
+
+def random_text(rng, atoms, max_atoms):
+    return ''.join(rng.choice(atoms) for _ in range(rng.randint(0, max_atoms)))
+
+
+def random_markdown(rng):
+    """按行生成更接近真实报告的Markdown"""
+    lines = []
+    for _ in range(rng.randint(1, 12)):
+        prefix = rng.choice(['', '', '# ', '### ', '- ', '* ', '+ ', '  - ', '1. ', '```', '```python', '> '])
+        words = [rng.choice(['通胀', 'CPI', '**重点**', '*斜体*', '`code`', '[链接](http://a.b)',
+                             '**未闭合', '*', '#', '`', 'a*b', '(注)', '[x]']) for _ in range(rng.randint(0, 6))]
+        lines.append(prefix + ' '.join(words))
+    return rng.choice(['\n', '\n\n', '\n \n\n']).join(lines)
+
+
+def check(cases, seed):
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        samples = [
+            ('markup', random_text(rng, MARKUP_ATOMS, 40)),
+            ('markdown', random_markdown(rng)),
+            ('security', random_text(rng, SECURITY_ATOMS, 30)),
+        ]
+        for kind, text in samples:
+            for name, new, old in PAIRS:
+                expected = old(text)
+                actual = new(text)
+                if actual != expected:
+                    failures += 1
+                    if failures <= 10:
+                        print(f"[不一致] {name} ({kind}, case {case})\n  输入: {text!r}\n"
+                              f"  旧实现: {expected!r}\n  新实现: {actual!r}")
+    for name, new, old in PAIRS:
+        for text in ('', ' ', '\n'):
+            if new(text) != old(text):
+                failures += 1
+                print(f"[不一致] {name} 输入: {text!r}")
+    return failures
+
+
+# ---- 性能 ----
+
+REPORT_PARAGRAPH = ("通货膨胀会通过**实际购买力**和*通胀预期*两个渠道影响居民行为。当「实际利率下降」时储蓄意愿减弱，"
+                    "消费可能提前；而当通胀预期不稳定时，居民往往增加预防性储蓄（参见 `CPI` 与 `PPI` 的走势）。")
+REPORT_BLOCKS = [
+    '## 理论分析',
+    REPORT_PARAGRAPH,
+    '- **收入效应**：名义收入调整滞后于物价\n- **替代效应**：实际利率变化改变跨期选择\n- *预防性储蓄*动机增强',
+    REPORT_PARAGRAPH,
+    '更多数据见[国家统计局](https://www.stats.gov.cn/)发布的月度数据。',
+    '```python\ncpi = prices / base_prices * 100\n```',
+]
+
+
+def make_body(size_kb):
+    """拼出大约 size_kb 千字节（UTF-8）的报告正文"""
+    blocks = []
+    size = 0
+    while size < size_kb * 1024:
+        for block in REPORT_BLOCKS:
+            blocks.append(block)
+            size += len(block.encode('utf-8')) + 2
+    return '\n\n'.join(blocks)
+
+
+def timed(func, text, rounds):
+    """单次调用的最短耗时（ms），减少机器负载波动的影响"""
+    func(text)
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def benchmark(size_kb, rounds):
+    body = make_body(size_kb)
+    print(f"\n报告正文: {len(body.encode('utf-8')) / 1024:.1f} KB, {len(body)} 字符, 每项 {rounds} 次取最短耗时")
+    print(f"{'函数':<30}{'旧实现(ms)':>12}{'新实现(ms)':>12}{'加速比':>10}")
+    results = []
+    for name, new, old in PAIRS:
+        assert new(body) == old(body)
+        old_ms = timed(old, body, rounds)
+        new_ms = timed(new, body, rounds)
+        speedup = old_ms / new_ms if new_ms else 0.0
+        results.append({'function': name, 'legacy_ms': round(old_ms, 3), 'engine_ms': round(new_ms, 3),
+                        'speedup': round(speedup, 2), 'body_bytes': len(body.encode('utf-8'))})
+        print(f"{name:<30}{old_ms:>12.2f}{new_ms:>12.2f}{speedup:>10.2f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文本清理一致性检查与性能对比')
+    parser.add_argument('--cases', type=int, default=20000, help='随机一致性检查的用例数（0 表示跳过）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--size-kb', type=int, default=100, help='基准测试的报告正文大小（KB）')
+    parser.add_argument('--rounds', type=int, default=20, help='每个函数重复的次数')
+    parser.add_argument('--output', default='', help='结果JSON输出路径')
+    args = parser.parse_args()
+
+    if args.cases:
+        started = time.perf_counter()
+        failures = check(args.cases, args.seed)
+        print(f"一致性检查: {args.cases} 组随机输入 × {len(PAIRS)} 个函数, "
+              f"{failures} 处不一致, 耗时 {time.perf_counter() - started:.1f}s")
+        if failures:
+            sys.exit(1)
+
+    results = benchmark(args.size_kb, args.rounds)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
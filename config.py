@@ -37,6 +37,98 @@ class ModelConfig:
 
     ENABLE_THINKING = os.environ.get('ENABLE_THINKING', 'True').lower() == 'true'
 
+    # 权重dtype：auto 沿用检查点中的dtype，也可指定 bfloat16 / float16 / float32
+    MODEL_DTYPE = os.environ.get('MODEL_DTYPE', 'auto')
+    # 加载前多线程预读权重分片（预读阶段按读取的字节数统计进度）
+    PREFETCH_WEIGHTS = os.environ.get('PREFETCH_WEIGHTS', 'True').lower() == 'true'
+    LOAD_THREADS = int(os.environ.get('LOAD_THREADS', 4))
+    # 预转换检查点缓存目录，为空时不缓存；源权重需转换dtype或不是safetensors格式时才会写入
+    CHECKPOINT_CACHE_DIR = os.environ.get('CHECKPOINT_CACHE_DIR', '')
+
+    # CPU推理（DEVICE=cpu 或无可用GPU时生效）
+    # 精度：auto 沿用 MODEL_DTYPE，fp32，bf16（需CPU支持），int8（线性层动态量化）
+    CPU_PRECISION = os.environ.get('CPU_PRECISION', 'auto')
+    # intra-op / inter-op 线程数，0 表示使用torch默认值
+    CPU_THREADS = int(os.environ.get('CPU_THREADS', 0))
+    CPU_INTEROP_THREADS = int(os.environ.get('CPU_INTEROP_THREADS', 0))
+    # 推理线程绑定的核心列表，如 "0-7,16-23"（建议只列物理核心），为空时不绑定
+    CPU_AFFINITY = os.environ.get('CPU_AFFINITY', '')
+
+    WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'True').lower() == 'true'
+
+    # 推测解码：草稿模型路径（同系列小模型，为空时不可用）及每步候选token数
+    DRAFT_MODEL_PATH = os.environ.get('DRAFT_MODEL_PATH', '')
+    SPECULATIVE_NUM_TOKENS = int(os.environ.get('SPECULATIVE_NUM_TOKENS', 4))
+    # 提示词查找解码：匹配的最长n-gram及每步候选token数
+    PROMPT_LOOKUP_MAX_NGRAM = int(os.environ.get('PROMPT_LOOKUP_MAX_NGRAM', 3))
+    PROMPT_LOOKUP_NUM_TOKENS = int(os.environ.get('PROMPT_LOOKUP_NUM_TOKENS', 10))
+    # 报告章节使用的解码方式：standard / speculative / prompt_lookup
+    SECTION_DECODING = os.environ.get('SECTION_DECODING', 'standard')
+
+    MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 8))
+    PREFIX_CACHE_MAX_MB = int(os.environ.get('PREFIX_CACHE_MAX_MB', 512))
+
+    # 多轮对话会话：空闲超时（秒）和最多保留的会话数
+    SESSION_TTL = int(os.environ.get('SESSION_TTL', 1800))
+    MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 1000))
+    # 会话KV缓存占用的显存（CPU推理时为内存）预算，0 表示不保留，每轮重新预填充完整对话
+    SESSION_KV_CACHE_MAX_MB = int(os.environ.get('SESSION_KV_CACHE_MAX_MB', 1024))
+    # 超出预算时被淘汰的会话KV缓存转移到CPU内存的上限，0 表示直接丢弃
+    SESSION_KV_OFFLOAD_MAX_MB = int(os.environ.get('SESSION_KV_OFFLOAD_MAX_MB', 2048))
+
+    # 上下文窗口：每个请求的提示词token预算（同时不超过模型上下文长度减去生成长度）和单条消息的token上限
+    MAX_PROMPT_TOKENS = int(os.environ.get('MAX_PROMPT_TOKENS', 8192))
+    MAX_MESSAGE_TOKENS = int(os.environ.get('MAX_MESSAGE_TOKENS', 2048))
+    # 会话历史超出预算时一次截掉较早的轮次，直到只占预算的该比例，使之后若干轮的提示词前缀不变、可复用会话KV缓存
+    CONTEXT_LOW_WATERMARK = float(os.environ.get('CONTEXT_LOW_WATERMARK', 0.6))
+    # 会话历史超过预算的该比例时，在后台把将被截掉的轮次摘要，截断时以摘要代替；0 表示不摘要，只截断
+    CONTEXT_SUMMARY_TRIGGER = float(os.environ.get('CONTEXT_SUMMARY_TRIGGER', 0.8))
+    CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_MAX_TOKENS', 512))
+
+    # 设置后 Flask 工作进程不再各自加载模型，而是通过该 Unix 套接字调用独立的模型服务
+    # （python -m models.model_server）
+    MODEL_SERVER_SOCKET = os.environ.get('MODEL_SERVER_SOCKET', '')
+    MODEL_SERVER_POOL_SIZE = int(os.environ.get('MODEL_SERVER_POOL_SIZE', 16))
+    MODEL_SERVER_TIMEOUT = float(os.environ.get('MODEL_SERVER_TIMEOUT', 600))
+    MODEL_SERVER_STATUS_TTL = float(os.environ.get('MODEL_SERVER_STATUS_TTL', 1))
+
+
+class CacheConfig:
+
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'True').lower() == 'true'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_MAX_MB = int(os.environ.get('RESPONSE_CACHE_MAX_MB', 64))
+    # 温度不高于该值的请求默认可缓存（聊天默认0.7，大纲0.3，章节0.4）
+    RESPONSE_CACHE_MAX_TEMPERATURE = float(os.environ.get('RESPONSE_CACHE_MAX_TEMPERATURE', 1.0))
+    RESPONSE_CACHE_TEMPERATURE_BUCKET = float(os.environ.get('RESPONSE_CACHE_TEMPERATURE_BUCKET', 0.1))
+
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'False').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))
+    SEMANTIC_CACHE_CAPACITY = int(os.environ.get('SEMANTIC_CACHE_CAPACITY', 4096))
+    # 为空时使用已加载对话模型的隐藏状态均值作为向量
+    SEMANTIC_CACHE_EMBEDDING_MODEL = os.environ.get('SEMANTIC_CACHE_EMBEDDING_MODEL', '')
+
+    # 已渲染的报告导出文件：内存LRU + 多进程共享的磁盘缓存（目录为空时只用内存）
+    EXPORT_CACHE_MAX_MB = int(os.environ.get('EXPORT_CACHE_MAX_MB', 64))
+    EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(BASE_DIR, 'data', 'exports'))
+    EXPORT_CACHE_DISK_MAX_MB = int(os.environ.get('EXPORT_CACHE_DISK_MAX_MB', 512))
+
+
+class AdmissionConfig:
+
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True').lower() == 'true'
+    # 排队中的交互式请求工作量上限（提示词字符数 + 最大生成token数），超出后返回429
+    MAX_QUEUED_TOKENS = int(os.environ.get('ADMISSION_MAX_QUEUED_TOKENS', 65536))
+    # 同时执行的请求工作量上限
+    MAX_INFLIGHT_TOKENS = int(os.environ.get('ADMISSION_MAX_INFLIGHT_TOKENS', 32768))
+    # 排队（含等待模型加载）的最长时间（秒）
+    QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 300))
+    # 尚无吞吐数据时建议的重试秒数，以及建议值的上限
+    RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 5))
+    MAX_RETRY_AFTER = int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 120))
+    # 流式请求排队时推送位置更新的间隔（秒）
+    QUEUE_UPDATE_INTERVAL = float(os.environ.get('ADMISSION_QUEUE_UPDATE_INTERVAL', 1))
+
 
 class ReportConfig:
 
@@ -46,8 +138,28 @@ class ReportConfig:
 
     POLLING_INTERVAL = int(os.environ.get('POLLING_INTERVAL', 2))
 
+    EVENT_KEEPALIVE_INTERVAL = int(os.environ.get('EVENT_KEEPALIVE_INTERVAL', 15))
+
+    # 报告由其他工作进程生成时，事件流轮询共享存储的间隔（秒）
+    EVENT_STORE_POLL_INTERVAL = float(os.environ.get('EVENT_STORE_POLL_INTERVAL', 1))
+
     REPORT_TIMEOUT = int(os.environ.get('REPORT_TIMEOUT', 30))
 
+    SECTION_CONCURRENCY = int(os.environ.get('SECTION_CONCURRENCY', 8))
+
+    # 章节数达到该值的报告导出Word时直接流式生成 document.xml
+    DOCX_STREAMING_SECTIONS = int(os.environ.get('DOCX_STREAMING_SECTIONS', 30))
+
+    # 批量导出时并行渲染的线程数
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 4))
+
+    # 是否记录报告生成的执行时间线（/api/report/trace/<id>），以及单个报告最多记录的 span 数
+    REPORT_TRACE_ENABLED = os.environ.get('REPORT_TRACE_ENABLED', 'True').lower() == 'true'
+    REPORT_TRACE_MAX_SPANS = int(os.environ.get('REPORT_TRACE_MAX_SPANS', 2000))
+
+    # 多个 gunicorn 工作进程共享的报告数据库
+    REPORT_DB_PATH = os.environ.get('REPORT_DB_PATH', os.path.join(BASE_DIR, 'data', 'reports.db'))
+
 
 class LogConfig:
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -55,17 +167,40 @@ class LogConfig:
     LOG_FILE = os.path.join(BASE_DIR, 'logs', 'app.log')
     MAX_LOG_SIZE = 10 * 1024 * 1024
     BACKUP_COUNT = 5
+    # 是否提供 /metrics（Prometheus 文本格式）
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
 
 
 class SecurityConfig:
 
     RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    # 按客户端IP和路由类别分别计数的令牌桶：每分钟补充的令牌数
     RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 60))
+    RATE_LIMIT_CHAT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_CHAT_PER_MINUTE', 20))
+    RATE_LIMIT_REPORT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_REPORT_PER_MINUTE', 5))
+    RATE_LIMIT_EXPORT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_EXPORT_PER_MINUTE', 30))
+    # 服务状态和报告进度的轮询（页面每个标签页定时请求，多个标签页或共用出口IP的用户叠加）
+    RATE_LIMIT_STATUS_PER_MINUTE = int(os.environ.get('RATE_LIMIT_STATUS_PER_MINUTE', 600))
+    # 桶容量按多少秒的补充量计算，即允许的突发请求数（至少为1）
+    RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', 15))
+    # 多个工作进程共享的限流数据库，设为空字符串时仅在进程内计数
+    RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', os.path.join(BASE_DIR, 'data', 'ratelimit.db'))
+    # 清理空闲令牌桶的间隔（秒）
+    RATE_LIMIT_CLEANUP_INTERVAL = float(os.environ.get('RATE_LIMIT_CLEANUP_INTERVAL', 60))
+    # 反向代理层数，大于0时从 X-Forwarded-For 取客户端IP
+    RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 0))
 
     MAX_MESSAGE_LENGTH = int(os.environ.get('MAX_MESSAGE_LENGTH', 4000))
     MAX_TOPIC_LENGTH = int(os.environ.get('MAX_TOPIC_LENGTH', 200))
     MAX_REQUIREMENTS_LENGTH = int(os.environ.get('MAX_REQUIREMENTS_LENGTH', 2000))
 
+    # 安全扫描规则文件（JSON，{"规则名": "正则"}），与内置规则合并，值为空表示禁用同名内置规则
+    SECURITY_PATTERNS_FILE = os.environ.get('SECURITY_PATTERNS_FILE', '')
+    # 是否扫描模型输出，命中时拦截回复
+    SECURITY_SCAN_OUTPUT = os.environ.get('SECURITY_SCAN_OUTPUT', 'True').lower() == 'true'
+    # 流式输出扫描时跨分块保留的字符数
+    SECURITY_STREAM_WINDOW = int(os.environ.get('SECURITY_STREAM_WINDOW', 512))
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -102,8 +237,11 @@ def ensure_directories():
     directories = [
         TEMP_DIR,
         Config.UPLOAD_FOLDER,
-        os.path.dirname(LogConfig.LOG_FILE)
+        os.path.dirname(LogConfig.LOG_FILE),
+        os.path.dirname(ReportConfig.REPORT_DB_PATH)
     ]
+    if CacheConfig.EXPORT_CACHE_DIR:
+        directories.append(CacheConfig.EXPORT_CACHE_DIR)
 
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
@@ -5,6 +5,12 @@
 
 from .chatbot import QwenChatBot
 from .report_generator import ReportGenerator
+from .report_store import SQLiteReportStore
+from .model_server import ModelServer, RemoteChatBot
+from .admission import AdmissionController, AdmissionRejected, AdmissionUnavailable
+from .rate_limiter import SQLiteRateLimiter, MemoryRateLimiter
 
-__all__ = ['QwenChatBot', 'ReportGenerator']
+__all__ = ['QwenChatBot', 'ReportGenerator', 'SQLiteReportStore', 'ModelServer', 'RemoteChatBot',
+           'AdmissionController', 'AdmissionRejected', 'AdmissionUnavailable', 'SQLiteRateLimiter',
+           'MemoryRateLimiter']
 __version__ = '1.0.0'
\ No newline at end of file
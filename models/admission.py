@@ -0,0 +1,296 @@
+"""
+推理请求准入控制
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from config import AdmissionConfig
+from utils.metrics import Histogram, LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# 优先级（数值越小越优先）：交互式聊天优先于后台报告章节
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    'chatbot_admission_wait_seconds', '请求在准入队列中的等待时间（秒）', LATENCY_BUCKETS, ('priority',)
+)
+_WAIT_BY_PRIORITY = {priority: ADMISSION_WAIT_SECONDS.labels(name) for priority, name in PRIORITY_NAMES.items()}
+
+
+class AdmissionRejected(Exception):
+    """排队的工作量已达上限，请求被拒绝"""
+
+    def __init__(self, retry_after, queued_tokens):
+        super().__init__(f"排队请求过多（{queued_tokens} tokens），请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+        self.queued_tokens = queued_tokens
+
+
+class AdmissionUnavailable(Exception):
+    """模型加载失败，排队的请求不会再获准执行"""
+
+
+def estimate_work(prompt_text, max_new_tokens):
+    """估算请求的token工作量：提示词长度（按字符数上估）+ 最大生成长度"""
+    return len(prompt_text or '') + int(max_new_tokens or 0)
+
+
+class AdmissionTicket:
+    """排队凭证；wait() 返回True后表示已获准执行，执行结束必须 release()"""
+
+    def __init__(self, controller, work, priority):
+        self.controller = controller
+        self.work = work
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.initial_position = None
+        self.released = False
+
+    @property
+    def admitted(self):
+        return self.admitted_at is not None
+
+    @property
+    def waited_seconds(self):
+        end = self.admitted_at or time.monotonic()
+        return end - self.enqueued_at
+
+    def wait(self, timeout=None):
+        """等待获准执行，超时返回False（凭证仍在队列中，可继续等待或 cancel()）；
+        模型加载失败时移出队列并抛出 AdmissionUnavailable"""
+        return self.controller._wait(self, timeout)
+
+    def position(self):
+        """当前排队位置（从1开始），已获准返回0"""
+        return self.controller._position(self)
+
+    def estimated_wait(self):
+        """按近期吞吐估算的剩余等待秒数，无法估算时返回None"""
+        return self.controller._estimated_wait(self)
+
+    def cancel(self):
+        """放弃排队（已获准时等同于 release）"""
+        self.controller._cancel(self)
+
+    def release(self):
+        """执行结束，归还占用的工作量"""
+        self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cancel()
+
+
+class AdmissionController:
+    """按token工作量限制排队与并发的准入控制器
+
+    - 交互式请求的排队工作量超过 max_queued_tokens 时立即拒绝（附带建议的重试秒数）；
+      后台请求不受排队上限约束，但只在没有交互式请求排队时才获准执行。
+    - 正在执行的工作量之和不超过 max_inflight_tokens（单个超大请求在空闲时仍可执行）。
+    - 模型未就绪时请求在队列中等待，而不是直接失败；模型加载失败（is_failed）时新请求立即被拒绝，
+      已在排队的请求被唤醒并移出队列。
+    - 吞吐量按 已完成工作量 / 有请求执行的累计时长 统计，用于估算等待时间。
+    """
+
+    def __init__(self, is_ready=None, max_queued_tokens=None, max_inflight_tokens=None, is_failed=None):
+        self.is_ready = is_ready or (lambda: True)
+        self.is_failed = is_failed or (lambda: False)
+        self.max_queued_tokens = max_queued_tokens or AdmissionConfig.MAX_QUEUED_TOKENS
+        self.max_inflight_tokens = max_inflight_tokens or AdmissionConfig.MAX_INFLIGHT_TOKENS
+
+        self._condition = threading.Condition()
+        self._queues = {PRIORITY_INTERACTIVE: deque(), PRIORITY_BACKGROUND: deque()}
+        self._queued_tokens = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._inflight_tokens = 0
+        self._inflight_count = 0
+
+        self._completed_tokens = 0
+        self._busy_seconds = 0.0
+        self._busy_since = None
+
+        self.stats = {
+            'admitted': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+            'unavailable': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0
+        }
+
+    def submit(self, work, priority=PRIORITY_INTERACTIVE):
+        """加入队列，返回 AdmissionTicket；交互式队列已满时抛出 AdmissionRejected，模型加载失败时抛出 AdmissionUnavailable"""
+        if self.is_failed():
+            with self._condition:
+                self.stats['unavailable'] += 1
+            raise AdmissionUnavailable("模型加载失败，暂时无法处理请求")
+
+        with self._condition:
+            queued = self._queued_tokens[priority]
+            if (priority == PRIORITY_INTERACTIVE and self._queues[priority]
+                    and queued + work > self.max_queued_tokens):
+                self.stats['rejected'] += 1
+                raise AdmissionRejected(self._retry_after(), queued)
+
+            ticket = AdmissionTicket(self, work, priority)
+            self._queues[priority].append(ticket)
+            self._queued_tokens[priority] += work
+            ticket.initial_position = self._position(ticket)
+            self._condition.notify_all()
+            return ticket
+
+    def _can_admit(self, ticket):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if queue:
+                if queue[0] is not ticket:
+                    return False
+                break
+        if not self.is_ready():
+            return False
+        return self._inflight_count == 0 or self._inflight_tokens + ticket.work <= self.max_inflight_tokens
+
+    def _wait(self, ticket, timeout=None):
+        if ticket.admitted:
+            return True
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while not self._can_admit(ticket):
+                if not ticket.admitted and self.is_failed():
+                    self._dequeue(ticket)
+                    self.stats['unavailable'] += 1
+                    self._condition.notify_all()
+                    raise AdmissionUnavailable("模型加载失败，暂时无法处理请求")
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                # 定期醒来检查模型是否已就绪或加载失败
+                self._condition.wait(min(remaining, 0.5) if remaining is not None else 0.5)
+
+            self._dequeue(ticket)
+            self._account_busy()
+            self._inflight_tokens += ticket.work
+            self._inflight_count += 1
+            ticket.admitted_at = time.monotonic()
+
+            waited = ticket.waited_seconds
+            self.stats['admitted'] += 1
+            self.stats['total_wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+            _WAIT_BY_PRIORITY[ticket.priority].observe(waited)
+            self._condition.notify_all()
+            return True
+
+    def _dequeue(self, ticket):
+        self._queues[ticket.priority].remove(ticket)
+        self._queued_tokens[ticket.priority] -= ticket.work
+
+    def _account_busy(self):
+        """累计有请求执行的时长（在并发数变化前调用）"""
+        now = time.monotonic()
+        if self._busy_since is not None and self._inflight_count > 0:
+            self._busy_seconds += now - self._busy_since
+        self._busy_since = now
+
+    def _release(self, ticket):
+        with self._condition:
+            if not ticket.admitted or ticket.released:
+                return
+            ticket.released = True
+            self._account_busy()
+            self._inflight_tokens -= ticket.work
+            self._inflight_count -= 1
+            self._completed_tokens += ticket.work
+            self._condition.notify_all()
+
+    def _cancel(self, ticket):
+        with self._condition:
+            if ticket.admitted:
+                self._release(ticket)
+            elif ticket in self._queues[ticket.priority]:
+                self._dequeue(ticket)
+                self.stats['cancelled'] += 1
+                self._condition.notify_all()
+
+    def timed_out(self, ticket):
+        """等待超时后移出队列并计数"""
+        with self._condition:
+            if not ticket.admitted and ticket in self._queues[ticket.priority]:
+                self._dequeue(ticket)
+                self.stats['timed_out'] += 1
+                self._condition.notify_all()
+
+    def _position(self, ticket):
+        with self._condition:
+            if ticket.admitted:
+                return 0
+            ahead = 0
+            for priority in sorted(self._queues):
+                queue = self._queues[priority]
+                if priority < ticket.priority:
+                    ahead += len(queue)
+                elif priority == ticket.priority:
+                    for index, queued in enumerate(queue):
+                        if queued is ticket:
+                            return ahead + index + 1
+            return ahead + 1
+
+    def _throughput(self):
+        """近似吞吐量（token工作量/秒），尚无数据时返回None"""
+        return self._completed_tokens / self._busy_seconds if self._busy_seconds > 0 else None
+
+    def _estimated_wait(self, ticket):
+        with self._condition:
+            if ticket.admitted:
+                return 0.0
+            throughput = self._throughput()
+            if not throughput:
+                return None
+            work_ahead = self._inflight_tokens
+            for priority in sorted(self._queues):
+                for queued in self._queues[priority]:
+                    if queued is ticket:
+                        return round(work_ahead / throughput, 1)
+                    work_ahead += queued.work
+            return round(work_ahead / throughput, 1)
+
+    def _retry_after(self):
+        """建议的重试秒数：按当前吞吐清空交互式队列所需时间"""
+        throughput = self._throughput()
+        if not throughput:
+            return AdmissionConfig.RETRY_AFTER
+        backlog = self._queued_tokens[PRIORITY_INTERACTIVE] + self._inflight_tokens
+        return max(1, min(math.ceil(backlog / throughput), AdmissionConfig.MAX_RETRY_AFTER))
+
+    def retry_after(self):
+        with self._condition:
+            return self._retry_after()
+
+    def get_stats(self):
+        """获取准入控制统计信息"""
+        with self._condition:
+            stats = dict(self.stats)
+            stats['avg_wait_seconds'] = (round(stats['total_wait_seconds'] / stats['admitted'], 3)
+                                         if stats['admitted'] else 0.0)
+            stats['total_wait_seconds'] = round(stats['total_wait_seconds'], 3)
+            stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 3)
+            stats['queued'] = {PRIORITY_NAMES[p]: len(q) for p, q in self._queues.items()}
+            stats['queued_tokens'] = {PRIORITY_NAMES[p]: tokens for p, tokens in self._queued_tokens.items()}
+            stats['inflight'] = self._inflight_count
+            stats['inflight_tokens'] = self._inflight_tokens
+            stats['max_queued_tokens'] = self.max_queued_tokens
+            stats['max_inflight_tokens'] = self.max_inflight_tokens
+            throughput = self._throughput()
+            stats['throughput_tokens_per_second'] = round(throughput, 2) if throughput else None
+            return stats
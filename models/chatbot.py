@@ -1,11 +1,69 @@
-import torch
+import os
 import threading
 import logging
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from config import ModelConfig, MODEL_PATH
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import ModelConfig, CacheConfig, SecurityConfig, MODEL_PATH
+from .loader import (
+    LoadProgress, WeightLoadMonitor, weight_files, prefetch_weights, expected_weight_bytes, resolve_dtype,
+    checkpoint_cache_path, save_checkpoint_cache, select_device, configure_cpu_runtime, cpu_load_dtype,
+    quantize_for_cpu
+)
+from .context import ContextManager, ContextOverflow
+from .response_cache import ResponseCache
+from .session import ChatSessionManager, SessionBusy, SessionNotFound
+from utils.security_scanner import SecurityScanner, load_rules
+from utils.metrics import REGISTRY, CallbackMetric, SCOPE_INFERENCE, gpu_memory_stats, process_memory_bytes
 
 logger = logging.getLogger(__name__)
 
+THINK_END_TOKEN_ID = 151668
+
+# 报告提示词的固定部分放在最前面，报告上下文其次，章节相关内容放在最后，
+# 使同一报告的各章节请求共享尽可能长的token前缀，从而复用前缀KV缓存
+OUTLINE_PROMPT_PREAMBLE = """
+作为经济学专家，请为文末给出的主题生成一个详细的报告大纲。
+
+请按以下JSON格式输出大纲，注意摘要部分请使用纯文本格式，避免使用Markdown符号：
+
+{
+    "title": "报告标题",
+    "abstract": "报告摘要内容，使用纯文本格式，不要使用星号或其他特殊符号（150字以内）",
+    "sections": [
+        {
+            "id": "一",
+            "title": "章节标题",
+            "description": "章节描述和要点"
+        }
+    ]
+}
+
+要求：
+1. 大纲应该逻辑清晰，层次分明
+2. 每个章节都应该有明确的主题和目标
+3. 整体结构应该符合学术报告的标准格式
+4. 摘要和描述请使用简洁的中文表述，避免使用特殊符号
+5. 请确保输出格式为有效的JSON
+
+示例摘要格式：
+"本报告主要分析2024年中国宏观经济的发展态势。通过对GDP增长、通胀水平和货币政策的综合分析，评估当前经济形势并提出相关建议。"
+"""
+
+SECTION_PROMPT_PREAMBLE = """
+作为经济学专家，请为报告章节生成详细内容。章节标题和描述见文末。
+
+请生成该章节的详细内容，要求：
+1. 内容应该专业、准确、有深度
+2. 结构清晰，逻辑严密
+3. 包含具体的数据分析和案例（如果相关）
+4. 字数控制在800-1500字之间
+5. 使用学术写作风格
+6. 避免使用Markdown格式符号，如 # * ** 等
+7. 如需强调内容，可以使用「重点内容」的方式标注
+
+请直接输出章节内容，使用纯文本格式。
+"""
+
 
 class QwenChatBot:
     def __init__(self, model_name=MODEL_PATH):
@@ -15,6 +73,19 @@ class QwenChatBot:
         self.device = None
         self.is_loading = True
         self.load_error = None
+        self.scheduler = None
+        self.context = None
+        self.response_cache = ResponseCache() if CacheConfig.RESPONSE_CACHE_ENABLED else None
+        self.semantic_cache = None
+        self.sessions = ChatSessionManager(on_remove=self._discard_session_cache)
+        # 会话回复写入历史前按与应用层相同的规则扫描，被拦截的回复不进入历史（在加载模型的进程中执行）
+        self.output_scanner = (SecurityScanner(load_rules(SecurityConfig.SECURITY_PATTERNS_FILE))
+                               if SecurityConfig.SECURITY_SCAN_OUTPUT else None)
+        self.startup_timings = {}
+        self.load_progress = LoadProgress()
+        self.runtime_info = {}
+        self._startup_started = time.perf_counter()
+        self._register_metrics()
 
         self.load_thread = threading.Thread(target=self._load_model)
         self.load_thread.start()
@@ -24,53 +95,222 @@ class QwenChatBot:
         try:
             logger.info(f"开始加载模型: {self.model_name}")
 
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            # torch/transformers 导入耗时数秒，放在后台线程中，避免阻塞应用启动
+            phase_started = time.perf_counter()
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            from .scheduler import GenerationScheduler
+            phase_started = self._record_phase('imports', phase_started)
+
+            self.device = select_device()
             logger.info(f"使用设备: {self.device}")
 
-    
-            logger.info("加载tokenizer...")
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                trust_remote_code=True
+            dtype_name = ModelConfig.MODEL_DTYPE
+            if self.device == "cpu":
+                self.runtime_info = configure_cpu_runtime()
+                dtype_name = cpu_load_dtype(ModelConfig.CPU_PRECISION)
+                self.runtime_info['precision'] = ModelConfig.CPU_PRECISION
+
+            cache_path = checkpoint_cache_path(self.model_name, dtype_name)
+            weights_path = self.model_name
+            if cache_path and os.path.isdir(cache_path):
+                weights_path = cache_path
+                logger.info(f"使用预转换检查点缓存: {cache_path}")
+            files = weight_files(weights_path)
+
+            # tokenizer 与权重并行加载
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                tokenizer_future = executor.submit(self._load_tokenizer, AutoTokenizer)
+
+                if ModelConfig.PREFETCH_WEIGHTS and files:
+                    self.load_progress.start('prefetch', sum(os.path.getsize(path) for path in files))
+                    prefetch_weights(files, self.load_progress)
+                    phase_started = self._record_phase('prefetch', phase_started)
+
+                logger.info("加载模型...")
+                # 加载阶段单独统计进度（预读与否都有）：总量为按目标dtype换算的权重大小，
+                # 已加载量按目标设备上新增的内存占用估算；模型ID不是本地目录时总量未知，只报告已加载量
+                self.load_progress.start('weights', expected_weight_bytes(files, dtype_name))
+                # safetensors 权重以内存映射方式直接加载到目标设备，不做随机初始化和额外拷贝
+                with WeightLoadMonitor(self.load_progress, self.device):
+                    self.model = AutoModelForCausalLM.from_pretrained(
+                        weights_path,
+                        torch_dtype=resolve_dtype(dtype_name),
+                        device_map="auto" if self.device == "cuda" else None,
+                        low_cpu_mem_usage=True,
+                        trust_remote_code=True
+                    )
+                self.model.eval()
+                phase_started = self._record_phase('weights', phase_started)
+
+                if self.device == "cpu" and ModelConfig.CPU_PRECISION == 'int8':
+                    self.model = quantize_for_cpu(self.model, ModelConfig.CPU_PRECISION)
+                    phase_started = self._record_phase('quantize', phase_started)
+
+                self.tokenizer = tokenizer_future.result()
+
+            draft_model = None
+            if ModelConfig.DRAFT_MODEL_PATH:
+                draft_model = self._load_draft_model(AutoModelForCausalLM)
+                phase_started = self._record_phase('draft_weights', phase_started)
+
+            self.scheduler = GenerationScheduler(
+                self.model, self.tokenizer, draft_model=draft_model, session_alive=self.sessions.exists
             )
-
-            logger.info("加载模型...")
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype="auto",
-                device_map="auto" if self.device == "cuda" else None,
-                trust_remote_code=True
+            self.context = ContextManager(
+                self.tokenizer, summarize=self._summarize_tokens,
+                max_context=getattr(self.model.config, 'max_position_embeddings', None)
             )
+            if ModelConfig.WARMUP_ENABLED:
+                self._warmup()
+                phase_started = self._record_phase('warmup', phase_started)
 
-            if self.device == "cpu":
-                self.model = self.model.to(self.device)
+            if CacheConfig.SEMANTIC_CACHE_ENABLED:
+                self._init_semantic_cache()
+                self._record_phase('semantic_cache', phase_started)
 
             self.is_loading = False
-            logger.info("模型加载完成！")
+            self.load_progress.finish('ready')
+            self.startup_timings['total'] = round(time.perf_counter() - self._startup_started, 3)
+            logger.info(f"模型加载完成！启动耗时: {self.startup_timings}")
+
+            # 源权重需要转换（指定了dtype或不是safetensors格式）时，写入缓存供下次启动直接加载；
+            # int8 量化后的模型不写缓存
+            quantized = self.device == "cpu" and ModelConfig.CPU_PRECISION == 'int8'
+            if (cache_path and weights_path != cache_path and not quantized
+                    and (dtype_name != 'auto' or not any(f.endswith('.safetensors') for f in files))):
+                save_checkpoint_cache(self.model, cache_path)
 
         except Exception as e:
             logger.error(f"模型加载失败: {str(e)}")
             self.is_loading = False
             self.load_error = str(e)
+            self.load_progress.finish('error')
             raise e
 
+    def _load_draft_model(self, model_class):
+        """加载推测解码用的草稿模型（与主模型相同的dtype和设备），失败时仅禁用推测解码"""
+        try:
+            logger.info(f"加载草稿模型: {ModelConfig.DRAFT_MODEL_PATH}")
+            draft_model = model_class.from_pretrained(
+                ModelConfig.DRAFT_MODEL_PATH,
+                torch_dtype=self.model.dtype,
+                device_map="auto" if self.device == "cuda" else None,
+                low_cpu_mem_usage=True,
+                trust_remote_code=True
+            )
+            draft_model.eval()
+            return draft_model
+        except Exception as e:
+            logger.error(f"草稿模型加载失败，推测解码不可用: {str(e)}")
+            return None
+
+    def _load_tokenizer(self, tokenizer_class):
+        logger.info("加载tokenizer...")
+        started = time.perf_counter()
+        tokenizer = tokenizer_class.from_pretrained(self.model_name, trust_remote_code=True)
+        self.startup_timings['tokenizer'] = round(time.perf_counter() - started, 3)
+        return tokenizer
+
+    def _record_phase(self, phase, started):
+        """记录启动阶段耗时（秒），返回下一阶段的起始时间"""
+        now = time.perf_counter()
+        self.startup_timings[phase] = round(now - started, 3)
+        return now
+
+    def _warmup(self):
+        """生成一个token完成首次前向计算，避免首个用户请求承担初始化开销"""
+        input_ids = self.tokenizer("你好")["input_ids"]
+        self.scheduler.submit(input_ids, max_new_tokens=1, temperature=ModelConfig.DEFAULT_TEMPERATURE).result()
+
+    def _summarize_tokens(self, input_ids, max_new_tokens):
+        """为上下文管理器生成会话历史摘要（在其后台线程中调用）"""
+        return self.scheduler.submit(input_ids, max_new_tokens, temperature=0.3).result()
+
+    def _init_semantic_cache(self):
+        """初始化语义缓存：优先使用配置的本地向量模型，否则使用已加载模型的隐藏状态"""
+        from .semantic_cache import LocalEmbedder, SemanticResponseCache
+
+        try:
+            if CacheConfig.SEMANTIC_CACHE_EMBEDDING_MODEL:
+                embed_fn = LocalEmbedder(CacheConfig.SEMANTIC_CACHE_EMBEDDING_MODEL)
+            else:
+                embed_fn = self._embed_with_chat_model
+            self.semantic_cache = SemanticResponseCache(embed_fn)
+            logger.info("语义缓存已启用")
+        except Exception as e:
+            logger.error(f"语义缓存初始化失败，已禁用: {str(e)}")
+            self.semantic_cache = None
+
+    def _embed_with_chat_model(self, text):
+        """使用对话模型最后一层隐藏状态的均值作为文本向量"""
+        input_ids = self.tokenizer(text)["input_ids"]
+        return self.scheduler.embed(input_ids).result().numpy()
+
     def is_ready(self):
         """检查模型是否已加载完成"""
         return not self.is_loading and self.model is not None and self.load_error is None
 
-    def get_status(self):
-        """获取模型状态"""
+    def get_status(self, detailed=False):
+        """获取模型状态
+
+        detailed 为True时返回字典，附带权重加载进度（已加载字节数、总字节数、预计剩余秒数）。
+        """
         if self.is_loading:
-            return "loading"
+            status = "loading"
         elif self.load_error:
-            return "error"
+            status = "error"
         elif self.model is not None:
-            return "ready"
+            status = "ready"
         else:
-            return "unknown"
+            status = "unknown"
 
-    def generate_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None):
-        """生成AI回复"""
+        if detailed:
+            return {
+                "status": status,
+                "load_progress": self.load_progress.snapshot(),
+                "runtime": dict(self.runtime_info, device=self.device)
+            }
+        return status
+
+    def _register_metrics(self):
+        """注册采集时计算的推理侧指标（调度队列、缓存命中、显存）"""
+        def scheduler_value(read):
+            return read(self.scheduler) if self.scheduler is not None else None
+
+        def cache_requests():
+            values = {}
+            caches = [('response', self.response_cache), ('semantic', self.semantic_cache)]
+            if self.scheduler is not None:
+                caches.append(('prefix_kv', self.scheduler.prefix_cache))
+                caches.append(('session_kv', self.scheduler.session_cache))
+            for name, cache in caches:
+                if cache is not None:
+                    stats = cache.get_stats()
+                    values[(name, 'hit')] = stats['hits']
+                    values[(name, 'miss')] = stats['misses']
+            return values
+
+        def gpu_memory(index):
+            return {(device,): values[index] for device, values in gpu_memory_stats().items()}
+
+        CallbackMetric('chatbot_model_ready', '模型是否已加载完成（1/0）', 'gauge',
+                       lambda: int(self.is_ready()), scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_scheduler_active_sequences', '正在批次中生成的序列数', 'gauge',
+                       lambda: scheduler_value(lambda s: len(s._active) + len(s._speculative)), scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_scheduler_queued_requests', '等待进入批次的请求数', 'gauge',
+                       lambda: scheduler_value(lambda s: s._queue.qsize()), scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_cache_requests_total', '模型侧缓存的查询次数（按缓存和命中与否）', 'counter',
+                       cache_requests, ('cache', 'result'), scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_inference_resident_memory_bytes', '推理进程常驻内存（字节）', 'gauge',
+                       process_memory_bytes, scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_gpu_memory_allocated_bytes', '已分配的显存（字节）', 'gauge',
+                       lambda: gpu_memory(0), ('device',), scope=SCOPE_INFERENCE)
+        CallbackMetric('chatbot_gpu_memory_reserved_bytes', 'PyTorch 缓存分配器预留的显存（字节）', 'gauge',
+                       lambda: gpu_memory(1), ('device',), scope=SCOPE_INFERENCE)
+
+    def _unavailable_response(self):
+        """模型不可用时的统一返回，可用时返回None"""
         if self.is_loading or self.model is None:
             return {
                 "content": "模型正在加载中，请稍后再试...",
@@ -85,56 +325,226 @@ class QwenChatBot:
                 "success": False
             }
 
+        return None
+
+    @staticmethod
+    def _normalize_params(max_new_tokens, temperature, enable_thinking):
+        """填充默认值并限制生成参数范围"""
         max_new_tokens = max_new_tokens or ModelConfig.DEFAULT_MAX_TOKENS
         temperature = temperature or ModelConfig.DEFAULT_TEMPERATURE
         enable_thinking = enable_thinking if enable_thinking is not None else ModelConfig.ENABLE_THINKING
 
         max_new_tokens = min(max_new_tokens, ModelConfig.MAX_TOKENS_LIMIT)
         temperature = max(ModelConfig.TEMPERATURE_MIN, min(temperature, ModelConfig.TEMPERATURE_MAX))
+        return max_new_tokens, temperature, enable_thinking
+
+    def _response_cache_key(self, user_message, max_new_tokens, temperature, enable_thinking, use_cache):
+        """返回回复缓存键；不使用缓存时返回None"""
+        if not use_cache or self.response_cache is None or not self.response_cache.is_cacheable(temperature):
+            return None
+        return self.response_cache.make_key(
+            user_message, str(self.tokenizer.chat_template), enable_thinking, max_new_tokens, temperature
+        )
 
-        try:
-            messages = [{"role": "user", "content": user_message}]
+    def _prepare_generation(self, user_message, enable_thinking, shared_prefixes=None, history=None):
+        """构造输入token
+
+        shared_prefixes 为 user_message 的若干可共享前缀，返回它们在输入token中对应的前缀长度。
+        history 为多轮会话此前的消息列表，与本轮消息一起按对话模板渲染。
+        """
+        messages = (history or []) + [{"role": "user", "content": user_message}]
 
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=enable_thinking
+        text = self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+            enable_thinking=enable_thinking
+        )
+
+        input_ids = self.tokenizer(text)["input_ids"]
+        prefix_lengths = self._shared_prefix_lengths(text, input_ids, user_message, shared_prefixes)
+        return input_ids, prefix_lengths
+
+    def _build_prompt(self, user_message, enable_thinking, max_new_tokens, shared_prefixes=None, session=None):
+        """构造输入token并保证不超过提示词预算，返回 (输入token, 共享前缀长度, 本轮消息token数)
+
+        会话请求先由上下文管理器按缓存的token数调整历史窗口；估算与实际分词结果有出入而仍超出预算时，
+        再逐轮移出最早的历史。超出预算且无法缩减时抛出 ContextOverflow。
+        """
+        if session is None:
+            input_ids, prefix_lengths = self._prepare_generation(user_message, enable_thinking, shared_prefixes)
+            self.context.check(input_ids, max_new_tokens)
+            return input_ids, prefix_lengths, None
+
+        user_tokens = self.context.prepare(session, user_message, enable_thinking, max_new_tokens)
+        while True:
+            input_ids, prefix_lengths = self._prepare_generation(
+                user_message, enable_thinking, shared_prefixes, history=session.history()
             )
+            try:
+                self.context.check(input_ids, max_new_tokens)
+                return input_ids, prefix_lengths, user_tokens
+            except ContextOverflow:
+                if not self.context.shrink(session):
+                    raise
+
+    def _finish_turn(self, session, user_message, user_tokens, content, thinking=None):
+        """把完成的一轮写入会话历史，回答的token数只在此时计算一次
+
+        回复命中输出安全规则时不写入：应用层会拦截这条回复，它也不应再作为历史送入模型。
+        """
+        if self.output_scanner is not None:
+            match = self.output_scanner.scan(content) or self.output_scanner.scan(thinking)
+            if match:
+                logger.warning(f"会话 {session.session_id} 的回复命中安全规则 {match.rule}，不写入历史")
+                return
+        session.append_turn(user_message, content, user_tokens, self.context.count(content))
+
+    @staticmethod
+    def _first_turn(session):
+        """无会话或会话还没有历史：提示词与独立提问相同，可以使用回复缓存"""
+        return session is None or not session.history()
+
+    def _cached_turn(self, session, session_id, user_message, cached):
+        """会话第一轮命中缓存时同样把这一轮写入历史，返回带会话ID的回复"""
+        if session is None:
+            return cached
+        self._finish_turn(
+            session, user_message, self.context.count(user_message), cached["content"], cached.get("thinking")
+        )
+        return dict(cached, session_id=session_id)
+
+    def _shared_prefix_lengths(self, text, input_ids, user_message, shared_prefixes):
+        """计算共享前缀在输入token中的长度（以实际分词结果的公共前缀为准）"""
+        message_start = text.find(user_message)
+        if not shared_prefixes or message_start < 0:
+            return []
+
+        prefix_lengths = []
+        for prefix in shared_prefixes:
+            if not user_message.startswith(prefix):
+                continue
+            prefix_ids = self.tokenizer(text[:message_start + len(prefix)])["input_ids"]
+            length = 0
+            for prefix_id, input_id in zip(prefix_ids, input_ids):
+                if prefix_id != input_id:
+                    break
+                length += 1
+            if length:
+                prefix_lengths.append(length)
+        return prefix_lengths
+
+    def _split_output(self, output_ids, enable_thinking):
+        """按最后一个 </think> 将输出拆分为思维过程和回答"""
+        thinking_content = ""
+        content = ""
+
+        if enable_thinking:
+            try:
+                index = len(output_ids) - output_ids[::-1].index(THINK_END_TOKEN_ID)
+                thinking_content = self.tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
+                content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
+            except ValueError:
+                content = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip("\n")
+        else:
+            content = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip("\n")
 
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+        return content, thinking_content if enable_thinking else None
 
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    **model_inputs,
-                    max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
+    def _discard_session_cache(self, session_id):
+        if self.scheduler is not None:
+            self.scheduler.discard_session(session_id)
 
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
+    def _open_session(self, session_id):
+        """取得会话并开始一轮对话，返回 (会话, 错误回复)；未指定会话时两者均为None"""
+        if session_id is None:
+            return None, None
+        try:
+            session = self.sessions.get(session_id)
+            session.acquire()
+            return session, None
+        except SessionNotFound as e:
+            return None, {"content": str(e), "thinking": None, "success": False, "session_error": "not_found"}
+        except SessionBusy as e:
+            return None, {"content": str(e), "thinking": None, "success": False, "session_error": "busy"}
+
+    def generate_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                          shared_prefixes=None, use_cache=True, semantic_cache=False, decoding=None,
+                          session_id=None):
+        """生成AI回复
+
+        shared_prefixes: user_message 中可被其他请求复用的前缀文本列表，其KV缓存会被保留
+        use_cache: 是否使用回复缓存，命中时返回结果带有 "cached": True
+        semantic_cache: 是否额外使用语义近似缓存（仅适合独立的聊天问题，需同时开启 use_cache）
+        decoding: 解码方式 standard / speculative（草稿模型）/ prompt_lookup（提示词查找），
+                  推测解码不改变输出分布，只影响速度
+        session_id: 多轮会话ID，本轮消息接在会话历史之后生成（仅第一轮使用回复缓存），成功后写入历史；
+                    会话不存在或上一轮未结束时返回带 session_error（not_found / busy）的失败回复；
+                    历史超出提示词预算时由上下文管理器截断或以摘要代替较早的轮次
+
+        提示词超出预算（MAX_PROMPT_TOKENS）且无法缩减时返回带 "context_overflow": True 的失败回复。
+        实际生成的回复带有 usage（token数、排队/预填充/解码的时间点、前向计算耗时），缓存命中的回复没有。
+        """
+        unavailable = self._unavailable_response()
+        if unavailable:
+            return unavailable
+
+        session, session_error = self._open_session(session_id)
+        if session_error:
+            return session_error
 
-            thinking_content = ""
-            content = ""
+        try:
+            max_new_tokens, temperature, enable_thinking = self._normalize_params(
+                max_new_tokens, temperature, enable_thinking
+            )
 
-            if enable_thinking:
-                try:
+            cache_key = self._response_cache_key(
+                user_message, max_new_tokens, temperature, enable_thinking, use_cache
+            ) if self._first_turn(session) else None
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached:
+                    cached["cached"] = True
+                    return self._cached_turn(session, session_id, user_message, cached)
+
+            semantic_entry = None
+            if cache_key and semantic_cache and self.semantic_cache is not None:
+                cached, semantic_entry = self._semantic_lookup(user_message, max_new_tokens, temperature, enable_thinking)
+                if cached:
+                    self.response_cache.put(cache_key, cached)
+                    cached["cached"] = True
+                    return self._cached_turn(session, session_id, user_message, cached)
+
+            started_at = time.time()
+            input_ids, prefix_lengths, user_tokens = self._build_prompt(
+                user_message, enable_thinking, max_new_tokens, shared_prefixes, session
+            )
 
-                    index = len(output_ids) - output_ids[::-1].index(151668)
-                    thinking_content = self.tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
-                    content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
-                except ValueError:
-                    content = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip("\n")
-            else:
-                content = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip("\n")
+            request = self.scheduler.submit(
+                input_ids, max_new_tokens, temperature, prefix_lengths=prefix_lengths, decoding=decoding,
+                session_id=session_id
+            )
+            output_ids = request.result()
 
-            return {
+            content, thinking_content = self._split_output(output_ids, enable_thinking)
+
+            response = {
                 "content": content,
-                "thinking": thinking_content if enable_thinking else None,
-                "success": True
+                "thinking": thinking_content,
+                "success": True,
+                "usage": request.usage()
             }
-
+            if session:
+                self._finish_turn(session, user_message, user_tokens, content, thinking_content)
+                response["session_id"] = session_id
+            if cache_key:
+                self.response_cache.put(cache_key, response)
+            if semantic_entry:
+                self.semantic_cache.put(*semantic_entry, response, generation_seconds=time.time() - started_at)
+            return response
+
+        except ContextOverflow as e:
+            return {"content": str(e), "thinking": None, "success": False, "context_overflow": True}
         except Exception as e:
             logger.error(f"生成回复时发生错误: {str(e)}")
             return {
@@ -142,80 +552,227 @@ class QwenChatBot:
                 "thinking": None,
                 "success": False
             }
+        finally:
+            if session:
+                session.release()
+
+    def _semantic_lookup(self, user_message, max_new_tokens, temperature, enable_thinking):
+        """查询语义缓存，返回 (命中的回复或None, 供写回使用的(向量, 上下文))"""
+        try:
+            context = self.semantic_cache.make_context(enable_thinking, max_new_tokens, temperature)
+            vector = self.semantic_cache.embed(user_message)
+            cached, similarity = self.semantic_cache.lookup(vector, context)
+            if cached:
+                logger.info(f"语义缓存命中，相似度: {similarity:.4f}")
+            return cached, (vector, context)
+        except Exception as e:
+            logger.warning(f"语义缓存查询失败: {str(e)}")
+            return None, None
+
+    def stream_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                        use_cache=True, semantic_cache=False, session_id=None):
+        """流式生成AI回复
+
+        逐步产出事件字典：
+            {"type": "thinking" | "answer", "text": 增量文本}
+            {"type": "done", "content": ..., "thinking": ..., "success": True}
+            {"type": "error", "content": 错误信息, "success": False}
+
+        开启思维模式时，</think> 出现之前的增量标记为 thinking；若模型最终没有输出
+        </think>，done 事件会按非流式接口的规则给出最终的 content/thinking。
+        命中回复缓存时直接按整段输出缓存内容。指定 session_id 时规则同 generate_response，
+        会话错误以带 session_error、超出提示词预算以带 context_overflow 的 error 事件返回。
+        """
+        unavailable = self._unavailable_response()
+        if unavailable:
+            yield {"type": "error", "content": unavailable["content"], "success": False}
+            return
+
+        session, session_error = self._open_session(session_id)
+        if session_error:
+            yield {"type": "error", "content": session_error["content"], "success": False,
+                   "session_error": session_error["session_error"]}
+            return
+
+        request = None
+        try:
+            max_new_tokens, temperature, enable_thinking = self._normalize_params(
+                max_new_tokens, temperature, enable_thinking
+            )
+
+            cache_key = self._response_cache_key(
+                user_message, max_new_tokens, temperature, enable_thinking, use_cache
+            ) if self._first_turn(session) else None
+            cached = self.response_cache.get(cache_key) if cache_key else None
+
+            semantic_entry = None
+            if not cached and cache_key and semantic_cache and self.semantic_cache is not None:
+                cached, semantic_entry = self._semantic_lookup(user_message, max_new_tokens, temperature, enable_thinking)
+                if cached:
+                    self.response_cache.put(cache_key, cached)
+
+            if cached:
+                cached = self._cached_turn(session, session_id, user_message, dict(cached, cached=True))
+                if cached.get("thinking"):
+                    yield {"type": "thinking", "text": cached["thinking"]}
+                yield {"type": "answer", "text": cached["content"]}
+                yield dict(cached, type="done")
+                return
+
+            from .scheduler import IncrementalDecoder
+
+            started_at = time.time()
+            input_ids, _, user_tokens = self._build_prompt(user_message, enable_thinking, max_new_tokens, session=session)
+
+            request = self.scheduler.submit(input_ids, max_new_tokens, temperature, stream=True, session_id=session_id)
+
+            phase = "thinking" if enable_thinking else "answer"
+            decoder = IncrementalDecoder(self.tokenizer)
+
+            for token in request.iter_tokens():
+                if token == THINK_END_TOKEN_ID and phase == "thinking":
+                    text = decoder.flush()
+                    if text:
+                        yield {"type": phase, "text": text}
+                    phase = "answer"
+                    decoder = IncrementalDecoder(self.tokenizer)
+                    continue
+
+                text = decoder.push(token)
+                if text:
+                    yield {"type": phase, "text": text}
+
+            text = decoder.flush()
+            if text:
+                yield {"type": phase, "text": text}
+
+            content, thinking_content = self._split_output(request.result(), enable_thinking)
+            response = {
+                "content": content,
+                "thinking": thinking_content,
+                "success": True
+            }
+            if session:
+                self._finish_turn(session, user_message, user_tokens, content, thinking_content)
+                response["session_id"] = session_id
+            if cache_key:
+                self.response_cache.put(cache_key, response)
+            if semantic_entry:
+                self.semantic_cache.put(*semantic_entry, response, generation_seconds=time.time() - started_at)
+            yield dict(response, type="done")
+
+        except ContextOverflow as e:
+            yield {"type": "error", "content": str(e), "success": False, "context_overflow": True}
+        except Exception as e:
+            logger.error(f"流式生成回复时发生错误: {str(e)}")
+            yield {
+                "type": "error",
+                "content": f"抱歉，生成回复时发生错误: {str(e)}",
+                "success": False
+            }
+        finally:
+            # 调用方提前关闭生成器（客户端断开、输出被拦截）时取消生成，释放批次位置
+            if request is not None and not request.is_done():
+                request.cancel()
+            if session:
+                session.release()
 
     def generate_report_outline(self, topic, requirements):
         """生成报告大纲"""
-        prompt = f"""
-作为经济学专家，请为以下主题生成一个详细的报告大纲：
-
+        prompt = OUTLINE_PROMPT_PREAMBLE + f"""
 主题：{topic}
 具体要求：{requirements}
-
-请按以下JSON格式输出大纲，注意摘要部分请使用纯文本格式，避免使用Markdown符号：
-
-{{
-    "title": "报告标题",
-    "abstract": "报告摘要内容，使用纯文本格式，不要使用星号或其他特殊符号（150字以内）",
-    "sections": [
-        {{
-            "id": "一",
-            "title": "章节标题",
-            "description": "章节描述和要点"
-        }}
-    ]
-}}
-
-要求：
-1. 大纲应该逻辑清晰，层次分明
-2. 每个章节都应该有明确的主题和目标
-3. 整体结构应该符合学术报告的标准格式
-4. 摘要和描述请使用简洁的中文表述，避免使用特殊符号
-5. 请确保输出格式为有效的JSON
-
-示例摘要格式：
-"本报告主要分析2024年中国宏观经济的发展态势。通过对GDP增长、通胀水平和货币政策的综合分析，评估当前经济形势并提出相关建议。"
 """
 
         response = self.generate_response(
             prompt,
             max_new_tokens=1500,
             temperature=0.3,
-            enable_thinking=False
+            enable_thinking=False,
+            shared_prefixes=[OUTLINE_PROMPT_PREAMBLE]
         )
         return response
 
     def generate_section_content(self, section_title, section_description, context):
         """生成章节内容"""
-        prompt = f"""
-作为经济学专家，请为报告章节生成详细内容：
-
+        context_prefix = SECTION_PROMPT_PREAMBLE + f"""
+报告上下文：{context}
+"""
+        prompt = context_prefix + f"""
 章节标题：{section_title}
 章节描述：{section_description}
-报告上下文：{context}
-
-请生成该章节的详细内容，要求：
-1. 内容应该专业、准确、有深度
-2. 结构清晰，逻辑严密
-3. 包含具体的数据分析和案例（如果相关）
-4. 字数控制在800-1500字之间
-5. 使用学术写作风格
-6. 避免使用Markdown格式符号，如 # * ** 等
-7. 如需强调内容，可以使用「重点内容」的方式标注
-
-请直接输出章节内容，使用纯文本格式。
 """
 
         response = self.generate_response(
             prompt,
             max_new_tokens=2000,
             temperature=0.4,
-            enable_thinking=False
+            enable_thinking=False,
+            shared_prefixes=[SECTION_PROMPT_PREAMBLE, context_prefix],
+            decoding=ModelConfig.SECTION_DECODING
         )
         return response
 
+    def get_response_cache_stats(self):
+        """获取回复缓存统计信息"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get_stats()
+
+    def get_semantic_cache_stats(self):
+        """获取语义缓存统计信息"""
+        if self.semantic_cache is None:
+            return None
+        return self.semantic_cache.get_stats()
+
+    def get_scheduler_stats(self):
+        """获取推理调度器统计信息"""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.get_stats()
+
+    def create_session(self):
+        """新建多轮对话会话，返回会话信息"""
+        return self.sessions.create().to_dict()
+
+    def get_session(self, session_id):
+        """获取会话信息（含历史消息），不存在或已过期时返回None"""
+        try:
+            return self.sessions.get(session_id).to_dict()
+        except SessionNotFound:
+            return None
+
+    def delete_session(self, session_id):
+        """删除会话及其保留的KV缓存，返回会话是否存在"""
+        return self.sessions.delete(session_id)
+
+    def get_session_stats(self):
+        """获取会话和会话KV缓存统计信息"""
+        stats = self.sessions.get_stats()
+        stats['kv_cache'] = (self.scheduler.session_cache.get_stats()
+                             if self.scheduler is not None and self.scheduler.session_cache else None)
+        stats['context'] = self.context.get_stats() if self.context is not None else None
+        return stats
+
+    def get_startup_timings(self):
+        """获取各启动阶段耗时（秒）"""
+        return dict(self.startup_timings)
+
+    def get_metrics(self):
+        """推理侧指标（Prometheus 文本格式）"""
+        return REGISTRY.render(SCOPE_INFERENCE)
+
     def cleanup(self):
         """清理资源"""
         try:
+            if self.context is not None:
+                self.context.shutdown()
+                self.context = None
+
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+
             if self.model is not None:
                 del self.model
                 self.model = None
@@ -224,7 +781,8 @@ class QwenChatBot:
                 del self.tokenizer
                 self.tokenizer = None
 
-            if torch.cuda.is_available():
+            if self.device == "cuda":
+                import torch
                 torch.cuda.empty_cache()
 
             logger.info("模型资源已清理")
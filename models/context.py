@@ -0,0 +1,240 @@
+"""
+上下文窗口管理
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+每个请求的提示词不超过token预算。会话历史按消息缓存的token数估算长度，不重新分词；
+超出预算时一次截掉较早的轮次，直到历史只占预算的 CONTEXT_LOW_WATERMARK，此后若干轮的提示词前缀
+保持不变，会话KV缓存可继续复用，每轮预填充量不随对话变长而增长。历史接近预算时在后台摘要将被截掉的
+轮次，截断时以摘要代替原文。
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import ModelConfig
+from utils.metrics import Counter, SCOPE_INFERENCE
+from .session import SUMMARY_MESSAGE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_COMPACTIONS = Counter(
+    'chatbot_context_compactions_total', '会话历史超出提示词预算时的截断次数（按是否使用了摘要）',
+    ('mode',), scope=SCOPE_INFERENCE
+)
+_TRUNCATED = CONTEXT_COMPACTIONS.labels('truncate')
+_SUMMARIZED = CONTEXT_COMPACTIONS.labels('summary')
+
+SUMMARY_PROMPT = """
+请把下面的对话压缩成一段摘要，保留用户的问题和关注点、已给出的关键结论、数据和约定，
+供后续对话参考。只输出摘要正文，不超过300字。
+"""
+
+
+class ContextOverflow(Exception):
+    """消息或提示词超出token预算"""
+
+
+class ContextManager:
+    """按token预算选择会话历史，并在后台摘要较早的轮次
+
+    summarize(prompt_ids, max_new_tokens) 生成摘要并返回输出token，由调用方提供（走推理调度器）。
+    """
+
+    def __init__(self, tokenizer, summarize=None, max_context=None, max_prompt_tokens=None, max_message_tokens=None,
+                 low_watermark=None, summary_trigger=None, summary_max_tokens=None):
+        self.tokenizer = tokenizer
+        self.summarize = summarize
+        self.max_context = max_context
+        self.max_prompt_tokens = max_prompt_tokens or ModelConfig.MAX_PROMPT_TOKENS
+        self.max_message_tokens = max_message_tokens or ModelConfig.MAX_MESSAGE_TOKENS
+        self.low_watermark = low_watermark if low_watermark is not None else ModelConfig.CONTEXT_LOW_WATERMARK
+        self.summary_trigger = summary_trigger if summary_trigger is not None else ModelConfig.CONTEXT_SUMMARY_TRIGGER
+        self.summary_max_tokens = summary_max_tokens or ModelConfig.CONTEXT_SUMMARY_MAX_TOKENS
+
+        # 每条消息在正文之外由对话模板加上的token数（角色名可能被分成多个token，按角色分别计算）
+        base = self._template_tokens([])
+        self.message_overhead = {
+            role: self._template_tokens([{"role": role, "content": ""}]) - base
+            for role in ('user', 'assistant', 'system')
+        }
+        self._prompt_overhead = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='context-summary')
+        self._lock = threading.Lock()
+
+        self.compactions = 0
+        self.dropped_turns = 0
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def count(self, text):
+        """文本正文的token数"""
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _render(self, messages, add_generation_prompt=False, enable_thinking=False):
+        text = self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=add_generation_prompt, enable_thinking=enable_thinking
+        )
+        return self.tokenizer(text)["input_ids"]
+
+    def _template_tokens(self, messages):
+        """system + messages 经对话模板渲染后的token数（系统消息放在最前，保证各角色按历史中的格式渲染）"""
+        return len(self._render([{"role": "system", "content": ""}, {"role": "user", "content": ""}] + messages))
+
+    def prompt_overhead(self, enable_thinking):
+        """一条空的用户消息加上生成提示（含思维模式标记）的token数"""
+        overhead = self._prompt_overhead.get(enable_thinking)
+        if overhead is None:
+            overhead = len(self._render([{"role": "user", "content": ""}], True, enable_thinking))
+            self._prompt_overhead[enable_thinking] = overhead
+        return overhead
+
+    def prompt_budget(self, max_new_tokens):
+        """本次请求的提示词token预算"""
+        budget = self.max_prompt_tokens
+        if self.max_context:
+            budget = min(budget, self.max_context - max_new_tokens)
+        return budget
+
+    def check(self, input_ids, max_new_tokens):
+        """提示词超出预算时抛出 ContextOverflow"""
+        budget = self.prompt_budget(max_new_tokens)
+        if len(input_ids) > budget:
+            raise ContextOverflow(f"提示词长度 {len(input_ids)} tokens 超出预算 {budget} tokens，请缩短输入")
+
+    def _window_tokens(self, session, start):
+        """按缓存的token数估算 start 之后的消息渲染后的长度"""
+        return sum(
+            count + self.message_overhead[message['role']]
+            for message, count in zip(session.messages[start:], session.token_counts[start:])
+        )
+
+    def _history_tokens(self, session):
+        """估算送入模型的历史（摘要 + 上下文窗口）渲染后的长度"""
+        tokens = self._window_tokens(session, session.window_start)
+        if session.summary:
+            tokens += session.summary_tokens + self.message_overhead['system']
+        return tokens
+
+    def summary_limit(self, budget):
+        """摘要的最大token数，不超过低水位的三分之一，为保留的近期轮次留出空间"""
+        return max(1, min(self.summary_max_tokens, int(budget * self.low_watermark / 3)))
+
+    def prepare(self, session, user_message, enable_thinking, max_new_tokens):
+        """为会话的新一轮消息调整上下文窗口，返回本轮消息的token数
+
+        调用方须持有会话（session.acquire）。
+        """
+        user_tokens = self.count(user_message)
+        if user_tokens > self.max_message_tokens:
+            raise ContextOverflow(f"消息过长（{user_tokens} tokens），请控制在 {self.max_message_tokens} tokens 以内")
+
+        budget = self.prompt_budget(max_new_tokens)
+        fixed = self.prompt_overhead(enable_thinking) + user_tokens
+        if fixed > budget:
+            raise ContextOverflow(f"消息过长（{user_tokens} tokens），超出提示词预算 {budget} tokens")
+
+        used = fixed + self._history_tokens(session)
+        if used > budget:
+            self.compact(session, fixed, budget)
+        elif self.summarize is not None and self.summary_trigger > 0 and used > budget * self.summary_trigger:
+            self._schedule_summary(session, fixed, budget)
+        return user_tokens
+
+    def compact(self, session, fixed, budget):
+        """截掉较早的轮次，直到历史加本轮消息不超过预算的低水位；有后台摘要结果时以摘要代替"""
+        target = budget * self.low_watermark
+        start = session.window_start
+        # 摘要覆盖到 cut 之前的全部消息；摘要完成前已被截断移出的轮次也由它代替
+        pending, session.pending_summary = session.pending_summary, None
+        summarized = pending is not None
+        if summarized:
+            session.summary, session.summary_tokens, cut = pending
+            session.window_start = max(start, cut)
+
+        # 按整轮（用户消息 + 回答）截断，窗口总是从用户消息开始
+        while session.window_start < len(session.messages) and fixed + self._history_tokens(session) > target:
+            session.window_start += 2
+        if session.summary and fixed + self._history_tokens(session) > budget:
+            session.summary, session.summary_tokens = None, 0
+
+        dropped = (session.window_start - start) // 2
+        with self._lock:
+            self.compactions += 1
+            self.dropped_turns += dropped
+            self.summaries += int(summarized)
+        (_SUMMARIZED if summarized else _TRUNCATED).inc()
+        logger.info(
+            f"会话 {session.session_id} 历史超出提示词预算 {budget} tokens，移出最早的 {dropped} 轮"
+            f"{'（以摘要代替）' if summarized else ''}"
+        )
+
+    def shrink(self, session):
+        """估算不准导致实际提示词超出预算时再移出一轮，返回是否还有可移出的历史"""
+        if session.window_start < len(session.messages):
+            session.window_start += 2
+            return True
+        if session.summary:
+            session.summary, session.summary_tokens = None, 0
+            return True
+        return False
+
+    def _schedule_summary(self, session, fixed, budget):
+        """选出截断后将被移出的轮次，在后台生成摘要（连同之前的摘要一起压缩）"""
+        if session.summarizing or session.pending_summary is not None:
+            return
+
+        # 预留摘要本身的长度，使以摘要代替后历史不超过低水位
+        summary_limit = self.summary_limit(budget)
+        target = budget * self.low_watermark - summary_limit - self.message_overhead['system']
+        cut = session.window_start
+        while cut < len(session.messages) and fixed + self._window_tokens(session, cut) > target:
+            cut += 2
+        if cut <= session.window_start:
+            return
+
+        session.summarizing = True
+        lines = [
+            f"{'用户' if message['role'] == 'user' else '助手'}：{message['content']}"
+            for message in session.messages[session.window_start:cut]
+        ]
+        if session.summary:
+            lines.insert(0, f"此前的摘要：{session.summary}")
+        self._executor.submit(self._summarize, session, lines, cut, summary_limit)
+
+    def _summarize(self, session, lines, cut, max_new_tokens):
+        try:
+            budget = self.prompt_budget(max_new_tokens)
+            while True:
+                prompt_ids = self._render(
+                    [{"role": "user", "content": SUMMARY_PROMPT + "\n" + "\n".join(lines)}], True, False
+                )
+                # 摘要提示词超出预算时舍弃最早的内容
+                if len(prompt_ids) <= budget or len(lines) <= 1:
+                    break
+                lines = lines[1:]
+            self.check(prompt_ids, max_new_tokens)
+            output_ids = self.summarize(prompt_ids, max_new_tokens)
+            summary = self.tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+            if summary:
+                session.pending_summary = (summary, self.count(SUMMARY_MESSAGE_PREFIX + summary), cut)
+        except Exception as e:
+            with self._lock:
+                self.summary_failures += 1
+            logger.warning(f"会话 {session.session_id} 摘要生成失败，届时直接截断: {str(e)}")
+        finally:
+            session.summarizing = False
+
+    def get_stats(self):
+        """获取上下文管理统计信息"""
+        with self._lock:
+            return {
+                'max_prompt_tokens': self.max_prompt_tokens,
+                'max_message_tokens': self.max_message_tokens,
+                'compactions': self.compactions,
+                'dropped_turns': self.dropped_turns,
+                'summaries': self.summaries,
+                'summary_failures': self.summary_failures
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,274 @@
+"""
+报告导出缓存
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import CacheConfig
+from utils.metrics import Histogram, RENDER_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# 渲染逻辑变化时递增，使旧的缓存文件失效
+RENDERER_VERSION = '2'
+
+RENDER_SECONDS = Histogram(
+    'chatbot_export_render_seconds', '报告导出文件（docx/md）的渲染耗时（秒）', RENDER_BUCKETS, ('format',)
+)
+
+
+class ExportArtifact:
+    """一次渲染的结果"""
+
+    __slots__ = ('data', 'etag', 'fmt')
+
+    def __init__(self, data, etag, fmt):
+        self.data = data
+        self.etag = etag
+        self.fmt = fmt
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+def content_hash(report_data, fmt):
+    """按影响渲染结果的报告内容计算摘要，报告内容变化后摘要随之变化"""
+    completed_at = report_data.get('completed_at')
+    payload = {
+        'renderer': RENDERER_VERSION,
+        'format': fmt,
+        'id': report_data.get('id'),
+        'topic': report_data.get('topic'),
+        'outline': report_data.get('outline'),
+        'sections': {str(key): value for key, value in (report_data.get('sections') or {}).items()},
+        'completed_at': completed_at.isoformat() if hasattr(completed_at, 'isoformat') else completed_at
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ExportCache:
+    """已渲染导出文件的两级缓存
+
+    - 内存层：按 (报告ID, 格式) 保存最近一次渲染结果，按字节上限LRU淘汰；
+    - 磁盘层（可选）：多个工作进程共享的目录，文件名包含内容摘要，同一内容各进程下载到的字节完全一致，
+      ETag 因此在进程间保持稳定；按字节上限淘汰最久未访问的文件。
+    同一报告的并发首次下载只渲染一次。
+    """
+
+    def __init__(self, max_bytes=None, cache_dir=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None else CacheConfig.EXPORT_CACHE_MAX_MB * 1024 * 1024
+        self.cache_dir = cache_dir if cache_dir is not None else CacheConfig.EXPORT_CACHE_DIR
+        self.max_disk_bytes = (max_disk_bytes if max_disk_bytes is not None
+                               else CacheConfig.EXPORT_CACHE_DISK_MAX_MB * 1024 * 1024)
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # key -> [渲染锁, 持有或等待该锁的线程数]，没有线程使用时才删除，保证同一key始终只有一把锁
+        self._render_locks = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.render_seconds = 0.0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _safe_id(report_id):
+        return re.sub(r'[^0-9A-Za-z_-]', '_', str(report_id))
+
+    def _disk_path(self, report_id, fmt, digest):
+        return os.path.join(self.cache_dir, f'{self._safe_id(report_id)}-{digest[:32]}.{fmt}')
+
+    def get_or_render(self, report_id, fmt, report_data, render, store=True):
+        """返回报告的导出结果，缓存未命中时调用 render(report_data) 生成字节内容
+
+        store=False 时只读取缓存、不写入新结果（批量导出时避免挤掉常用的缓存项）。
+        """
+        digest = content_hash(report_data, fmt)
+        key = (report_id, fmt)
+
+        artifact = self._get_memory(key, digest)
+        if artifact is not None:
+            return artifact
+
+        with self._lock:
+            entry = self._render_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                # 等待期间其他线程可能已完成渲染
+                artifact = self._get_memory(key, digest, count_miss=False)
+                if artifact is not None:
+                    return artifact
+
+                artifact = self._read_disk(report_id, fmt, digest)
+                if artifact is None:
+                    started = time.perf_counter()
+                    data = render(report_data)
+                    elapsed = time.perf_counter() - started
+                    artifact = ExportArtifact(data, digest, fmt)
+                    with self._lock:
+                        self.render_seconds += elapsed
+                    RENDER_SECONDS.labels(fmt).observe(elapsed)
+                    logger.info(f"渲染导出文件 - Report ID: {report_id}, 格式: {fmt}, "
+                                f"大小: {artifact.size} 字节, 耗时 {elapsed * 1000:.0f}ms")
+                    if store:
+                        self._write_disk(report_id, artifact)
+
+                if store:
+                    self._put_memory(key, artifact)
+                return artifact
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._render_locks[key]
+
+    def _get_memory(self, key, digest, count_miss=True):
+        with self._lock:
+            artifact = self._entries.get(key)
+            if artifact is not None and artifact.etag == digest:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return artifact
+            if artifact is not None:
+                # 报告内容已变化，旧的渲染结果作废
+                self._remove(key)
+                self.invalidations += 1
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def _put_memory(self, key, artifact):
+        if artifact.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = artifact
+            self._total_bytes += artifact.size
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        artifact = self._entries.pop(key)
+        self._total_bytes -= artifact.size
+
+    def _read_disk(self, report_id, fmt, digest):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(report_id, fmt, digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        return ExportArtifact(data, digest, fmt)
+
+    def _write_disk(self, report_id, artifact):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(report_id, artifact.fmt, artifact.etag)
+        tmp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(artifact.data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入导出缓存失败: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        # 同一报告同一格式的旧版本文件不再需要
+        prefix = f'{self._safe_id(report_id)}-'
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith(f'.{artifact.fmt}') and name != os.path.basename(path):
+                self._remove_file(os.path.join(self.cache_dir, name))
+        self._enforce_disk_budget()
+
+    def _enforce_disk_budget(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if '.tmp-' in name:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        files.sort()
+        while total > self.max_disk_bytes and files:
+            _, size, path = files.pop(0)
+            self._remove_file(path)
+            total -= size
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def invalidate(self, report_id):
+        """删除报告的全部导出缓存（报告被删除或清理时调用）"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == report_id]:
+                self._remove(key)
+                self.invalidations += 1
+
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            prefix = f'{self._safe_id(report_id)}-'
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix):
+                    self._remove_file(os.path.join(self.cache_dir, name))
+
+    def clear(self):
+        """清空内存缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'render_seconds': round(self.render_seconds, 3),
+                'cache_dir': self.cache_dir or None
+            }
@@ -0,0 +1,253 @@
+"""
+KV缓存管理
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from config import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+
+def layers_nbytes(layers):
+    """计算 [(key, value), ...] 形式KV缓存占用的字节数"""
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+
+class PrefixKVCache:
+    """按token前缀索引的KV缓存，超出内存预算时按LRU淘汰
+
+    缓存项以前缀token元组为键，值为该前缀预填充后的KV张量（batch=1）。
+    查找时按已缓存的前缀长度从长到短逐一做哈希匹配，返回命中的最长前缀。
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None else ModelConfig.PREFIX_CACHE_MAX_MB * 1024 * 1024
+        self._entries = OrderedDict()
+        self._length_counts = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.evictions = 0
+
+    def lookup(self, input_ids):
+        """查找 input_ids 的最长已缓存前缀，返回 (前缀长度, KV层列表)，未命中返回 (0, None)
+
+        前缀长度严格小于 input_ids 长度，保证至少还有一个token需要前向计算以得到logits。
+        """
+        with self._lock:
+            for length in sorted(self._length_counts, reverse=True):
+                if length >= len(input_ids):
+                    continue
+                key = tuple(input_ids[:length])
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_tokens += length
+                    return length, entry[0]
+
+            self.misses += 1
+            return 0, None
+
+    def put(self, token_ids, layers):
+        """缓存前缀对应的KV张量"""
+        key = tuple(token_ids)
+        nbytes = layers_nbytes(layers)
+        if nbytes > self.max_bytes:
+            logger.debug(f"前缀KV缓存过大，跳过缓存: {len(key)} tokens, {nbytes} bytes")
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+
+            self._entries[key] = (layers, nbytes)
+            self._length_counts[len(key)] = self._length_counts.get(len(key), 0) + 1
+            self._total_bytes += nbytes
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                self._evict_oldest()
+
+        logger.debug(f"缓存前缀KV: {len(key)} tokens, {nbytes / 1024 / 1024:.1f} MB")
+        return True
+
+    def _evict_oldest(self):
+        key, (_, nbytes) = self._entries.popitem(last=False)
+        self._total_bytes -= nbytes
+        self._length_counts[len(key)] -= 1
+        if not self._length_counts[len(key)]:
+            del self._length_counts[len(key)]
+        self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._length_counts.clear()
+            self._total_bytes = 0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'saved_tokens': self.saved_tokens,
+                'evictions': self.evictions
+            }
+
+
+def common_prefix_length(a, b):
+    """两个token序列的公共前缀长度"""
+    length = min(len(a), len(b))
+    for index in range(length):
+        if a[index] != b[index]:
+            return index
+    return length
+
+
+class _SessionEntry:
+    __slots__ = ('token_ids', 'layers', 'nbytes', 'offloaded')
+
+    def __init__(self, token_ids, layers, nbytes):
+        self.token_ids = token_ids
+        self.layers = layers
+        self.nbytes = nbytes
+        self.offloaded = False
+
+
+class SessionKVCache:
+    """按会话保存对话KV缓存：会话每轮结束时保存“提示词 + 回复”的KV，下一轮只需预填充新增的token
+
+    常驻显存的缓存项超出预算时按LRU淘汰；设置了转移预算且模型在GPU上时，被淘汰的缓存转移到CPU内存，
+    下一轮取用时再拷回GPU，否则直接丢弃。缓存项在取用时移出，本轮结束后由调度器写回更新后的KV。
+    """
+
+    def __init__(self, max_bytes=None, offload_bytes=None):
+        self.max_bytes = (max_bytes if max_bytes is not None
+                          else ModelConfig.SESSION_KV_CACHE_MAX_MB * 1024 * 1024)
+        self.offload_bytes = (offload_bytes if offload_bytes is not None
+                              else ModelConfig.SESSION_KV_OFFLOAD_MAX_MB * 1024 * 1024)
+        self._resident = OrderedDict()
+        self._offloaded = OrderedDict()
+        self._resident_bytes = 0
+        self._offloaded_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.offloads = 0
+        self.restores = 0
+        self.evictions = 0
+
+    def take(self, session_id, input_ids, device):
+        """取出会话的KV缓存，返回与 input_ids 的公共前缀长度及对应的KV层列表，未命中返回 (0, None)
+
+        前缀长度严格小于 input_ids 长度，保证至少还有一个token需要前向计算以得到logits。
+        """
+        with self._lock:
+            entry = self._pop(session_id)
+            length = common_prefix_length(entry.token_ids, input_ids) if entry is not None else 0
+            length = min(length, len(input_ids) - 1)
+            if length <= 0:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            self.saved_tokens += length
+            if entry.offloaded:
+                self.restores += 1
+
+        layers = entry.layers
+        if entry.offloaded:
+            layers = [(k.to(device), v.to(device)) for k, v in layers]
+        if length < len(entry.token_ids):
+            layers = [(k[:, :, :length], v[:, :, :length]) for k, v in layers]
+        return length, layers
+
+    def put(self, session_id, token_ids, layers):
+        """保存会话本轮结束时的KV缓存（覆盖旧的）"""
+        nbytes = layers_nbytes(layers)
+        if nbytes > self.max_bytes:
+            logger.debug(f"会话KV缓存过大，跳过缓存: {session_id}, {len(token_ids)} tokens, {nbytes} bytes")
+            self.discard(session_id)
+            return False
+
+        with self._lock:
+            self._pop(session_id)
+            self._resident[session_id] = _SessionEntry(tuple(token_ids), layers, nbytes)
+            self._resident_bytes += nbytes
+
+            while self._resident_bytes > self.max_bytes and self._resident:
+                evicted_id, entry = self._resident.popitem(last=False)
+                self._resident_bytes -= entry.nbytes
+                self._offload(evicted_id, entry)
+        return True
+
+    def _offload(self, session_id, entry):
+        """把淘汰的缓存项转移到CPU内存；模型在CPU上或超出转移预算时丢弃"""
+        if self.offload_bytes <= 0 or entry.nbytes > self.offload_bytes or entry.layers[0][0].device.type == 'cpu':
+            self.evictions += 1
+            return
+
+        entry.layers = [(k.to('cpu'), v.to('cpu')) for k, v in entry.layers]
+        entry.offloaded = True
+        self._offloaded[session_id] = entry
+        self._offloaded_bytes += entry.nbytes
+        self.offloads += 1
+
+        while self._offloaded_bytes > self.offload_bytes and self._offloaded:
+            _, dropped = self._offloaded.popitem(last=False)
+            self._offloaded_bytes -= dropped.nbytes
+            self.evictions += 1
+
+    def _pop(self, session_id):
+        entry = self._resident.pop(session_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry.nbytes
+            return entry
+        entry = self._offloaded.pop(session_id, None)
+        if entry is not None:
+            self._offloaded_bytes -= entry.nbytes
+        return entry
+
+    def discard(self, session_id):
+        """删除会话的KV缓存（会话删除或过期时调用）"""
+        with self._lock:
+            return self._pop(session_id) is not None
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._resident.clear()
+            self._offloaded.clear()
+            self._resident_bytes = 0
+            self._offloaded_bytes = 0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'resident_sessions': len(self._resident),
+                'resident_bytes': self._resident_bytes,
+                'max_bytes': self.max_bytes,
+                'offloaded_sessions': len(self._offloaded),
+                'offloaded_bytes': self._offloaded_bytes,
+                'offload_max_bytes': self.offload_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'saved_tokens': self.saved_tokens,
+                'offloads': self.offloads,
+                'restores': self.restores,
+                'evictions': self.evictions
+            }
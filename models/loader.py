@@ -0,0 +1,326 @@
+"""
+模型加载加速
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import ModelConfig, DEVICE
+from utils.metrics import process_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_SUFFIXES = ('.safetensors', '.bin', '.pt', '.pth')
+PREFETCH_CHUNK_SIZE = 16 * 1024 * 1024
+# safetensors 文件头中浮点张量的dtype及其元素字节数（整数张量加载时不转换dtype）
+SAFETENSORS_FLOAT_BYTES = {'F64': 8, 'F32': 4, 'F16': 2, 'BF16': 2, 'F8_E4M3': 1, 'F8_E5M2': 1}
+
+
+class LoadProgress:
+    """记录权重加载进度（字节数）并估算剩余时间"""
+
+    def __init__(self):
+        self.phase = 'pending'
+        self.total_bytes = 0
+        self.loaded_bytes = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def start(self, phase, total_bytes=0):
+        with self._lock:
+            self.phase = phase
+            self.total_bytes = total_bytes
+            self.loaded_bytes = 0
+            self.started_at = time.perf_counter()
+            self.finished_at = None
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+
+    def finish(self, phase):
+        """加载结束（ready / error），之后耗时和速度不再变化"""
+        with self._lock:
+            self.phase = phase
+            self.finished_at = time.perf_counter()
+
+    def advance(self, nbytes):
+        with self._lock:
+            self.loaded_bytes += nbytes
+
+    def set_loaded(self, nbytes):
+        """按外部估算设置已加载字节数（不超过总量，不回退）"""
+        with self._lock:
+            if self.total_bytes:
+                nbytes = min(nbytes, self.total_bytes)
+            self.loaded_bytes = max(self.loaded_bytes, nbytes)
+
+    def complete(self):
+        """当前阶段的字节已全部加载"""
+        with self._lock:
+            self.loaded_bytes = max(self.loaded_bytes, self.total_bytes)
+
+    def snapshot(self):
+        """返回进度快照，eta_seconds 按当前平均速度估算"""
+        with self._lock:
+            now = self.finished_at or time.perf_counter()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            rate = self.loaded_bytes / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.total_bytes - self.loaded_bytes, 0)
+            return {
+                'phase': self.phase,
+                'loaded_bytes': self.loaded_bytes,
+                'total_bytes': self.total_bytes,
+                'percent': round(self.loaded_bytes / self.total_bytes * 100, 1) if self.total_bytes else 0.0,
+                'bytes_per_second': round(rate),
+                'elapsed_seconds': round(elapsed, 1),
+                'eta_seconds': round(remaining / rate, 1) if rate > 0 and remaining else None
+            }
+
+
+def weight_files(model_dir):
+    """列出模型目录下的权重文件"""
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(
+        os.path.join(model_dir, name) for name in os.listdir(model_dir)
+        if name.endswith(WEIGHT_SUFFIXES) and os.path.isfile(os.path.join(model_dir, name))
+    )
+
+
+def prefetch_weights(files, progress, threads=None):
+    """多线程顺序读取权重分片，使其进入页缓存
+
+    safetensors 以内存映射方式加载，预读后 from_pretrained 直接命中页缓存，
+    而并行的顺序读比按张量随机缺页快得多；读取过程同时用于统计预读阶段的进度。
+    """
+    threads = threads or ModelConfig.LOAD_THREADS
+
+    def read_file(path):
+        buffer = bytearray(PREFETCH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                nbytes = f.readinto(view)
+                if not nbytes:
+                    break
+                progress.advance(nbytes)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(files)))) as executor:
+        list(executor.map(read_file, files))
+
+
+def expected_weight_bytes(files, dtype_name):
+    """权重按目标dtype加载后的字节数：safetensors 按文件头中各张量的大小换算浮点张量的dtype，其余格式按文件大小"""
+    itemsize = None
+    if dtype_name and dtype_name != 'auto':
+        import torch
+        itemsize = torch.empty((), dtype=getattr(torch, dtype_name)).element_size()
+
+    total = 0
+    for path in files:
+        if itemsize is None or not path.endswith('.safetensors'):
+            total += os.path.getsize(path)
+            continue
+        try:
+            with open(path, 'rb') as f:
+                (length,) = struct.unpack('<Q', f.read(8))
+                header = json.loads(f.read(length))
+        except (OSError, ValueError, struct.error) as e:
+            logger.debug(f"读取safetensors文件头失败，按文件大小统计: {path}, {e}")
+            total += os.path.getsize(path)
+            continue
+        for name, info in header.items():
+            if name == '__metadata__':
+                continue
+            start, end = info['data_offsets']
+            source_size = SAFETENSORS_FLOAT_BYTES.get(info['dtype'])
+            total += (end - start) // source_size * itemsize if source_size else end - start
+    return total
+
+
+class WeightLoadMonitor:
+    """from_pretrained 期间按目标设备上新增的内存占用估算已加载的权重字节数
+
+    from_pretrained 不提供逐分片的进度回调；权重逐个分片拷贝到GPU（或在CPU上转换dtype）时，
+    已分配的显存 / 进程常驻内存随之增长。以内存映射直接使用的CPU权重在首次访问时才读入，
+    这部分进度在加载结束时一次补齐。
+    """
+
+    def __init__(self, progress, device, interval=0.5):
+        self.progress = progress
+        self.device = device
+        self.interval = interval
+        self._baseline = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _memory(self):
+        if self.device == 'cuda':
+            import torch
+            return sum(torch.cuda.memory_allocated(index) for index in range(torch.cuda.device_count()))
+        return process_memory_bytes()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.progress.set_loaded(self._memory() - self._baseline)
+
+    def __enter__(self):
+        self._baseline = self._memory()
+        self._thread = threading.Thread(target=self._run, name='weight-load-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        if exc_type is None:
+            self.progress.complete()
+
+
+def resolve_dtype(name):
+    """将配置中的dtype名称转换为 from_pretrained 可接受的值"""
+    if not name or name == 'auto':
+        return 'auto'
+    import torch
+    return getattr(torch, name)
+
+
+def checkpoint_cache_path(model_path, dtype_name):
+    """预转换检查点缓存目录；未启用缓存或源路径不是本地目录时返回None
+
+    缓存目录名由源路径、权重文件的大小与修改时间以及目标dtype共同决定，源模型更新后自动失效。
+    """
+    if not ModelConfig.CHECKPOINT_CACHE_DIR or not os.path.isdir(model_path):
+        return None
+
+    fingerprint = hashlib.sha1(os.path.abspath(model_path).encode('utf-8'))
+    for path in weight_files(model_path):
+        stat = os.stat(path)
+        fingerprint.update(f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    fingerprint.update((dtype_name or 'auto').encode('utf-8'))
+
+    name = f'{os.path.basename(os.path.normpath(model_path))}-{dtype_name or "auto"}-{fingerprint.hexdigest()[:12]}'
+    return os.path.join(ModelConfig.CHECKPOINT_CACHE_DIR, name)
+
+
+def save_checkpoint_cache(model, cache_path):
+    """以safetensors格式保存已转换dtype的模型，先写临时目录再原子替换"""
+    tmp_path = f'{cache_path}.tmp-{os.getpid()}'
+    try:
+        started = time.perf_counter()
+        model.save_pretrained(tmp_path, safe_serialization=True)
+        os.replace(tmp_path, cache_path)
+        logger.info(f"检查点缓存已写入: {cache_path}，耗时 {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        logger.warning(f"写入检查点缓存失败: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def select_device():
+    """根据 config.DEVICE（auto / cuda / cpu）选择推理设备"""
+    import torch
+
+    if DEVICE == 'cpu':
+        return 'cpu'
+    if DEVICE.startswith('cuda') and not torch.cuda.is_available():
+        logger.warning(f"配置的设备 {DEVICE} 不可用，改用CPU")
+        return 'cpu'
+    if DEVICE.startswith('cuda'):
+        return 'cuda'
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def parse_core_list(spec):
+    """解析核心列表，如 "0-7,16-23" """
+    cores = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cores.update(range(int(start), int(end) + 1))
+        else:
+            cores.add(int(part))
+    return cores
+
+
+def bf16_supported():
+    """当前CPU是否支持bf16矩阵运算（AVX512-BF16 / AMX）"""
+    import torch
+
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_cpu_runtime():
+    """设置CPU推理的核心绑定和线程数，需在首次推理前于加载线程中调用
+
+    核心绑定作用于调用线程，之后创建的调度线程及其计算线程池会继承该设置。
+    """
+    import torch
+
+    cores = None
+    if ModelConfig.CPU_AFFINITY and hasattr(os, 'sched_setaffinity'):
+        cores = parse_core_list(ModelConfig.CPU_AFFINITY)
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            logger.warning(f"绑定CPU核心失败: {e}")
+            cores = None
+
+    threads = ModelConfig.CPU_THREADS or (len(cores) if cores else 0)
+    if threads:
+        torch.set_num_threads(threads)
+    if ModelConfig.CPU_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(ModelConfig.CPU_INTEROP_THREADS)
+        except RuntimeError as e:
+            logger.warning(f"设置inter-op线程数失败（需在首次并行计算前设置）: {e}")
+
+    info = {
+        'threads': torch.get_num_threads(),
+        'interop_threads': torch.get_num_interop_threads(),
+        'affinity': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+    }
+    logger.info(f"CPU推理线程配置: {info}")
+    return info
+
+
+def cpu_load_dtype(precision):
+    """CPU精度模式对应的加载dtype名称
+
+    int8 动态量化需要先以float32加载；bf16 在不支持的CPU上回退为float32。
+    """
+    if precision == 'int8' or precision == 'fp32':
+        return 'float32'
+    if precision == 'bf16':
+        if bf16_supported():
+            return 'bfloat16'
+        logger.warning("当前CPU不支持bf16加速，改用float32")
+        return 'float32'
+    return ModelConfig.MODEL_DTYPE
+
+
+def quantize_for_cpu(model, precision):
+    """int8 模式下对全部线性层做动态量化（权重int8，激活按批动态量化）"""
+    if precision != 'int8':
+        return model
+
+    import torch
+
+    started = time.perf_counter()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"线性层动态int8量化完成，耗时 {time.perf_counter() - started:.1f}s")
+    return model
@@ -0,0 +1,440 @@
+"""
+独立模型推理服务
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+模型只在本进程中加载一份，Flask 工作进程通过 Unix 套接字调用。
+每帧为 4 字节大端长度前缀 + 紧凑 JSON 请求/应答。
+
+启动: python -m models.model_server [套接字路径]
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+from config import ModelConfig, MODEL_PATH
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# 允许远程调用的方法；STREAM_METHODS 的结果按事件逐帧返回
+REMOTE_METHODS = frozenset({
+    'generate_response',
+    'generate_report_outline',
+    'generate_section_content',
+    'get_response_cache_stats',
+    'get_semantic_cache_stats',
+    'get_scheduler_stats',
+    'get_startup_timings',
+    'get_metrics',
+    'create_session',
+    'get_session',
+    'delete_session',
+    'get_session_stats',
+})
+STREAM_METHODS = frozenset({'stream_response'})
+
+
+class ModelServerError(Exception):
+    """模型服务调用失败"""
+
+
+def send_frame(sock, payload):
+    """发送一帧"""
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def recv_frame(sock):
+    """接收一帧，对端关闭连接时返回None"""
+    header = _recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ModelServerError(f"帧长度超出限制: {length}")
+    data = _recv_exact(sock, length)
+    if data is None:
+        raise ModelServerError("连接在帧传输中途关闭")
+    return json.loads(data)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            if buffer:
+                raise ModelServerError("连接在帧传输中途关闭")
+            return None
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+class ModelServer:
+    """模型推理服务端：每个连接一个线程，并发请求由 QwenChatBot 的调度器合并批处理"""
+
+    def __init__(self, socket_path=None, chatbot=None):
+        self.socket_path = socket_path or ModelConfig.MODEL_SERVER_SOCKET
+        if chatbot is None:
+            from .chatbot import QwenChatBot
+            chatbot = QwenChatBot()
+        self.chatbot = chatbot
+        self._server_socket = None
+        self._running = False
+
+    def serve_forever(self):
+        """监听套接字并处理连接，直到 shutdown() 被调用"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+
+        self._server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server_socket.bind(self.socket_path)
+        self._server_socket.listen(128)
+        self._running = True
+        logger.info(f"模型服务已启动: {self.socket_path}")
+
+        try:
+            while self._running:
+                try:
+                    conn, _ = self._server_socket.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            self._close_server_socket()
+
+    def shutdown(self):
+        """停止服务"""
+        self._running = False
+        self._close_server_socket()
+
+    def _close_server_socket(self):
+        if self._server_socket is not None:
+            try:
+                self._server_socket.close()
+            except OSError:
+                pass
+            self._server_socket = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def _status(self):
+        detailed = self.chatbot.get_status(detailed=True)
+        return {
+            'ready': self.chatbot.is_ready(),
+            'status': detailed['status'],
+            'load_progress': detailed['load_progress'],
+            'runtime': detailed['runtime'],
+            'is_loading': self.chatbot.is_loading,
+            'load_error': self.chatbot.load_error,
+            'model_name': self.chatbot.model_name
+        }
+
+    def _handle_connection(self, conn):
+        """按顺序处理同一连接上的请求"""
+        try:
+            while True:
+                request = recv_frame(conn)
+                if request is None:
+                    break
+
+                method = request.get('method')
+                args = request.get('args') or []
+                kwargs = request.get('kwargs') or {}
+
+                if method == 'status':
+                    send_frame(conn, {'result': self._status()})
+                elif method in STREAM_METHODS:
+                    self._handle_stream(conn, method, args, kwargs)
+                elif method in REMOTE_METHODS:
+                    try:
+                        result = getattr(self.chatbot, method)(*args, **kwargs)
+                        send_frame(conn, {'result': result})
+                    except Exception as e:
+                        logger.error(f"模型服务调用失败 {method}: {str(e)}")
+                        send_frame(conn, {'error': str(e)})
+                else:
+                    send_frame(conn, {'error': f"不支持的方法: {method}"})
+        except (OSError, ModelServerError, ValueError) as e:
+            logger.debug(f"模型服务连接关闭: {e}")
+        finally:
+            conn.close()
+
+    def _handle_stream(self, conn, method, args, kwargs):
+        """逐帧返回流式事件，以 {'end': True} 结束
+
+        客户端断开后下一次发送失败，关闭事件生成器；stream_response 随之取消调度器中的请求，
+        不再为已断开的客户端继续生成。
+        """
+        events = getattr(self.chatbot, method)(*args, **kwargs)
+        try:
+            for event in events:
+                send_frame(conn, {'event': event})
+            send_frame(conn, {'end': True})
+        except (OSError, ModelServerError):
+            logger.info(f"流式调用的客户端已断开，停止生成: {method}")
+            raise
+        except Exception as e:
+            logger.error(f"模型服务流式调用失败 {method}: {str(e)}")
+            send_frame(conn, {'error': str(e)})
+        finally:
+            events.close()
+
+
+class RemoteChatBot:
+    """Flask 工作进程侧的模型客户端，接口与 QwenChatBot 保持一致
+
+    连接池中的连接按需建立并复用；模型服务不可达时视为加载中。
+    """
+
+    def __init__(self, socket_path=None, pool_size=None, timeout=None):
+        self.socket_path = socket_path or ModelConfig.MODEL_SERVER_SOCKET
+        self.pool_size = pool_size or ModelConfig.MODEL_SERVER_POOL_SIZE
+        self.timeout = timeout if timeout is not None else ModelConfig.MODEL_SERVER_TIMEOUT
+        self.model_name = MODEL_PATH
+        self.load_error = None
+
+        self._pool = queue.LifoQueue()
+        self._status = None
+        self._status_checked_at = 0.0
+        self._status_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _acquire(self):
+        """取出连接，返回 (连接, 是否来自连接池)"""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, sock):
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(sock)
+        else:
+            sock.close()
+
+    def _call(self, method, *args, **kwargs):
+        """同步调用，连接异常时抛出 ModelServerError
+
+        连接池中的连接可能已随模型服务重启失效，此时换用新连接重试一次。
+        """
+        while True:
+            sock, pooled = None, False
+            try:
+                sock, pooled = self._acquire()
+                send_frame(sock, {'method': method, 'args': args, 'kwargs': kwargs})
+                response = recv_frame(sock)
+                if response is None:
+                    raise ModelServerError("模型服务连接已关闭")
+                break
+            except (OSError, ModelServerError) as e:
+                if sock is not None:
+                    sock.close()
+                if not pooled or isinstance(e, socket.timeout):
+                    if isinstance(e, ModelServerError):
+                        raise
+                    raise ModelServerError(f"模型服务连接失败: {e}") from e
+
+        self._release(sock)
+
+        if 'error' in response:
+            raise ModelServerError(response['error'])
+        return response['result']
+
+    def _refresh_status(self):
+        """读取服务端模型状态（短时间内复用上次结果，避免每个请求都往返一次）"""
+        with self._status_lock:
+            now = time.monotonic()
+            if self._status is not None and now - self._status_checked_at < ModelConfig.MODEL_SERVER_STATUS_TTL:
+                return self._status
+            try:
+                status = self._call('status')
+                self.model_name = status.get('model_name') or self.model_name
+                self.load_error = status.get('load_error')
+            except ModelServerError as e:
+                logger.debug(f"模型服务暂不可用: {e}")
+                status = {'ready': False, 'status': 'loading', 'is_loading': True, 'load_error': None,
+                          'load_progress': None, 'runtime': None}
+            self._status = status
+            self._status_checked_at = now
+            return status
+
+    @property
+    def is_loading(self):
+        return self._refresh_status()['is_loading']
+
+    def is_ready(self):
+        """检查模型是否已加载完成"""
+        return self._refresh_status()['ready']
+
+    def get_status(self, detailed=False):
+        """获取模型状态，detailed 为True时附带模型服务的权重加载进度"""
+        status = self._refresh_status()
+        if detailed:
+            return {
+                'status': status['status'],
+                'load_progress': status.get('load_progress'),
+                'runtime': status.get('runtime')
+            }
+        return status['status']
+
+    def _failed_response(self, error):
+        return {
+            "content": f"模型服务调用失败: {error}",
+            "thinking": None,
+            "success": False
+        }
+
+    def generate_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                          shared_prefixes=None, use_cache=True, semantic_cache=False, decoding=None,
+                          session_id=None):
+        """生成AI回复"""
+        try:
+            return self._call('generate_response', user_message, max_new_tokens, temperature, enable_thinking,
+                              shared_prefixes=shared_prefixes, use_cache=use_cache, semantic_cache=semantic_cache,
+                              decoding=decoding, session_id=session_id)
+        except ModelServerError as e:
+            logger.error(f"生成回复失败: {str(e)}")
+            return self._failed_response(e)
+
+    def stream_response(self, user_message, max_new_tokens=None, temperature=None, enable_thinking=None,
+                        use_cache=True, semantic_cache=False, session_id=None):
+        """流式生成AI回复；提前关闭生成器会断开连接并终止服务端生成"""
+        sock = None
+        finished = False
+        try:
+            sock = self._connect()
+            sock.settimeout(None)
+            send_frame(sock, {
+                'method': 'stream_response',
+                'args': [user_message, max_new_tokens, temperature, enable_thinking],
+                'kwargs': {'use_cache': use_cache, 'semantic_cache': semantic_cache, 'session_id': session_id}
+            })
+            while True:
+                response = recv_frame(sock)
+                if response is None:
+                    raise ModelServerError("模型服务连接已关闭")
+                if response.get('end'):
+                    finished = True
+                    break
+                if 'error' in response:
+                    raise ModelServerError(response['error'])
+                yield response['event']
+        except (OSError, ModelServerError) as e:
+            logger.error(f"流式生成失败: {str(e)}")
+            yield {"type": "error", "content": f"模型服务调用失败: {e}", "success": False}
+        finally:
+            if sock is not None:
+                if finished:
+                    sock.settimeout(self.timeout)
+                    self._release(sock)
+                else:
+                    sock.close()
+
+    def generate_report_outline(self, topic, requirements):
+        """生成报告大纲"""
+        try:
+            return self._call('generate_report_outline', topic, requirements)
+        except ModelServerError as e:
+            logger.error(f"生成报告大纲失败: {str(e)}")
+            return self._failed_response(e)
+
+    def generate_section_content(self, section_title, section_description, context):
+        """生成章节内容"""
+        try:
+            return self._call('generate_section_content', section_title, section_description, context)
+        except ModelServerError as e:
+            logger.error(f"生成章节内容失败: {str(e)}")
+            return self._failed_response(e)
+
+    def _stats(self, method):
+        try:
+            return self._call(method)
+        except ModelServerError:
+            return None
+
+    def get_response_cache_stats(self):
+        """获取回复缓存统计信息"""
+        return self._stats('get_response_cache_stats')
+
+    def get_semantic_cache_stats(self):
+        """获取语义缓存统计信息"""
+        return self._stats('get_semantic_cache_stats')
+
+    def get_scheduler_stats(self):
+        """获取推理调度器统计信息"""
+        return self._stats('get_scheduler_stats')
+
+    def get_startup_timings(self):
+        """获取模型服务各启动阶段耗时（秒）"""
+        return self._stats('get_startup_timings') or {}
+
+    def get_metrics(self):
+        """模型服务进程的推理侧指标，服务不可用时返回空字符串"""
+        return self._stats('get_metrics') or ''
+
+    def create_session(self):
+        """在模型服务中新建多轮对话会话（会话和KV缓存都保存在模型服务进程中）"""
+        return self._call('create_session')
+
+    def get_session(self, session_id):
+        """获取会话信息，不存在或已过期时返回None"""
+        return self._call('get_session', session_id)
+
+    def delete_session(self, session_id):
+        """删除会话及其保留的KV缓存"""
+        return self._call('delete_session', session_id)
+
+    def get_session_stats(self):
+        """获取会话和会话KV缓存统计信息"""
+        return self._stats('get_session_stats')
+
+    def cleanup(self):
+        """关闭连接池（不影响模型服务进程）"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else ModelConfig.MODEL_SERVER_SOCKET
+    if not socket_path:
+        print("请通过参数或 MODEL_SERVER_SOCKET 环境变量指定套接字路径")
+        sys.exit(1)
+
+    server = ModelServer(socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.chatbot.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+请求限流
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import SecurityConfig
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# 单条语句完成“补充令牌 → 判断 → 扣减”，SQLite 对单条语句加写锁，多进程并发时不会超发
+TAKE_SQL = """
+INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed)
+VALUES (:key, :capacity - :cost, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    tokens = min(:capacity, tokens + max(0, :now - updated_at) * :rate)
+             - CASE WHEN min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= :cost THEN :cost ELSE 0 END,
+    allowed = min(:capacity, tokens + max(0, :now - updated_at) * :rate) >= :cost,
+    updated_at = max(updated_at, :now)
+RETURNING tokens, allowed
+"""
+
+
+class RateLimitPolicy:
+    """一类路由的限流参数：每分钟补充 per_minute 个令牌，桶容量（允许的突发请求数）为 burst"""
+
+    __slots__ = ('name', 'per_minute', 'burst', 'rate')
+
+    def __init__(self, name, per_minute, burst=None):
+        if per_minute <= 0:
+            raise ValueError(f"限流速率必须为正数: {name}")
+        self.name = name
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        if burst is None:
+            burst = self.rate * SecurityConfig.RATE_LIMIT_BURST_SECONDS
+        self.burst = max(1.0, float(burst))
+
+    @property
+    def idle_seconds(self):
+        """桶从空到满所需的时间；超过该时间未访问的桶与新桶等价，可以删除"""
+        return self.burst / self.rate
+
+    def header_value(self):
+        return f'{self.per_minute};w=60;burst={int(self.burst)}'
+
+
+class RateLimitResult:
+    """一次限流检查的结果"""
+
+    __slots__ = ('allowed', 'policy', 'tokens')
+
+    def __init__(self, allowed, policy, tokens):
+        self.allowed = allowed
+        self.policy = policy
+        self.tokens = tokens
+
+    @property
+    def remaining(self):
+        return max(0, int(self.tokens))
+
+    @property
+    def retry_after(self):
+        """下一个令牌可用前的秒数（向上取整）"""
+        if self.tokens >= 1:
+            return 0
+        return max(1, math.ceil((1 - self.tokens) / self.policy.rate))
+
+    @property
+    def reset_after(self):
+        """令牌桶恢复到满的秒数"""
+        return max(0, math.ceil((self.policy.burst - self.tokens) / self.policy.rate))
+
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.policy.per_minute),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset_after),
+            'RateLimit-Policy': self.policy.header_value()
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+class _BaseRateLimiter:
+
+    def __init__(self, cleanup_interval=None):
+        self.cleanup_interval = (cleanup_interval if cleanup_interval is not None
+                                 else SecurityConfig.RATE_LIMIT_CLEANUP_INTERVAL)
+        self._stats_lock = threading.Lock()
+        self._last_cleanup = time.time()
+        self.allowed = 0
+        self.rejected = 0
+        self.removed_buckets = 0
+
+    def check(self, client, policy, cost=1.0):
+        """为 (客户端, 路由类别) 取 cost 个令牌，返回 RateLimitResult"""
+        now = time.time()
+        allowed, tokens = self._take(f'{policy.name}|{client}', policy, cost, now)
+        with self._stats_lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+            cleanup_due = now - self._last_cleanup >= self.cleanup_interval
+            if cleanup_due:
+                self._last_cleanup = now
+        if cleanup_due:
+            self.cleanup(now)
+        return RateLimitResult(allowed, policy, tokens)
+
+    def _take(self, key, policy, cost, now):
+        raise NotImplementedError
+
+    def cleanup(self, now=None):
+        raise NotImplementedError
+
+    def _stats(self):
+        with self._stats_lock:
+            return {
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'removed_buckets': self.removed_buckets
+            }
+
+
+class MemoryRateLimiter(_BaseRateLimiter):
+    """进程内令牌桶，单工作进程部署时使用
+
+    桶按最近访问时间排列（OrderedDict），清理时从最久未访问的一端删除，遇到第一个未过期的桶即停止。
+    """
+
+    def __init__(self, cleanup_interval=None):
+        super().__init__(cleanup_interval)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, key, policy, cost, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = policy.burst
+            else:
+                tokens = min(policy.burst, bucket[0] + max(0.0, now - bucket[1]) * policy.rate)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            return allowed, tokens
+
+    def cleanup(self, now=None):
+        """删除已补满（超过最长补满时间未访问）的桶"""
+        now = now if now is not None else time.time()
+        expire_before = now - max_idle_seconds()
+        removed = 0
+        with self._lock:
+            while self._buckets:
+                key, (_, updated_at) = next(iter(self._buckets.items()))
+                if updated_at >= expire_before:
+                    break
+                del self._buckets[key]
+                removed += 1
+        with self._stats_lock:
+            self.removed_buckets += removed
+        return removed
+
+    def get_stats(self):
+        stats = self._stats()
+        with self._lock:
+            stats['buckets'] = len(self._buckets)
+        stats['backend'] = 'memory'
+        return stats
+
+
+class SQLiteRateLimiter(_BaseRateLimiter):
+    """基于SQLite（WAL模式）的令牌桶，多个 gunicorn 工作进程共享同一个数据库文件
+
+    每次检查是一条按主键的 UPSERT，耗时与桶的数量无关；限流数据丢失无害，因此关闭同步写盘。
+    """
+
+    def __init__(self, db_path, cleanup_interval=None):
+        super().__init__(cleanup_interval)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+        logger.info(f"限流存储已就绪: {db_path}")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, cached_statements=16)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+        return conn
+
+    def _take(self, key, policy, cost, now):
+        try:
+            # 读完结果语句才会结束并释放写锁，因此用 fetchall
+            rows = self._connection().execute(TAKE_SQL, {
+                'key': key,
+                'capacity': policy.burst,
+                'rate': policy.rate,
+                'cost': cost,
+                'now': now
+            }).fetchall()
+        except sqlite3.Error as e:
+            # 限流存储不可用时放行，不影响正常服务
+            logger.warning(f"限流检查失败，本次请求放行: {e}")
+            return True, policy.burst
+        tokens, allowed = rows[0]
+        return bool(allowed), tokens
+
+    def cleanup(self, now=None):
+        """删除已补满（超过最长补满时间未访问）的桶"""
+        now = now if now is not None else time.time()
+        try:
+            cursor = self._connection().execute(
+                'DELETE FROM rate_limit_buckets WHERE updated_at < ?', (now - max_idle_seconds(),)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"清理限流数据失败: {e}")
+            return 0
+        with self._stats_lock:
+            self.removed_buckets += cursor.rowcount
+        return cursor.rowcount
+
+    def get_stats(self):
+        stats = self._stats()
+        stats['buckets'] = self._connection().execute('SELECT count(*) FROM rate_limit_buckets').fetchone()[0]
+        stats['backend'] = 'sqlite'
+        return stats
+
+
+def _build_policies():
+    return {
+        'chat': RateLimitPolicy('chat', SecurityConfig.RATE_LIMIT_CHAT_PER_MINUTE),
+        'report': RateLimitPolicy('report', SecurityConfig.RATE_LIMIT_REPORT_PER_MINUTE),
+        'export': RateLimitPolicy('export', SecurityConfig.RATE_LIMIT_EXPORT_PER_MINUTE),
+        'status': RateLimitPolicy('status', SecurityConfig.RATE_LIMIT_STATUS_PER_MINUTE),
+        'default': RateLimitPolicy('default', SecurityConfig.RATE_LIMIT_PER_MINUTE),
+    }
+
+
+ROUTE_POLICIES = _build_policies()
+
+
+def max_idle_seconds():
+    """超过该时间未访问的桶在任何类别下都已补满"""
+    return max(policy.idle_seconds for policy in ROUTE_POLICIES.values())
+
+# 不限流的端点（负载均衡健康检查）
+EXEMPT_PATHS = frozenset({'/api/health'})
+
+
+def route_class(path, method):
+    """按请求路径划分路由类别，非API请求（页面、静态文件）返回None"""
+    if not path.startswith('/api/') or path in EXEMPT_PATHS:
+        return None
+    if path.startswith('/api/chat/session'):
+        # 会话的创建和查询不触发生成，按普通API计
+        return 'default'
+    if path.startswith('/api/chat'):
+        return 'chat'
+    if path == '/api/report/generate' and method == 'POST':
+        return 'report'
+    if path.startswith('/api/report/download/') or path == '/api/report/export':
+        return 'export'
+    if path == '/api/status' or path.startswith(('/api/report/status/', '/api/report/events/')):
+        # 页面定时轮询的状态和进度，单独使用较宽的配额，不与其他API共用
+        return 'status'
+    return 'default'
+
+
+def client_address(remote_addr, forwarded_for=None, proxy_hops=None):
+    """客户端IP；部署在反向代理后时从 X-Forwarded-For 右侧取第 proxy_hops 个地址"""
+    proxy_hops = proxy_hops if proxy_hops is not None else SecurityConfig.RATE_LIMIT_PROXY_HOPS
+    if proxy_hops > 0 and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',') if address.strip()]
+        if len(addresses) >= proxy_hops:
+            return addresses[-proxy_hops]
+    return remote_addr or 'unknown'
+
+
+def create_rate_limiter():
+    """按配置创建限流器：配置了数据库路径时多进程共享，否则仅在进程内生效"""
+    if SecurityConfig.RATE_LIMIT_DB_PATH:
+        return SQLiteRateLimiter(SecurityConfig.RATE_LIMIT_DB_PATH)
+    return MemoryRateLimiter()
@@ -1,7 +1,12 @@
 import uuid
+import queue
 import logging
+import threading
 from datetime import datetime
 from config import ReportConfig
+from .report_store import SQLiteReportStore
+from .export_cache import ExportCache
+from utils.tracing import Trace
 
 logger = logging.getLogger(__name__)
 
@@ -9,18 +14,43 @@ logger = logging.getLogger(__name__)
 class ReportGenerator:
     """报告生成管理器"""
 
-    def __init__(self):
-        self.active_reports = {}
-        self.completed_reports = {}
+    def __init__(self, db_path=None, export_cache=None):
+        self.store = SQLiteReportStore(db_path or ReportConfig.REPORT_DB_PATH)
+        self.export_cache = export_cache or ExportCache()
         self.max_active_reports = ReportConfig.MAX_ACTIVE_REPORTS
+        self._subscribers = {}
+        self._subscribers_lock = threading.Lock()
+        # 本进程中正在生成的报告的执行时间线，生成结束后写入存储
+        self._traces = {}
+        self._traces_lock = threading.Lock()
+
+    def subscribe(self, report_id):
+        """订阅报告事件，返回接收 (事件类型, 数据) 的队列"""
+        subscription = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.setdefault(report_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, report_id, subscription):
+        """取消订阅报告事件"""
+        with self._subscribers_lock:
+            subscriptions = self._subscribers.get(report_id, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscribers.pop(report_id, None)
+
+    def _publish(self, report_id, event_type, data):
+        """向报告的所有订阅者推送事件"""
+        with self._subscribers_lock:
+            subscriptions = list(self._subscribers.get(report_id, []))
+        for subscription in subscriptions:
+            subscription.put((event_type, data))
 
     def create_report_session(self, topic, requirements):
         """创建报告生成会话"""
-        if len(self.active_reports) >= self.max_active_reports:
-            raise Exception(f"活跃报告数量已达上限({self.max_active_reports})")
-
         report_id = str(uuid.uuid4())
-        self.active_reports[report_id] = {
+        report = {
             'id': report_id,
             'topic': topic,
             'requirements': requirements,
@@ -35,60 +65,80 @@ class ReportGenerator:
             'file_paths': {}
         }
 
+        if not self.store.create(report, max_active=self.max_active_reports):
+            raise Exception(f"活跃报告数量已达上限({self.max_active_reports})")
+
         logger.info(f"创建报告会话: {report_id}, 主题: {topic}")
         return report_id
 
     def get_report_status(self, report_id):
         """获取报告生成状态"""
-        return self.active_reports.get(report_id) or self.completed_reports.get(report_id)
+        return self.store.get(report_id)
 
     def update_report_progress(self, report_id, status, progress=None, **kwargs):
         """更新报告进度"""
-        if report_id in self.active_reports:
-            self.active_reports[report_id]['status'] = status
-            if progress is not None:
-                self.active_reports[report_id]['progress'] = progress
-            for key, value in kwargs.items():
-                self.active_reports[report_id][key] = value
+        fields = dict(kwargs, status=status)
+        if progress is not None:
+            fields['progress'] = progress
+
+        if self.store.update(report_id, fields):
+            report_data = self.store.get(report_id, include_sections=False)
+            event = {
+                'status': status,
+                'progress': report_data['progress'],
+                'sections_completed': self.store.count_sections(report_id),
+                'total_sections': kwargs.get('total_sections', report_data.get('total_sections')),
+                'error': report_data.get('error')
+            }
+            if 'outline' in kwargs:
+                event['outline'] = kwargs['outline']
+            self._publish(report_id, 'failed' if status == 'error' else 'progress', event)
 
             logger.debug(f"更新报告进度: {report_id}, 状态: {status}, 进度: {progress}%")
 
     def add_section_content(self, report_id, section_id, section_data):
         """添加章节内容"""
-        if report_id in self.active_reports:
-            self.active_reports[report_id]['sections'][section_id] = section_data
+        sections_completed = self.store.add_section(report_id, section_id, section_data)
+        if sections_completed is not None:
+            self._publish(report_id, 'section', {
+                'section_id': section_id,
+                'title': section_data.get('title'),
+                'error': section_data.get('error', False),
+                'sections_completed': sections_completed
+            })
             logger.debug(f"添加章节内容: {report_id}, 章节: {section_id}")
 
     def complete_report(self, report_id):
         """标记报告为完成状态"""
-        if report_id in self.active_reports:
-            report_data = self.active_reports[report_id]
-            report_data['status'] = 'completed'
-            report_data['completed_at'] = datetime.now()
-            report_data['progress'] = 100
+        report_data = self.store.get(report_id)
+        if not report_data or report_data['status'] == 'completed':
+            return False
 
-            self._generate_report_summary(report_id)
+        completed_at = datetime.now()
+        summary = self._generate_report_summary(report_data, completed_at)
+        if not self.store.update(report_id, {
+            'status': 'completed',
+            'completed_at': completed_at,
+            'progress': 100,
+            'summary': summary
+        }):
+            return False
 
-            self.completed_reports[report_id] = report_data
-            del self.active_reports[report_id]
+        self._publish(report_id, 'completed', {'status': 'completed', 'progress': 100})
 
-            logger.info(f"报告生成完成: {report_id}, 主题: {report_data['topic']}")
-            return True
-        return False
+        logger.info(f"报告生成完成: {report_id}, 主题: {report_data['topic']}")
+        return True
 
     def mark_report_error(self, report_id, error_message):
         """标记报告生成失败"""
-        if report_id in self.active_reports:
-            self.active_reports[report_id]['status'] = 'error'
-            self.active_reports[report_id]['error'] = error_message
+        if self.store.update(report_id, {'status': 'error', 'error': error_message}):
+            self._publish(report_id, 'failed', {'status': 'error', 'error': error_message})
             logger.error(f"报告生成失败: {report_id}, 错误: {error_message}")
 
-    def _generate_report_summary(self, report_id):
+    def _generate_report_summary(self, report_data, completed_at):
         """生成报告摘要统计"""
-        report_data = self.active_reports[report_id]
-
         total_words = 0
-        if report_data.get('outline', {}).get('abstract'):
+        if (report_data.get('outline') or {}).get('abstract'):
             total_words += len(report_data['outline']['abstract'])
 
         for section_data in report_data.get('sections', {}).values():
@@ -96,10 +146,10 @@ class ReportGenerator:
                 total_words += len(section_data['content'])
 
         duration = None
-        if report_data.get('completed_at') and report_data.get('created_at'):
-            duration = report_data['completed_at'] - report_data['created_at']
+        if completed_at and report_data.get('created_at'):
+            duration = completed_at - report_data['created_at']
 
-        report_data['summary'] = {
+        return {
             'total_words': total_words,
             'total_sections': len(report_data.get('sections', {})),
             'generation_duration': duration.total_seconds() if duration else None,
@@ -108,83 +158,100 @@ class ReportGenerator:
 
     def increment_download_count(self, report_id):
         """增加下载计数"""
-        report_data = self.active_reports.get(report_id) or self.completed_reports.get(report_id)
-        if report_data:
-            report_data['download_count'] = report_data.get('download_count', 0) + 1
-            logger.info(f"报告下载计数更新: {report_id}, 次数: {report_data['download_count']}")
+        download_count = self.store.increment_download_count(report_id)
+        if download_count is not None:
+            logger.info(f"报告下载计数更新: {report_id}, 次数: {download_count}")
+
+    def start_trace(self, report_id):
+        """开始记录报告的执行时间线；未开启追踪时返回None"""
+        if not ReportConfig.REPORT_TRACE_ENABLED:
+            return None
+        trace = Trace(report_id, max_spans=ReportConfig.REPORT_TRACE_MAX_SPANS)
+        with self._traces_lock:
+            self._traces[report_id] = trace
+        return trace
+
+    def finish_trace(self, report_id):
+        """保存并结束报告的执行时间线"""
+        with self._traces_lock:
+            trace = self._traces.pop(report_id, None)
+        if trace is None:
+            return
+        try:
+            self.store.save_trace(report_id, trace.to_dict())
+        except Exception as e:
+            logger.warning(f"保存报告执行时间线失败: {report_id}, {e}")
+
+    def get_trace(self, report_id):
+        """报告的执行时间线：生成中的报告返回已结束的 span，不存在返回None"""
+        with self._traces_lock:
+            trace = self._traces.get(report_id)
+        if trace is not None:
+            return trace.to_dict()
+        return self.store.get_trace(report_id)
 
     def get_report_summary(self, report_id):
         """获取报告摘要"""
-        report_data = self.active_reports.get(report_id) or self.completed_reports.get(report_id)
+        report_data = self.store.get(report_id, include_sections=False)
         if report_data and report_data.get('summary'):
             return report_data['summary']
         return None
 
-    def get_all_reports(self):
-        """获取所有报告数据"""
-        all_reports = {}
-        all_reports.update(self.active_reports)
-        all_reports.update(self.completed_reports)
-        return all_reports
+    def get_all_reports(self, include_sections=False):
+        """获取所有报告数据（按创建时间倒序）"""
+        return self.store.list(include_sections=include_sections)
 
     def get_active_count(self):
         """获取活跃报告数量"""
-        return len(self.active_reports)
+        return self.store.count() - self.store.count('completed')
 
     def get_completed_count(self):
         """获取已完成报告数量"""
-        return len(self.completed_reports)
+        return self.store.count('completed')
 
     def get_total_count(self):
         """获取总报告数量"""
-        return len(self.active_reports) + len(self.completed_reports)
+        return self.store.count()
 
     def cleanup_old_reports(self, hours=None):
         """清理旧的报告数据"""
         hours = hours or ReportConfig.REPORT_CLEANUP_HOURS
-        current_time = datetime.now()
-        expired_reports = []
-
-        for report_id, report_data in list(self.completed_reports.items()):
-            if report_data.get('completed_at'):
-                age = current_time - report_data['completed_at']
-                if age.total_seconds() > hours * 3600:
-                    expired_reports.append(report_id)
-
-        timeout_minutes = ReportConfig.REPORT_TIMEOUT
-        for report_id, report_data in list(self.active_reports.items()):
-            if report_data.get('created_at'):
-                age = current_time - report_data['created_at']
-                if age.total_seconds() > timeout_minutes * 60:
-                    expired_reports.append(report_id)
-                    self.mark_report_error(report_id, "报告生成超时")
+        now = datetime.now().timestamp()
+
+        expired_reports, timed_out_reports = self.store.find_expired(
+            completed_before=now - hours * 3600,
+            active_created_before=now - ReportConfig.REPORT_TIMEOUT * 60
+        )
+        for report_id in timed_out_reports:
+            self.mark_report_error(report_id, "报告生成超时")
+        expired_reports += timed_out_reports
 
         cleaned_count = 0
-        for report_id in expired_reports:
+        if expired_reports:
+            reports = [self.store.get(report_id, include_sections=False) for report_id in expired_reports]
             try:
-                if report_id in self.completed_reports:
-                    report_data = self.completed_reports.pop(report_id)
-                elif report_id in self.active_reports:
-                    report_data = self.active_reports.pop(report_id)
-                else:
-                    continue
-
-                self._cleanup_report_files(report_data)
-                cleaned_count += 1
-                logger.info(f"清理过期/超时报告: {report_id}")
-
+                cleaned_count = self.store.delete_many(expired_reports)
             except Exception as e:
-                logger.warning(f"清理报告失败 {report_id}: {e}")
+                logger.warning(f"清理报告失败: {e}")
+                return 0
+
+            for report_id, report_data in zip(expired_reports, reports):
+                self._cleanup_report_files(report_id, report_data)
+                logger.info(f"清理过期/超时报告: {report_id}")
 
         if cleaned_count > 0:
             logger.info(f"清理任务完成，共清理 {cleaned_count} 个报告")
 
         return cleaned_count
 
-    def _cleanup_report_files(self, report_data):
-        """清理报告相关文件"""
+    def _cleanup_report_files(self, report_id, report_data):
+        """清理报告相关文件及导出缓存"""
         import os
 
+        self.export_cache.invalidate(report_id)
+        if not report_data:
+            return
+
         for file_path in report_data.get('file_paths', {}).values():
             try:
                 if os.path.exists(file_path):
@@ -195,15 +262,11 @@ class ReportGenerator:
 
     def delete_report(self, report_id):
         """删除指定报告"""
-        report_data = None
-
-        if report_id in self.active_reports:
-            report_data = self.active_reports.pop(report_id)
-        elif report_id in self.completed_reports:
-            report_data = self.completed_reports.pop(report_id)
+        report_data = self.store.get(report_id, include_sections=False)
 
         if report_data:
-            self._cleanup_report_files(report_data)
+            self.store.delete_many([report_id])
+            self._cleanup_report_files(report_id, report_data)
             logger.info(f"删除报告: {report_id}")
             return True
 
@@ -211,22 +274,14 @@ class ReportGenerator:
 
     def get_statistics(self):
         """获取统计信息"""
-        total_completed = len(self.completed_reports)
-        total_active = len(self.active_reports)
-        total_downloads = sum(report.get('download_count', 0) for report in self.completed_reports.values())
-        generation_times = []
-        for report in self.completed_reports.values():
-            if report.get('summary', {}).get('generation_duration'):
-                generation_times.append(report['summary']['generation_duration'])
-
-        avg_generation_time = sum(generation_times) / len(generation_times) if generation_times else 0
+        stats = self.store.get_statistics()
 
         return {
-            'total_reports': total_completed + total_active,
-            'completed_reports': total_completed,
-            'active_reports': total_active,
-            'total_downloads': total_downloads,
-            'average_generation_time': avg_generation_time,
+            'total_reports': stats['total'],
+            'completed_reports': stats['completed'],
+            'active_reports': stats['total'] - stats['completed'],
+            'total_downloads': stats['downloads'],
+            'average_generation_time': stats['avg_duration'],
             'max_active_reports': self.max_active_reports
         }
 
@@ -234,8 +289,8 @@ class ReportGenerator:
         """导出报告列表（用于备份或迁移）"""
         export_data = {
             'export_time': datetime.now().isoformat(),
-            'active_reports': self.active_reports,
-            'completed_reports': self.completed_reports,
+            'active_reports': self.store.list(exclude_status='completed', include_sections=True),
+            'completed_reports': self.store.list(status='completed', include_sections=True),
             'statistics': self.get_statistics()
         }
         return export_data
@@ -243,15 +298,15 @@ class ReportGenerator:
     def import_report_list(self, import_data):
         """导入报告列表（用于恢复或迁移）"""
         try:
-            if 'active_reports' in import_data:
-                self.active_reports.update(import_data['active_reports'])
-
-            if 'completed_reports' in import_data:
-                self.completed_reports.update(import_data['completed_reports'])
+            reports = []
+            for key in ('active_reports', 'completed_reports'):
+                for report_id, report_data in import_data.get(key, {}).items():
+                    reports.append(dict(report_data, id=report_data.get('id', report_id)))
+            self.store.import_reports(reports)
 
             logger.info("报告列表导入成功")
             return True
 
         except Exception as e:
             logger.error(f"报告列表导入失败: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,387 @@
+"""
+报告持久化存储
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    topic TEXT NOT NULL,
+    requirements TEXT,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    outline TEXT,
+    error TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    download_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    completed_at REAL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports(status);
+CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports(created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_completed_at ON reports(completed_at);
+
+CREATE TABLE IF NOT EXISTS report_sections (
+    report_id TEXT NOT NULL,
+    section_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (report_id, section_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS report_traces (
+    report_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# reports 表中有独立列的字段，其余字段存放在 extra（JSON）中
+COLUMN_FIELDS = ('topic', 'requirements', 'status', 'progress', 'outline', 'error',
+                 'download_count', 'created_at', 'completed_at')
+
+LIGHT_COLUMNS = ('id, topic, requirements, status, progress, outline, error, extra, download_count, '
+                 'created_at, completed_at, version')
+
+
+def _to_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+def _from_timestamp(value):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _section_key(section_id):
+    """章节ID按JSON编码存储，读取时保持原类型（大纲中的ID可能是字符串或数字）"""
+    return json.dumps(section_id, ensure_ascii=False)
+
+
+class SQLiteReportStore:
+    """基于SQLite（WAL模式）的报告存储，可被多个工作进程共享
+
+    每个线程持有独立连接；语句均为参数化查询，由 sqlite3 的语句缓存复用预编译结果。
+    章节内容按行单独存储，生成过程中逐节写入，状态和列表查询不读取章节内容。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = threading.local()
+
+        self._connection().executescript(SCHEMA)
+        logger.info(f"报告存储已就绪: {db_path}")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            conn.execute('PRAGMA foreign_keys=OFF')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 提前获取写锁，避免多进程读改写冲突"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _row_to_report(self, row):
+        report = json.loads(row['extra'] or '{}')
+        report.update({
+            'id': row['id'],
+            'topic': row['topic'],
+            'requirements': row['requirements'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'outline': json.loads(row['outline']) if row['outline'] else None,
+            'error': row['error'],
+            'download_count': row['download_count'],
+            'created_at': _from_timestamp(row['created_at']),
+            'completed_at': _from_timestamp(row['completed_at']),
+            'version': row['version']
+        })
+        report.setdefault('file_paths', {})
+        return report
+
+    @staticmethod
+    def _split_fields(fields):
+        """将字段拆分为独立列和 extra 两部分，并转换为存储格式"""
+        columns, extra = {}, {}
+        for key, value in fields.items():
+            if key in ('id', 'sections', 'version'):
+                continue
+            if key in COLUMN_FIELDS:
+                if key == 'outline':
+                    value = json.dumps(value, ensure_ascii=False) if value is not None else None
+                elif key in ('created_at', 'completed_at'):
+                    value = _to_timestamp(value)
+                columns[key] = value
+            else:
+                extra[key] = value
+        return columns, extra
+
+    def create(self, report, max_active=None):
+        """新建报告；max_active 不为空时在同一事务内检查活跃报告数量，超出返回False"""
+        columns, extra = self._split_fields(report)
+        now = time.time()
+
+        with self._transaction() as conn:
+            if max_active is not None:
+                total = conn.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+                completed = conn.execute("SELECT COUNT(*) FROM reports WHERE status = 'completed'").fetchone()[0]
+                if total - completed >= max_active:
+                    return False
+
+            conn.execute(
+                'INSERT INTO reports (id, topic, requirements, status, progress, outline, error, extra, '
+                'download_count, created_at, completed_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (report['id'], columns.get('topic'), columns.get('requirements'), columns.get('status'),
+                 columns.get('progress', 0), columns.get('outline'), columns.get('error'),
+                 json.dumps(extra, ensure_ascii=False, default=str), columns.get('download_count', 0),
+                 columns.get('created_at') or now, columns.get('completed_at'), now)
+            )
+            self._write_sections(conn, report['id'], report.get('sections') or {})
+        return True
+
+    def _write_sections(self, conn, report_id, sections):
+        if not sections:
+            return
+        conn.executemany(
+            'INSERT OR REPLACE INTO report_sections (report_id, section_id, position, data) VALUES (?, ?, ?, ?)',
+            [(report_id, _section_key(section_id), position, json.dumps(data, ensure_ascii=False, default=str))
+             for position, (section_id, data) in enumerate(sections.items())]
+        )
+
+    def get(self, report_id, include_sections=True):
+        """读取报告，不存在返回None"""
+        conn = self._connection()
+        row = conn.execute(f'SELECT {LIGHT_COLUMNS} FROM reports WHERE id = ?', (report_id,)).fetchone()
+        if row is None:
+            return None
+
+        report = self._row_to_report(row)
+        if include_sections:
+            report['sections'] = self.get_sections(report_id)
+        return report
+
+    def get_sections(self, report_id):
+        """按写入顺序读取报告的全部章节"""
+        rows = self._connection().execute(
+            'SELECT section_id, data FROM report_sections WHERE report_id = ? ORDER BY position', (report_id,)
+        ).fetchall()
+        return {json.loads(row['section_id']): json.loads(row['data']) for row in rows}
+
+    def count_sections(self, report_id):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM report_sections WHERE report_id = ?', (report_id,)
+        ).fetchone()[0]
+
+    def get_version(self, report_id):
+        """读取报告版本号和状态（每次写入版本号加一），不存在返回 (None, None)"""
+        row = self._connection().execute(
+            'SELECT version, status FROM reports WHERE id = ?', (report_id,)
+        ).fetchone()
+        return (row['version'], row['status']) if row else (None, None)
+
+    def update(self, report_id, fields, only_active=True):
+        """更新报告字段；only_active 时已完成的报告不再更新。返回是否更新成功"""
+        columns, extra = self._split_fields(fields)
+        condition = "id = ? AND status != 'completed'" if only_active else 'id = ?'
+
+        with self._transaction() as conn:
+            if extra:
+                row = conn.execute(f'SELECT extra FROM reports WHERE {condition}', (report_id,)).fetchone()
+                if row is None:
+                    return False
+                merged = json.loads(row['extra'] or '{}')
+                merged.update(extra)
+                columns['extra'] = json.dumps(merged, ensure_ascii=False, default=str)
+
+            assignments = ''.join(f'{key} = ?, ' for key in columns)
+            cursor = conn.execute(
+                f'UPDATE reports SET {assignments}updated_at = ?, version = version + 1 WHERE {condition}',
+                (*columns.values(), time.time(), report_id)
+            )
+            return cursor.rowcount > 0
+
+    def add_section(self, report_id, section_id, section_data):
+        """写入单个章节（仅限未完成的报告），返回当前章节数量，报告不可写时返回None"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE reports SET updated_at = ?, version = version + 1 WHERE id = ? AND status != 'completed'",
+                (time.time(), report_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+
+            existing = conn.execute(
+                'SELECT position FROM report_sections WHERE report_id = ? AND section_id = ?',
+                (report_id, _section_key(section_id))
+            ).fetchone()
+            count = conn.execute(
+                'SELECT COUNT(*) FROM report_sections WHERE report_id = ?', (report_id,)
+            ).fetchone()[0]
+            position = existing['position'] if existing else count
+
+            conn.execute(
+                'INSERT OR REPLACE INTO report_sections (report_id, section_id, position, data) VALUES (?, ?, ?, ?)',
+                (report_id, _section_key(section_id), position, json.dumps(section_data, ensure_ascii=False, default=str))
+            )
+            return count if existing else count + 1
+
+    def save_trace(self, report_id, trace_data):
+        """保存报告的执行时间线（覆盖旧的）"""
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO report_traces (report_id, data) VALUES (?, ?)',
+                (report_id, json.dumps(trace_data, ensure_ascii=False, default=str))
+            )
+
+    def get_trace(self, report_id):
+        """读取报告的执行时间线，不存在返回None"""
+        row = self._connection().execute(
+            'SELECT data FROM report_traces WHERE report_id = ?', (report_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def increment_download_count(self, report_id):
+        """下载次数加一，返回新的次数，报告不存在返回None"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE reports SET download_count = download_count + 1, updated_at = ? WHERE id = ?',
+                (time.time(), report_id)
+            )
+            row = conn.execute('SELECT download_count FROM reports WHERE id = ?', (report_id,)).fetchone()
+            return row['download_count'] if row else None
+
+    def list(self, status=None, exclude_status=None, include_sections=False):
+        """按创建时间倒序列出报告，返回 {report_id: report}"""
+        query = f'SELECT {LIGHT_COLUMNS} FROM reports'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        elif exclude_status is not None:
+            query += ' WHERE status != ?'
+            params = (exclude_status,)
+        query += ' ORDER BY created_at DESC'
+
+        reports = {}
+        for row in self._connection().execute(query, params).fetchall():
+            report = self._row_to_report(row)
+            if include_sections:
+                report['sections'] = self.get_sections(report['id'])
+            reports[report['id']] = report
+        return reports
+
+    def list_ids(self, status=None, created_after=None, created_before=None):
+        """按创建时间倒序列出符合条件的报告ID（时间为时间戳，区间左闭右开）"""
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('status = ?')
+            params.append(status)
+        if created_after is not None:
+            conditions.append('created_at >= ?')
+            params.append(created_after)
+        if created_before is not None:
+            conditions.append('created_at < ?')
+            params.append(created_before)
+
+        query = 'SELECT id FROM reports'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC'
+        return [row[0] for row in self._connection().execute(query, params)]
+
+    def count(self, status=None):
+        """统计报告数量"""
+        conn = self._connection()
+        if status is None:
+            return conn.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM reports WHERE status = ?', (status,)).fetchone()[0]
+
+    def find_expired(self, completed_before, active_created_before):
+        """查找过期的已完成报告和超时的未完成报告，返回 (已完成ID列表, 超时ID列表)"""
+        conn = self._connection()
+        completed = [row[0] for row in conn.execute(
+            "SELECT id FROM reports WHERE status = 'completed' AND completed_at < ?", (completed_before,)
+        )]
+        timed_out = [row[0] for row in conn.execute(
+            "SELECT id FROM reports WHERE created_at < ? AND status != 'completed'", (active_created_before,)
+        )]
+        return completed, timed_out
+
+    def delete_many(self, report_ids):
+        """批量删除报告及其章节、执行时间线"""
+        if not report_ids:
+            return 0
+        params = [(report_id,) for report_id in report_ids]
+        with self._transaction() as conn:
+            conn.executemany('DELETE FROM report_sections WHERE report_id = ?', params)
+            conn.executemany('DELETE FROM report_traces WHERE report_id = ?', params)
+            cursor = conn.executemany('DELETE FROM reports WHERE id = ?', params)
+            return cursor.rowcount
+
+    def import_reports(self, reports):
+        """批量导入报告（已存在的报告会被覆盖）"""
+        with self._transaction() as conn:
+            for report in reports:
+                columns, extra = self._split_fields(report)
+                conn.execute('DELETE FROM report_sections WHERE report_id = ?', (report['id'],))
+                conn.execute(
+                    'INSERT OR REPLACE INTO reports (id, topic, requirements, status, progress, outline, error, '
+                    'extra, download_count, created_at, completed_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (report['id'], columns.get('topic'), columns.get('requirements'), columns.get('status'),
+                     columns.get('progress', 0), columns.get('outline'), columns.get('error'),
+                     json.dumps(extra, ensure_ascii=False, default=str), columns.get('download_count', 0),
+                     columns.get('created_at') or time.time(), columns.get('completed_at'), time.time())
+                )
+                self._write_sections(conn, report['id'], report.get('sections') or {})
+
+    def get_statistics(self):
+        """聚合统计"""
+        row = self._connection().execute(
+            "SELECT COUNT(*) AS total, "
+            "COALESCE(SUM(status = 'completed'), 0) AS completed, "
+            "COALESCE(SUM(CASE WHEN status = 'completed' THEN download_count ELSE 0 END), 0) AS downloads, "
+            "AVG(CASE WHEN status = 'completed' THEN completed_at - created_at END) AS avg_duration "
+            "FROM reports"
+        ).fetchone()
+        return {
+            'total': row['total'],
+            'completed': row['completed'],
+            'downloads': row['downloads'],
+            'avg_duration': row['avg_duration'] or 0
+        }
@@ -0,0 +1,128 @@
+"""
+回复缓存
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import CacheConfig
+from utils.text_utils import normalize_whitespace
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """精确匹配的回复缓存，支持TTL过期和按内存上限的LRU淘汰
+
+    键由规范化后的消息、对话模板、enable_thinking、max_new_tokens 和温度分档共同决定，
+    只缓存生成成功的回复。
+    """
+
+    def __init__(self, ttl=None, max_bytes=None, max_temperature=None, temperature_bucket=None):
+        self.ttl = ttl if ttl is not None else CacheConfig.RESPONSE_CACHE_TTL
+        self.max_bytes = max_bytes if max_bytes is not None else CacheConfig.RESPONSE_CACHE_MAX_MB * 1024 * 1024
+        self.max_temperature = (max_temperature if max_temperature is not None
+                                else CacheConfig.RESPONSE_CACHE_MAX_TEMPERATURE)
+        self.temperature_bucket = temperature_bucket or CacheConfig.RESPONSE_CACHE_TEMPERATURE_BUCKET
+
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def is_cacheable(self, temperature):
+        """温度高于上限的请求不走缓存"""
+        return temperature <= self.max_temperature
+
+    def make_key(self, user_message, chat_template, enable_thinking, max_new_tokens, temperature):
+        """构造缓存键"""
+        bucket = round(temperature / self.temperature_bucket)
+        template_digest = hashlib.sha1((chat_template or '').encode('utf-8')).hexdigest()[:12]
+        raw_key = '\x1f'.join([
+            normalize_whitespace(user_message),
+            template_digest,
+            '1' if enable_thinking else '0',
+            str(max_new_tokens),
+            str(bucket)
+        ])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            response, nbytes, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(response)
+
+    def put(self, key, response):
+        """写入缓存（仅缓存成功的回复）"""
+        if not response.get('success'):
+            return False
+
+        response = {
+            'content': response.get('content'),
+            'thinking': response.get('thinking'),
+            'success': True
+        }
+        nbytes = len((response['content'] or '').encode('utf-8')) + len((response['thinking'] or '').encode('utf-8'))
+        if nbytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (response, nbytes, time.time() + self.ttl)
+            self._total_bytes += nbytes
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+        return True
+
+    def _remove(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._total_bytes -= nbytes
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'ttl': self.ttl
+            }
@@ -0,0 +1,799 @@
+"""
+批量生成调度器
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import torch
+import queue
+import threading
+import logging
+import time
+from config import ModelConfig
+from .kv_cache import PrefixKVCache, SessionKVCache
+from .speculative import (
+    DECODING_MODES, DECODING_STANDARD, DECODING_SPECULATIVE, DECODING_PROMPT_LOOKUP,
+    PromptLookupIndex, verify_draft_tokens
+)
+from utils.metrics import (
+    Counter, Histogram, SCOPE_INFERENCE, LATENCY_BUCKETS, TOKEN_BUCKETS, RATE_BUCKETS
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT_SECONDS = Histogram(
+    'chatbot_scheduler_queue_wait_seconds', '生成请求从提交到开始预填充的等待时间（秒）',
+    LATENCY_BUCKETS, scope=SCOPE_INFERENCE
+)
+PROMPT_TOKENS = Histogram(
+    'chatbot_prompt_tokens', '每个生成请求的提示词token数', TOKEN_BUCKETS, scope=SCOPE_INFERENCE
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    'chatbot_time_to_first_token_seconds', '从提交到生成第一个token的时间（秒）',
+    LATENCY_BUCKETS, ('decoding',), scope=SCOPE_INFERENCE
+)
+GENERATED_TOKENS = Histogram(
+    'chatbot_generated_tokens', '每个完成的请求生成的token数', TOKEN_BUCKETS, ('decoding',), scope=SCOPE_INFERENCE
+)
+TOKENS_PER_SECOND = Histogram(
+    'chatbot_generation_tokens_per_second', '每个完成的请求从预填充开始计算的生成速度（tokens/s）',
+    RATE_BUCKETS, ('decoding',), scope=SCOPE_INFERENCE
+)
+GENERATION_REQUESTS = Counter(
+    'chatbot_generation_requests_total', '结束的生成请求数', ('status',), scope=SCOPE_INFERENCE
+)
+
+# 调度线程上记录指标时直接使用预先取得的子指标
+_MODE_METRICS = {
+    mode: (TIME_TO_FIRST_TOKEN.labels(mode), GENERATED_TOKENS.labels(mode), TOKENS_PER_SECOND.labels(mode))
+    for mode in DECODING_MODES
+}
+_COMPLETED = GENERATION_REQUESTS.labels('completed')
+_FAILED = GENERATION_REQUESTS.labels('failed')
+_CANCELLED = GENERATION_REQUESTS.labels('cancelled')
+
+
+def _cache_to_layers(past_key_values):
+    """将模型返回的KV缓存统一转换为 [(key, value), ...] 列表"""
+    if isinstance(past_key_values, (tuple, list)):
+        return [(layer[0], layer[1]) for layer in past_key_values]
+    if hasattr(past_key_values, 'layers'):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+
+def _layers_to_cache(layers):
+    """将 [(key, value), ...] 列表转换为模型可接受的KV缓存对象"""
+    from transformers import DynamicCache
+
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(ddp_cache_data=layers)
+
+
+def _token_probabilities(logits, temperatures, top_k=None, top_p=None):
+    """按行计算采样分布，温度、top_k、top_p 的处理顺序与 transformers 一致"""
+    logits = logits.float() / temperatures.unsqueeze(1)
+
+    if top_k and top_k < logits.size(-1):
+        kth_values = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth_values, float('-inf'))
+
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=True, dim=-1)
+        sorted_probs = torch.softmax(sorted_logits, dim=-1)
+        remove = (sorted_probs.cumsum(dim=-1) - sorted_probs) > top_p
+        sorted_logits = sorted_logits.masked_fill(remove, float('-inf'))
+        logits = torch.full_like(logits, float('-inf')).scatter(-1, sorted_indices, sorted_logits)
+
+    return torch.softmax(logits, dim=-1)
+
+
+def _sample_next_tokens(logits, temperatures, top_k=None, top_p=None):
+    """按行温度采样下一个token"""
+    probs = _token_probabilities(logits, temperatures, top_k, top_p)
+    return torch.multinomial(probs, num_samples=1).squeeze(1)
+
+
+def _crop_layers(layers, length):
+    """将KV缓存截断到前 length 个位置"""
+    return [(k[:, :, :length], v[:, :, :length]) for k, v in layers]
+
+
+class GenerationRequest:
+    """调度器中的单个生成请求"""
+
+    def __init__(self, input_ids, max_new_tokens, temperature, stream=False, prefix_lengths=None,
+                 decoding=DECODING_STANDARD, session_id=None):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.decoding = decoding
+        self.prefix_lengths = sorted(prefix_lengths or [])
+        self.session_id = session_id
+        self.output_ids = []
+        self.token_queue = queue.Queue() if stream else None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        # 前向计算耗时（GPU上即GPU时间），批量解码的每一步按批次内序列数均摊
+        self.compute_seconds = 0.0
+        self.cached_tokens = 0
+        # 调用方不再需要结果时置位（客户端断开等），调度线程在下一步将其移出批次
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def add_token(self, token):
+        """追加新生成的token（由调度线程调用）"""
+        self.output_ids.append(token)
+        if self.token_queue is not None:
+            self.token_queue.put(token)
+
+    def finish(self, error=None):
+        """标记请求完成（由调度线程调用）"""
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+        if self.token_queue is not None:
+            self.token_queue.put(None)
+
+    def is_done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """取消请求（可由任意线程调用），调度线程停止为其生成并释放其KV缓存"""
+        self.cancelled = True
+
+    def usage(self):
+        """token数和各阶段时间点（Unix时间戳），用于报告的执行时间线"""
+        return {
+            'prompt_tokens': len(self.input_ids),
+            'cached_tokens': self.cached_tokens,
+            'generated_tokens': len(self.output_ids),
+            'decoding': self.decoding,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'first_token_at': self.first_token_at,
+            'finished_at': self.finished_at,
+            'compute_seconds': round(self.compute_seconds, 6)
+        }
+
+    def result(self, timeout=None):
+        """阻塞等待生成结果，返回新生成的token id列表"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("等待生成结果超时")
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.output_ids
+
+    def iter_tokens(self):
+        """流式请求：按生成顺序逐个产出token，生成结束后返回"""
+        if self.token_queue is None:
+            raise RuntimeError("该请求未开启流式输出")
+        while True:
+            token = self.token_queue.get()
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise RuntimeError(self.error)
+
+
+class EmbeddingRequest:
+    """调度器中的文本向量请求（对最后一层隐藏状态做均值池化）"""
+
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+        self.embedding = None
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def result(self, timeout=None):
+        """阻塞等待向量结果，返回一维CPU张量"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("等待向量结果超时")
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.embedding
+
+
+class IncrementalDecoder:
+    """增量解码token，只解码最近的窗口，避免每个token都重新解码全文"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def push(self, token):
+        """加入一个token，返回可以安全输出的新增文本"""
+        self.token_ids.append(token)
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset:self.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], skip_special_tokens=True)
+
+        # 末尾是不完整的多字节字符时先不输出，等待后续token
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self):
+        """输出剩余未输出的文本"""
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset:self.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], skip_special_tokens=True)
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+class _ActiveSequence:
+    """批次中正在解码的序列"""
+
+    def __init__(self, request, next_token, position):
+        self.request = request
+        self.next_token = next_token
+        self.position = position
+
+
+class _SpeculativeSequence:
+    """单独解码（batch=1）的推测解码序列
+
+    context 为提示词加已生成的全部token；目标模型KV缓存覆盖 context[:-1]，
+    最后一个token在下一步与候选token一起送入目标模型。
+    """
+
+    def __init__(self, request, context, layers, lookup=None):
+        self.request = request
+        self.context = context
+        self.layers = layers
+        self.lookup = lookup
+        self.draft_layers = None
+        self.draft_len = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.target_forwards = 0
+
+
+class GenerationScheduler:
+    """连续批处理推理调度器
+
+    独占模型对象，在单个后台线程中运行。新请求先单独预填充，再并入正在解码的
+    批次（左侧填充KV缓存对齐长度）；每一步对整批执行一次前向计算，已完成的序列
+    立即移出批次，空出的位置由排队中的请求补上。
+
+    预填充时会复用 PrefixKVCache 中命中的最长前缀，只计算剩余部分；请求声明的
+    共享前缀边界（prefix_lengths）在首次计算后写入缓存，供后续请求复用。
+    属于多轮会话的请求优先取用 SessionKVCache 中该会话上一轮保留的KV，结束时写回
+    覆盖“提示词 + 回复”的KV，下一轮只需预填充新增的消息。
+
+    选择推测解码（草稿模型 / 提示词查找）的请求不并入批次，而是单独解码，
+    与批次的解码步交替进行；每步一次目标模型前向计算校验多个候选token。
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=None, draft_model=None, session_alive=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.draft_model = draft_model
+        self.max_batch_size = max_batch_size or ModelConfig.MAX_BATCH_SIZE
+
+        generation_config = getattr(model, 'generation_config', None)
+        self.top_k = getattr(generation_config, 'top_k', None)
+        self.top_p = getattr(generation_config, 'top_p', None)
+        self.eos_token_ids = self._collect_eos_token_ids(generation_config, tokenizer)
+
+        self.prefix_cache = PrefixKVCache() if ModelConfig.PREFIX_CACHE_MAX_MB > 0 else None
+        self.session_cache = SessionKVCache() if ModelConfig.SESSION_KV_CACHE_MAX_MB > 0 else None
+        # session_alive(session_id) 判断会话是否仍存在；会话在生成期间被删除或过期时，结束后不再保留其KV
+        self.session_alive = session_alive or (lambda session_id: True)
+
+        self._queue = queue.Queue()
+        self._active = []
+        self._speculative = []
+        self._layers = None
+        self._attention_mask = None
+        self._running = True
+
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'generated_tokens': 0,
+            'decode_steps': 0,
+            'max_batch_seen': 0
+        }
+        # submitted 由各调用线程递增，需加锁；其余计数只由调度线程修改
+        self._stats_lock = threading.Lock()
+        self.speculative_stats = {
+            mode: {'requests': 0, 'proposed': 0, 'accepted': 0, 'target_forwards': 0, 'tokens': 0, 'seconds': 0.0}
+            for mode in DECODING_MODES
+        }
+
+        self._worker = threading.Thread(target=self._run, name='generation-scheduler', daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def _collect_eos_token_ids(generation_config, tokenizer):
+        eos_ids = set()
+        config_eos = getattr(generation_config, 'eos_token_id', None)
+        if isinstance(config_eos, (list, tuple)):
+            eos_ids.update(config_eos)
+        elif config_eos is not None:
+            eos_ids.add(config_eos)
+        if tokenizer.eos_token_id is not None:
+            eos_ids.add(tokenizer.eos_token_id)
+        return eos_ids
+
+    def submit(self, input_ids, max_new_tokens, temperature, stream=False, prefix_lengths=None, decoding=None,
+               session_id=None):
+        """提交生成请求，返回 GenerationRequest
+
+        调用方通过 result() 等待完整结果；stream=True 时可用 iter_tokens() 逐个读取token。
+        prefix_lengths 为可跨请求共享的前缀长度（token数），这些前缀的KV缓存会被保留复用。
+        decoding 为解码方式：standard（默认）、speculative（草稿模型）或 prompt_lookup（提示词查找）。
+        session_id 为多轮会话ID，同一会话的请求复用上一轮保留的KV缓存（调用方保证同一会话的请求依次提交）。
+        """
+        if not self._running:
+            raise RuntimeError("推理调度器已停止")
+
+        decoding = decoding or DECODING_STANDARD
+        if decoding not in DECODING_MODES:
+            raise ValueError(f"不支持的解码方式: {decoding}")
+        if decoding == DECODING_SPECULATIVE and self.draft_model is None:
+            logger.warning("未加载草稿模型，推测解码请求改用标准解码")
+            decoding = DECODING_STANDARD
+
+        request = GenerationRequest(
+            list(input_ids), max_new_tokens, temperature, stream=stream, prefix_lengths=prefix_lengths,
+            decoding=decoding, session_id=session_id
+        )
+        with self._stats_lock:
+            self.stats['submitted'] += 1
+        self._queue.put(request)
+        return request
+
+    def embed(self, input_ids):
+        """提交文本向量请求，返回 EmbeddingRequest"""
+        if not self._running:
+            raise RuntimeError("推理调度器已停止")
+
+        request = EmbeddingRequest(list(input_ids))
+        self._queue.put(request)
+        return request
+
+    def get_stats(self):
+        """获取调度器统计信息"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._queue.qsize()
+        stats['active'] = len(self._active) + len(self._speculative)
+        stats['max_batch_size'] = self.max_batch_size
+        stats['prefix_cache'] = self.prefix_cache.get_stats() if self.prefix_cache else None
+        stats['session_cache'] = self.session_cache.get_stats() if self.session_cache else None
+        stats['decoding'] = self._decoding_stats()
+        return stats
+
+    def _decoding_stats(self):
+        """各解码方式的接受率、每次前向产出token数和相对标准解码的速度比"""
+        standard = self.speculative_stats[DECODING_STANDARD]
+        standard_rate = standard['tokens'] / standard['seconds'] if standard['seconds'] else None
+
+        result = {}
+        for mode, data in self.speculative_stats.items():
+            if not data['requests']:
+                continue
+            rate = data['tokens'] / data['seconds'] if data['seconds'] else None
+            result[mode] = {
+                'requests': data['requests'],
+                'tokens_per_second': round(rate, 2) if rate else None
+            }
+            if mode != DECODING_STANDARD:
+                result[mode].update({
+                    'acceptance_rate': round(data['accepted'] / data['proposed'], 4) if data['proposed'] else 0.0,
+                    'tokens_per_forward': (round(data['tokens'] / data['target_forwards'], 3)
+                                           if data['target_forwards'] else None),
+                    'speedup': round(rate / standard_rate, 3) if rate and standard_rate else None
+                })
+        return result
+
+    def discard_session(self, session_id):
+        """删除会话保留的KV缓存（会话删除或过期时调用）"""
+        if self.session_cache is not None:
+            self.session_cache.discard(session_id)
+
+    def stop(self):
+        """停止调度线程，未完成的请求以错误结束"""
+        self._running = False
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def _run(self):
+        """调度主循环"""
+        with torch.inference_mode():
+            while self._running:
+                try:
+                    self._admit_requests()
+                    self._drop_cancelled()
+                    if self._active:
+                        self._decode_step()
+                    for seq in list(self._speculative):
+                        self._speculative_step(seq)
+                except Exception as e:
+                    logger.error(f"推理调度出错: {str(e)}", exc_info=True)
+                    self._fail_active(str(e))
+
+        self._fail_active("推理调度器已停止")
+        while not self._queue.empty():
+            request = self._queue.get_nowait()
+            if request is not None:
+                request.finish(error="推理调度器已停止")
+
+    def _admit_requests(self):
+        """从队列中取出请求并入批次；没有正在解码的序列时阻塞等待"""
+        while len(self._active) + len(self._speculative) < self.max_batch_size:
+            idle = not self._active and not self._speculative
+            try:
+                request = self._queue.get(block=idle, timeout=0.5 if idle else None)
+            except queue.Empty:
+                return
+
+            if request is None:
+                return
+
+            if isinstance(request, EmbeddingRequest):
+                self._embed(request)
+                continue
+
+            if request.cancelled:
+                self._finish_cancelled(request)
+                continue
+
+            try:
+                self._prefill(request)
+            except Exception as e:
+                logger.error(f"预填充失败: {str(e)}", exc_info=True)
+                self.stats['failed'] += 1
+                _FAILED.inc()
+                request.finish(error=str(e))
+
+    def _prefill(self, request):
+        """对单个请求执行预填充，并将其KV缓存并入当前批次"""
+        request.started_at = time.time()
+        device = self.model.device
+        input_ids = request.input_ids
+        QUEUE_WAIT_SECONDS.observe(request.started_at - request.submitted_at)
+        PROMPT_TOKENS.observe(len(input_ids))
+        past_len, past_layers = 0, None
+
+        if request.session_id is not None and self.session_cache is not None:
+            past_len, past_layers = self.session_cache.take(request.session_id, input_ids, device)
+
+        if not past_len and self.prefix_cache is not None:
+            past_len, past_layers = self.prefix_cache.lookup(input_ids)
+        # 只统计命中缓存的部分，下面本次计算后写入缓存的共享前缀不算在内
+        request.cached_tokens = past_len
+
+        if self.prefix_cache is not None:
+            for boundary in request.prefix_lengths:
+                if past_len < boundary < len(input_ids):
+                    past_layers = self._forward_prefill(input_ids[past_len:boundary], past_layers)[1]
+                    self.prefix_cache.put(input_ids[:boundary], past_layers)
+                    past_len = boundary
+
+        logits, layers = self._forward_prefill(input_ids[past_len:], past_layers)
+        temperatures = torch.tensor([request.temperature], device=device)
+        next_token = _sample_next_tokens(logits, temperatures, self.top_k, self.top_p).item()
+        request.compute_seconds += time.time() - request.started_at
+
+        if self._append_token(request, next_token):
+            self._save_session(request, layers)
+            return
+
+        if request.decoding != DECODING_STANDARD:
+            lookup = None
+            if request.decoding == DECODING_PROMPT_LOOKUP:
+                lookup = PromptLookupIndex(ModelConfig.PROMPT_LOOKUP_MAX_NGRAM, ModelConfig.PROMPT_LOOKUP_NUM_TOKENS)
+            self._speculative.append(_SpeculativeSequence(request, input_ids + [next_token], layers, lookup))
+            return
+
+        mask = torch.ones((1, len(input_ids)), dtype=torch.long, device=device)
+        self._merge_into_batch(layers, mask)
+        self._active.append(_ActiveSequence(request, next_token, len(input_ids)))
+        self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(self._active))
+
+    def _embed(self, request):
+        """计算文本向量，不占用批次位置"""
+        try:
+            input_ids = torch.tensor([request.input_ids], dtype=torch.long, device=self.model.device)
+            outputs = self.model(input_ids=input_ids, output_hidden_states=True, use_cache=False)
+            request.embedding = outputs.hidden_states[-1][0].float().mean(dim=0).cpu()
+            request.finish()
+        except Exception as e:
+            logger.error(f"计算文本向量失败: {str(e)}", exc_info=True)
+            request.finish(error=str(e))
+
+    def _forward_prefill(self, token_ids, past_layers=None):
+        """对单个序列的一段token做前向计算，返回 (最后位置的logits, 完整KV层列表)"""
+        logits, layers = self._forward_tokens(self.model, token_ids, past_layers)
+        return logits[-1:], layers
+
+    @staticmethod
+    def _forward_tokens(model, token_ids, past_layers=None):
+        """对单个序列的一段token做前向计算，返回 (各位置的logits, 完整KV层列表)"""
+        input_ids = torch.tensor([token_ids], dtype=torch.long, device=model.device)
+        past_key_values = _layers_to_cache(past_layers) if past_layers is not None else None
+
+        outputs = model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True)
+        return outputs.logits[0], _cache_to_layers(outputs.past_key_values)
+
+    def _merge_into_batch(self, layers, mask):
+        """将新序列的KV缓存左侧填充后拼接到批次上"""
+        if self._layers is None:
+            self._layers = layers
+            self._attention_mask = mask
+            return
+
+        batch_len = self._attention_mask.size(1)
+        new_len = mask.size(1)
+        target_len = max(batch_len, new_len)
+
+        merged = []
+        for (batch_k, batch_v), (new_k, new_v) in zip(self._layers, layers):
+            merged.append((
+                torch.cat([self._left_pad(batch_k, target_len), self._left_pad(new_k, target_len)], dim=0),
+                torch.cat([self._left_pad(batch_v, target_len), self._left_pad(new_v, target_len)], dim=0)
+            ))
+        self._layers = merged
+        self._attention_mask = torch.cat([
+            self._left_pad(self._attention_mask, target_len),
+            self._left_pad(mask, target_len)
+        ], dim=0)
+
+    @staticmethod
+    def _left_pad(tensor, target_len):
+        """在序列维度左侧补零（KV张量为dim=2，注意力掩码为dim=1）"""
+        seq_dim = 2 if tensor.dim() == 4 else 1
+        pad_len = target_len - tensor.size(seq_dim)
+        if pad_len <= 0:
+            return tensor
+        pad_shape = list(tensor.shape)
+        pad_shape[seq_dim] = pad_len
+        return torch.cat([tensor.new_zeros(pad_shape), tensor], dim=seq_dim)
+
+    def _decode_step(self):
+        """对整个批次执行一步解码"""
+        step_started = time.time()
+        device = self.model.device
+        input_ids = torch.tensor([[seq.next_token] for seq in self._active], dtype=torch.long, device=device)
+        position_ids = torch.tensor([[seq.position] for seq in self._active], dtype=torch.long, device=device)
+        attention_mask = torch.cat([
+            self._attention_mask,
+            self._attention_mask.new_ones((len(self._active), 1))
+        ], dim=1)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_layers_to_cache(self._layers),
+            use_cache=True
+        )
+        self._layers = _cache_to_layers(outputs.past_key_values)
+        self._attention_mask = attention_mask
+        self.stats['decode_steps'] += 1
+
+        temperatures = torch.tensor([seq.request.temperature for seq in self._active], device=device)
+        next_tokens = _sample_next_tokens(outputs.logits[:, -1, :], temperatures, self.top_k, self.top_p).tolist()
+        step_share = (time.time() - step_started) / len(self._active)
+
+        keep = []
+        for index, (seq, token) in enumerate(zip(self._active, next_tokens)):
+            seq.position += 1
+            seq.request.compute_seconds += step_share
+            if not self._append_token(seq.request, token):
+                seq.next_token = token
+                keep.append(index)
+            elif seq.request.session_id is not None and self.session_cache is not None:
+                self._save_session(seq.request, self._batch_row_layers(index))
+
+        if len(keep) < len(self._active):
+            self._retain(keep)
+
+    def _speculative_step(self, seq):
+        """推测解码一步：提出候选token，由目标模型一次前向计算校验"""
+        request = seq.request
+        step_started = time.time()
+        device = self.model.device
+        limit = request.max_new_tokens - len(request.output_ids) - 1
+
+        draft_probs = None
+        if request.decoding == DECODING_PROMPT_LOOKUP:
+            draft_tokens = seq.lookup.propose(seq.context, limit)
+        else:
+            draft_tokens, draft_probs = self._draft_propose(seq, min(limit, ModelConfig.SPECULATIVE_NUM_TOKENS))
+
+        base_len = len(seq.context) - 1
+        logits, layers = self._forward_tokens(self.model, [seq.context[-1]] + draft_tokens, seq.layers)
+        temperatures = torch.full((logits.size(0),), request.temperature, device=device)
+        probs = _token_probabilities(logits, temperatures, self.top_k, self.top_p)
+        if draft_probs is not None and draft_probs.size(1) != probs.size(1):
+            # 同系列模型词表一致，仅输出层可能按不同长度补齐
+            draft_probs = draft_probs[:, :probs.size(1)]
+            draft_probs = torch.nn.functional.pad(draft_probs, (0, probs.size(1) - draft_probs.size(1)))
+        accepted, token = verify_draft_tokens(probs, draft_tokens, draft_probs)
+
+        seq.layers = _crop_layers(layers, base_len + 1 + accepted)
+        if seq.draft_layers is not None and seq.draft_len > base_len + 1 + accepted:
+            seq.draft_len = base_len + 1 + accepted
+            seq.draft_layers = _crop_layers(seq.draft_layers, seq.draft_len)
+        seq.proposed += len(draft_tokens)
+        seq.accepted += accepted
+        seq.target_forwards += 1
+        self.stats['decode_steps'] += 1
+        request.compute_seconds += time.time() - step_started
+
+        for new_token in draft_tokens[:accepted] + [token]:
+            seq.context.append(new_token)
+            if self._append_token(request, new_token):
+                self._save_session(request, _crop_layers(seq.layers, len(seq.context) - 1))
+                self._speculative.remove(seq)
+                return
+
+    def _draft_propose(self, seq, num_tokens):
+        """用草稿模型自回归生成候选token，返回 (候选列表, 各候选位置的草稿分布)"""
+        if num_tokens <= 0:
+            return [], None
+
+        device = self.model.device
+        temperatures = torch.tensor([seq.request.temperature], device=device)
+        logits, seq.draft_layers = self._forward_tokens(
+            self.draft_model, seq.context[seq.draft_len:], seq.draft_layers
+        )
+        seq.draft_len = len(seq.context)
+
+        tokens, probs = [], []
+        for index in range(num_tokens):
+            dist = _token_probabilities(logits[-1:].to(device), temperatures, self.top_k, self.top_p)[0]
+            token = torch.multinomial(dist, num_samples=1).item()
+            tokens.append(token)
+            probs.append(dist)
+            if index < num_tokens - 1:
+                logits, seq.draft_layers = self._forward_tokens(self.draft_model, [token], seq.draft_layers)
+                seq.draft_len += 1
+
+        return tokens, torch.stack(probs)
+
+    def _append_token(self, request, token):
+        """记录新token，返回该请求是否已结束"""
+        request.add_token(token)
+        self.stats['generated_tokens'] += 1
+        if len(request.output_ids) == 1:
+            request.first_token_at = time.time()
+            _MODE_METRICS[request.decoding][0].observe(request.first_token_at - request.submitted_at)
+
+        if token in self.eos_token_ids or len(request.output_ids) >= request.max_new_tokens:
+            self.stats['completed'] += 1
+            _COMPLETED.inc()
+            request.finish()
+            self._record_decoding(request)
+            return True
+        return False
+
+    def _record_decoding(self, request):
+        """累计各解码方式的速度统计，推测解码请求结束时记录接受率和加速比"""
+        data = self.speculative_stats[request.decoding]
+        seconds = request.finished_at - (request.started_at or request.submitted_at)
+        data['requests'] += 1
+        data['tokens'] += len(request.output_ids)
+        data['seconds'] += seconds
+
+        _, generated_tokens, tokens_per_second = _MODE_METRICS[request.decoding]
+        generated_tokens.observe(len(request.output_ids))
+        if seconds > 0:
+            tokens_per_second.observe(len(request.output_ids) / seconds)
+
+        if request.decoding == DECODING_STANDARD:
+            return
+        seq = next((seq for seq in self._speculative if seq.request is request), None)
+        if seq is None:
+            return
+        data['proposed'] += seq.proposed
+        data['accepted'] += seq.accepted
+        data['target_forwards'] += seq.target_forwards
+
+        mode_stats = self._decoding_stats().get(request.decoding, {})
+        logger.info(
+            f"推测解码完成({request.decoding}): 生成 {len(request.output_ids)} tokens, "
+            f"接受率 {seq.accepted / seq.proposed if seq.proposed else 0:.1%}, "
+            f"每次前向 {len(request.output_ids) / seq.target_forwards:.2f} tokens, "
+            f"累计加速比 {mode_stats.get('speedup')}"
+        )
+
+    def _batch_row_layers(self, index):
+        """取出批次中一行去掉左侧填充后的KV缓存（复制一份，不引用整批张量）"""
+        valid_len = int(self._attention_mask[index].sum().item())
+        return [
+            (k[index:index + 1, :, -valid_len:].clone(), v[index:index + 1, :, -valid_len:].clone())
+            for k, v in self._layers
+        ]
+
+    def _save_session(self, request, layers):
+        """请求正常结束时保存会话的KV缓存，覆盖提示词和除最后一个token外的全部输出"""
+        if request.session_id is None or self.session_cache is None:
+            return
+        token_ids = request.input_ids + request.output_ids[:-1]
+        if layers[0][0].size(2) != len(token_ids):
+            logger.warning(
+                f"会话KV缓存长度与token数不一致，跳过缓存: {request.session_id}, "
+                f"{layers[0][0].size(2)} != {len(token_ids)}"
+            )
+            return
+        self.session_cache.put(request.session_id, token_ids, layers)
+        # 会话删除时先移出会话表再丢弃KV：写入后再检查一次，删除发生在写入之前或之后都不会留下无人取用的KV
+        if not self.session_alive(request.session_id):
+            self.session_cache.discard(request.session_id)
+            logger.debug(f"会话已在生成期间删除，丢弃其KV缓存: {request.session_id}")
+
+    def _retain(self, keep):
+        """移除已完成的序列，并裁掉所有行都为填充的前导列"""
+        if not keep:
+            self._active = []
+            self._layers = None
+            self._attention_mask = None
+            return
+
+        self._active = [self._active[i] for i in keep]
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        mask = self._attention_mask.index_select(0, index)
+
+        valid_columns = mask.sum(dim=0).nonzero()
+        start = valid_columns[0].item() if len(valid_columns) else 0
+
+        self._attention_mask = mask[:, start:]
+        self._layers = [
+            (k.index_select(0, index.to(k.device))[:, :, start:], v.index_select(0, index.to(v.device))[:, :, start:])
+            for k, v in self._layers
+        ]
+
+    def _drop_cancelled(self):
+        """移除已取消的序列：批次中的行连同其KV一起裁掉，单独解码的序列直接丢弃"""
+        if any(seq.request.cancelled for seq in self._active):
+            keep = []
+            for index, seq in enumerate(self._active):
+                if seq.request.cancelled:
+                    self._finish_cancelled(seq.request)
+                else:
+                    keep.append(index)
+            self._retain(keep)
+
+        for seq in [seq for seq in self._speculative if seq.request.cancelled]:
+            self._speculative.remove(seq)
+            self._finish_cancelled(seq.request)
+
+    def _finish_cancelled(self, request):
+        """以取消状态结束请求；会话KV缓存不写回，下一轮按历史重新预填充"""
+        self.stats['cancelled'] += 1
+        _CANCELLED.inc()
+        request.finish(error="生成已取消")
+        logger.info(f"生成请求已取消，已生成 {len(request.output_ids)}/{request.max_new_tokens} tokens")
+
+    def _fail_active(self, error):
+        """以错误结束当前批次中的所有请求"""
+        for seq in self._active + self._speculative:
+            self.stats['failed'] += 1
+            _FAILED.inc()
+            seq.request.finish(error=error)
+        self._active = []
+        self._speculative = []
+        self._layers = None
+        self._attention_mask = None
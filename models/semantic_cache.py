@@ -0,0 +1,172 @@
+"""
+语义近似回复缓存
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+from config import CacheConfig
+from utils.text_utils import normalize_whitespace
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbedder:
+    """使用本地小型编码模型生成文本向量（均值池化）"""
+
+    def __init__(self, model_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        self.model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
+        self.model.eval()
+        self._torch = torch
+        logger.info(f"语义缓存向量模型加载完成: {model_path}")
+
+    def __call__(self, text):
+        with self._torch.inference_mode():
+            inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
+            hidden = self.model(**inputs).last_hidden_state[0]
+            mask = inputs["attention_mask"][0].unsqueeze(-1).to(hidden.dtype)
+            return ((hidden * mask).sum(dim=0) / mask.sum()).float().numpy()
+
+
+class SemanticResponseCache:
+    """基于向量相似度的近似回复缓存
+
+    向量按行存放在预分配的NumPy矩阵中（已归一化），查找时一次矩阵乘法得到全部余弦相似度；
+    只有生成参数（思维模式、max_new_tokens、温度分档）相同的条目才参与匹配。
+    容量满时淘汰最久未使用的条目，过期条目视为无效。
+    """
+
+    def __init__(self, embed_fn, capacity=None, threshold=None, ttl=None, temperature_bucket=None):
+        self.embed_fn = embed_fn
+        self.capacity = capacity or CacheConfig.SEMANTIC_CACHE_CAPACITY
+        self.threshold = threshold if threshold is not None else CacheConfig.SEMANTIC_CACHE_THRESHOLD
+        self.ttl = ttl if ttl is not None else CacheConfig.RESPONSE_CACHE_TTL
+        self.temperature_bucket = temperature_bucket or CacheConfig.RESPONSE_CACHE_TEMPERATURE_BUCKET
+
+        self._matrix = None
+        self._valid = np.zeros(self.capacity, dtype=bool)
+        self._contexts = np.full(self.capacity, -1, dtype=np.int64)
+        self._expires_at = np.zeros(self.capacity, dtype=np.float64)
+        self._last_used = np.zeros(self.capacity, dtype=np.float64)
+        self._responses = [None] * self.capacity
+        self._generation_seconds = np.zeros(self.capacity, dtype=np.float64)
+        self._context_ids = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_count = 0
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+        self.embed_count = 0
+        self.embed_seconds = 0.0
+        self.saved_generation_seconds = 0.0
+
+    def make_context(self, enable_thinking, max_new_tokens, temperature):
+        """生成参数上下文，只有上下文相同的条目才会互相命中"""
+        key = (bool(enable_thinking), int(max_new_tokens), round(temperature / self.temperature_bucket))
+        with self._lock:
+            return self._context_ids.setdefault(key, len(self._context_ids))
+
+    def embed(self, text):
+        """计算归一化后的文本向量"""
+        start = time.perf_counter()
+        vector = np.asarray(self.embed_fn(normalize_whitespace(text)), dtype=np.float32).reshape(-1)
+        self.embed_count += 1
+        self.embed_seconds += time.perf_counter() - start
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, vector, context):
+        """查找最相似的缓存回复，返回 (回复或None, 相似度)"""
+        start = time.perf_counter()
+        with self._lock:
+            response, similarity = None, 0.0
+
+            if self._matrix is not None and self._matrix.shape[1] == vector.shape[0]:
+                now = time.time()
+                candidates = self._valid & (self._contexts == context) & (self._expires_at > now)
+                if candidates.any():
+                    similarities = self._matrix @ vector
+                    similarities[~candidates] = -1.0
+                    best = int(np.argmax(similarities))
+                    similarity = float(similarities[best])
+                    if similarity >= self.threshold:
+                        self._last_used[best] = now
+                        self.saved_generation_seconds += self._generation_seconds[best]
+                        response = dict(self._responses[best])
+
+            if response is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            elapsed = time.perf_counter() - start
+            self.lookup_count += 1
+            self.lookup_seconds += elapsed
+            self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+
+        return response, similarity
+
+    def put(self, vector, context, response, generation_seconds=0.0):
+        """写入缓存（仅缓存成功的回复）"""
+        if not response.get('success'):
+            return False
+
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+
+            now = time.time()
+            free_slots = np.flatnonzero(~self._valid | (self._expires_at <= now))
+            if len(free_slots):
+                slot = int(free_slots[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+
+            self._matrix[slot] = vector
+            self._valid[slot] = True
+            self._contexts[slot] = context
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._generation_seconds[slot] = generation_seconds
+            self._responses[slot] = {
+                'content': response.get('content'),
+                'thinking': response.get('thinking'),
+                'success': True
+            }
+        return True
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._valid[:] = False
+            self._responses = [None] * self.capacity
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': int(self._valid.sum()),
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'avg_lookup_ms': round(self.lookup_seconds / self.lookup_count * 1000, 3) if self.lookup_count else 0.0,
+                'max_lookup_ms': round(self.max_lookup_seconds * 1000, 3),
+                'avg_embed_ms': round(self.embed_seconds / self.embed_count * 1000, 3) if self.embed_count else 0.0,
+                'saved_generation_seconds': round(self.saved_generation_seconds, 3)
+            }
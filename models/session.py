@@ -0,0 +1,191 @@
+"""
+多轮对话会话
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+# 较早轮次的摘要以系统消息放在历史最前面
+SUMMARY_MESSAGE_PREFIX = "以下是此前对话的摘要，回答时请结合其中的信息：\n"
+
+
+class SessionNotFound(Exception):
+    """会话不存在或已过期"""
+
+
+class SessionBusy(Exception):
+    """会话的上一轮对话尚未结束"""
+
+
+class ChatSession:
+    """一个对话会话：按顺序保存的用户消息和助手回答
+
+    同一会话同时只能进行一轮对话（acquire/release），保证每轮的历史和KV缓存都基于上一轮的完整结果。
+    送入模型的只是上下文窗口（window_start 之后的消息）和较早轮次的摘要，由 ContextManager 维护。
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.messages = []
+        # 各消息正文的token数，写入时计算一次，之后按它估算提示词长度，不再重新分词
+        self.token_counts = []
+        self.window_start = 0
+        self.summary = None
+        self.summary_tokens = 0
+        # 后台摘要的结果 (摘要, token数, 摘要覆盖到的消息位置)，下次截断时使用
+        self.pending_summary = None
+        self.summarizing = False
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """开始一轮对话，上一轮未结束时抛出 SessionBusy"""
+        if not self._lock.acquire(blocking=False):
+            raise SessionBusy("该会话的上一条消息仍在生成中，请稍后再试")
+        self.last_active = time.time()
+
+    def release(self):
+        self.last_active = time.time()
+        self._lock.release()
+
+    @property
+    def busy(self):
+        return self._lock.locked()
+
+    def history(self):
+        """送入模型的历史消息：较早轮次的摘要（如有）和上下文窗口内的消息"""
+        messages = [{"role": "system", "content": SUMMARY_MESSAGE_PREFIX + self.summary}] if self.summary else []
+        messages.extend(self.messages[self.window_start:])
+        return messages
+
+    def append_turn(self, user_message, answer, user_tokens, answer_tokens):
+        """记录一轮完成的对话及各自的token数；只保存回答正文，思维过程不进入历史（与对话模板的处理一致）"""
+        self.messages.append({"role": "user", "content": user_message})
+        self.messages.append({"role": "assistant", "content": answer})
+        self.token_counts.extend((user_tokens, answer_tokens))
+        self.turns += 1
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "turns": self.turns,
+            "messages": list(self.messages),
+            "context_start": self.window_start,
+            "summary": self.summary,
+            "created_at": self.created_at,
+            "last_active": self.last_active
+        }
+
+
+class ChatSessionManager:
+    """会话表：空闲超过 ttl 的会话过期删除，会话数超过上限时删除最久未使用的空闲会话
+
+    on_remove(session_id) 在会话删除、过期或被淘汰时调用，用于释放会话保留的KV缓存。
+    """
+
+    def __init__(self, ttl=None, max_sessions=None, on_remove=None):
+        self.ttl = ttl if ttl is not None else ModelConfig.SESSION_TTL
+        self.max_sessions = max_sessions if max_sessions is not None else ModelConfig.MAX_SESSIONS
+        self.on_remove = on_remove
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self):
+        """新建会话，返回 ChatSession"""
+        session = ChatSession(uuid.uuid4().hex)
+        removed = []
+        with self._lock:
+            removed.extend(self._expire_locked())
+            while len(self._sessions) >= self.max_sessions:
+                victim = next((s for s in self._sessions.values() if not s.busy), None)
+                if victim is None:
+                    break
+                del self._sessions[victim.session_id]
+                removed.append(victim.session_id)
+                self.evicted += 1
+            self._sessions[session.session_id] = session
+            self.created += 1
+        self._notify_removed(removed)
+        return session
+
+    def get(self, session_id):
+        """取得会话并标记为最近使用，不存在或已过期时抛出 SessionNotFound"""
+        removed = []
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and self._is_expired(session):
+                del self._sessions[session_id]
+                removed.append(session_id)
+                self.expired += 1
+                session = None
+            if session is not None:
+                session.last_active = time.time()
+                self._sessions.move_to_end(session_id)
+        self._notify_removed(removed)
+        if session is None:
+            raise SessionNotFound("会话不存在或已过期")
+        return session
+
+    def exists(self, session_id):
+        """会话是否仍在会话表中（不更新最近使用时间）"""
+        with self._lock:
+            return session_id in self._sessions
+
+    def delete(self, session_id):
+        """删除会话，返回是否存在"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._notify_removed([session_id])
+        return session is not None
+
+    def cleanup(self):
+        """删除所有过期会话，返回删除的数量"""
+        with self._lock:
+            removed = self._expire_locked()
+        self._notify_removed(removed)
+        return len(removed)
+
+    def _is_expired(self, session):
+        return not session.busy and time.time() - session.last_active > self.ttl
+
+    def _expire_locked(self):
+        expired = [session_id for session_id, session in self._sessions.items() if self._is_expired(session)]
+        for session_id in expired:
+            del self._sessions[session_id]
+        self.expired += len(expired)
+        return expired
+
+    def _notify_removed(self, session_ids):
+        if self.on_remove is None:
+            return
+        for session_id in session_ids:
+            try:
+                self.on_remove(session_id)
+            except Exception as e:
+                logger.warning(f"释放会话资源失败 {session_id}: {str(e)}")
+
+    def get_stats(self):
+        """获取会话统计信息"""
+        with self._lock:
+            return {
+                'active_sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'ttl': self.ttl,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
@@ -0,0 +1,80 @@
+"""
+推测解码
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import torch
+
+DECODING_STANDARD = 'standard'
+DECODING_SPECULATIVE = 'speculative'
+DECODING_PROMPT_LOOKUP = 'prompt_lookup'
+DECODING_MODES = (DECODING_STANDARD, DECODING_SPECULATIVE, DECODING_PROMPT_LOOKUP)
+
+
+class PromptLookupIndex:
+    """在已有token（提示词+已生成内容）中查找与末尾n-gram相同的最近一次出现，
+    将其后续token作为候选
+
+    n-gram按结束位置增量建立索引，每次查找只处理新增的token。
+    """
+
+    def __init__(self, max_ngram, num_tokens):
+        self.max_ngram = max_ngram
+        self.num_tokens = num_tokens
+        self._index = {}
+        self._indexed_end = 0
+
+    def propose(self, context, limit=None):
+        """返回候选token列表，找不到匹配时返回空列表"""
+        limit = self.num_tokens if limit is None else min(limit, self.num_tokens)
+        if limit <= 0:
+            return []
+
+        # 索引所有结束位置早于末尾的n-gram（末尾n-gram本身不参与匹配）
+        for end in range(self._indexed_end + 1, len(context)):
+            for n in range(1, min(self.max_ngram, end) + 1):
+                self._index[tuple(context[end - n:end])] = end
+        self._indexed_end = max(self._indexed_end, len(context) - 1)
+
+        for n in range(min(self.max_ngram, len(context)), 0, -1):
+            end = self._index.get(tuple(context[-n:]))
+            if end is not None:
+                return list(context[end:end + limit])
+        return []
+
+
+def verify_draft_tokens(probs, draft_tokens, draft_probs=None):
+    """按推测采样规则校验候选token，保证输出分布与目标模型逐个采样完全一致
+
+    probs: 目标模型在各候选位置（及其后一个位置）的概率分布，形状 (k+1, vocab)
+    draft_probs: 草稿模型给出候选时的概率分布 (k, vocab)；为None时候选来自提示词查找（确定性提议）
+
+    候选 x_i 以 min(1, p_i(x_i) / q_i(x_i)) 的概率被接受（确定性提议时 q_i(x_i)=1）；
+    首个被拒绝的位置从残差分布 max(0, p_i - q_i) 中重新采样，全部接受时再从 p_k 追加一个token。
+    返回 (接受的候选数量, 最后采样的token)。
+    """
+    k = len(draft_tokens)
+    if k:
+        tokens = torch.tensor(draft_tokens, dtype=torch.long, device=probs.device).unsqueeze(1)
+        target = probs[:k].gather(1, tokens).squeeze(1)
+        if draft_probs is None:
+            accept_probs = target
+        else:
+            proposal = draft_probs.gather(1, tokens).squeeze(1)
+            accept_probs = (target / proposal.clamp(min=1e-10)).clamp(max=1.0)
+
+        rejected = (torch.rand_like(accept_probs) >= accept_probs).nonzero()
+        if len(rejected):
+            position = rejected[0].item()
+            if draft_probs is None:
+                residual = probs[position].clone()
+                residual[draft_tokens[position]] = 0
+            else:
+                residual = (probs[position] - draft_probs[position]).clamp(min=0)
+            if residual.sum() <= 0:
+                residual = probs[position]
+            token = torch.multinomial(residual / residual.sum(), num_samples=1).item()
+            return position, token
+
+    token = torch.multinomial(probs[k], num_samples=1).item()
+    return k, token
@@ -14,8 +14,11 @@ let messages = [];
 let messageIdCounter = 0;
 let isTyping = false;
 let isModelReady = false;
+let chatSessionId = null;
 let currentReportId = null;
 let reportPollingInterval = null;
+let reportEventSource = null;
+let reportState = null;
 
 let domElements = {};
 
@@ -125,11 +128,7 @@ function initializeApp() {
         showError('发生了未知错误，请稍后重试');
     });
 
-    window.addEventListener('beforeunload', function() {
-        if (reportPollingInterval) {
-            clearInterval(reportPollingInterval);
-        }
-    });
+    window.addEventListener('beforeunload', stopReportUpdates);
 }
 
 /**
@@ -369,14 +368,16 @@ async function handleSendMessage() {
     showTypingIndicator();
 
     try {
+        const sessionId = await ensureChatSession();
         const requestData = {
             message: message,
+            session_id: sessionId,
             max_new_tokens: domElements.maxTokensInput ? parseInt(domElements.maxTokensInput.value) : 1024,
             temperature: domElements.temperatureInput ? parseFloat(domElements.temperatureInput.value) : 0.7,
             enable_thinking: domElements.enableThinkingInput ? domElements.enableThinkingInput.checked : true
         };
 
-        const response = await fetch(`${CONFIG.API_BASE}/chat`, {
+        const response = await fetch(`${CONFIG.API_BASE}/chat/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -384,16 +385,22 @@ async function handleSendMessage() {
             body: JSON.stringify(requestData)
         });
 
-        const data = await response.json();
-
-        if (response.ok && data.success) {
+        if (!response.ok || !response.body) {
+            const data = await response.json().catch(() => ({}));
             hideTypingIndicator();
-            addMessage('assistant', data.message, data.thinking);
-        } else {
-            hideTypingIndicator();
-            showError(data.error || '请求失败');
+            if (response.status === 429 && data.retry_after) {
+                showError(`${data.error || '当前请求过多'}（约 ${data.retry_after} 秒后可重试）`);
+            } else if (data.session_expired) {
+                chatSessionId = null;
+                showError('对话已过期，请重新发送，将开始新的对话');
+            } else {
+                showError(data.error || '请求失败');
+            }
+            return;
         }
 
+        await consumeChatStream(response);
+
     } catch (error) {
         hideTypingIndicator();
         showError('网络连接失败，请检查后端服务是否运行');
@@ -401,6 +408,169 @@ async function handleSendMessage() {
     }
 }
 
+/**
+ * 取得当前对话的会话ID，首次发送时创建；创建失败时返回null（按单轮对话发送）
+ */
+async function ensureChatSession() {
+    if (chatSessionId) return chatSessionId;
+
+    try {
+        const response = await fetch(`${CONFIG.API_BASE}/chat/session`, { method: 'POST' });
+        if (response.ok) {
+            const data = await response.json();
+            chatSessionId = data.session_id;
+        }
+    } catch (error) {
+        console.warn('创建对话会话失败:', error);
+    }
+    return chatSessionId;
+}
+
+/**
+ * 解析单条SSE消息
+ */
+function parseSSEEvent(rawEvent) {
+    let type = 'message';
+    const dataLines = [];
+
+    rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            type = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+
+    if (dataLines.length === 0) return null;
+
+    try {
+        return { type: type, data: JSON.parse(dataLines.join('\n')) };
+    } catch (error) {
+        console.warn('无法解析SSE数据:', error);
+        return null;
+    }
+}
+
+/**
+ * 读取流式聊天响应并逐步渲染
+ */
+async function consumeChatStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let streamingMessage = null;
+    let finished = false;
+
+    while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const event = parseSSEEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            if (!event) continue;
+
+            if (event.type === 'queued') {
+                updateTypingQueueStatus(event.data);
+            } else if (event.type === 'thinking' || event.type === 'answer') {
+                if (!streamingMessage) {
+                    removeTypingIndicatorElement();
+                    streamingMessage = createStreamingMessage();
+                }
+                appendStreamingText(streamingMessage, event.type, event.data.text);
+            } else if (event.type === 'done') {
+                removeStreamingMessage(streamingMessage);
+                hideTypingIndicator();
+                addMessage('assistant', event.data.content, event.data.thinking);
+                finished = true;
+                break;
+            } else if (event.type === 'error') {
+                removeStreamingMessage(streamingMessage);
+                hideTypingIndicator();
+                if (event.data.session_expired) {
+                    chatSessionId = null;
+                    showError('对话已过期，请重新发送，将开始新的对话');
+                } else {
+                    showError(event.data.content || '请求失败');
+                }
+                finished = true;
+                break;
+            }
+        }
+    }
+
+    if (!finished) {
+        removeStreamingMessage(streamingMessage);
+        hideTypingIndicator();
+        showError('回复流意外中断，请重试');
+    }
+}
+
+/**
+ * 创建流式输出中的助手消息
+ */
+function createStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message assistant';
+    messageDiv.innerHTML = `
+        <div class="avatar">
+            <img src="/static/icons/t1.svg" alt="AI Assistant" style="width: 100%; height: 100%; object-fit: contain;" />
+        </div>
+        <div class="message-bubble assistant">
+            <div class="thinking-content expanded" style="display: none;">
+                <div class="thinking-section"></div>
+            </div>
+            <div class="markdown-content"></div>
+        </div>
+    `;
+    domElements.messagesContainer.appendChild(messageDiv);
+
+    return {
+        element: messageDiv,
+        thinkingContainer: messageDiv.querySelector('.thinking-content'),
+        thinkingElement: messageDiv.querySelector('.thinking-section'),
+        contentElement: messageDiv.querySelector('.markdown-content'),
+        thinking: '',
+        content: '',
+        renderScheduled: false
+    };
+}
+
+/**
+ * 追加流式文本，回答部分按帧合并渲染Markdown
+ */
+function appendStreamingText(streamingMessage, type, text) {
+    if (type === 'thinking') {
+        streamingMessage.thinking += text;
+        streamingMessage.thinkingContainer.style.display = 'block';
+        streamingMessage.thinkingElement.textContent = streamingMessage.thinking;
+    } else {
+        streamingMessage.content += text;
+        if (!streamingMessage.renderScheduled) {
+            streamingMessage.renderScheduled = true;
+            requestAnimationFrame(() => {
+                streamingMessage.renderScheduled = false;
+                streamingMessage.contentElement.innerHTML = typeof marked !== 'undefined'
+                    ? marked.parse(streamingMessage.content)
+                    : streamingMessage.content;
+            });
+        }
+    }
+    scrollToBottom();
+}
+
+/**
+ * 移除流式输出中的临时消息
+ */
+function removeStreamingMessage(streamingMessage) {
+    if (streamingMessage && streamingMessage.element) {
+        streamingMessage.element.remove();
+    }
+}
+
 /**
  * 添加消息到界面
  */
@@ -513,16 +683,44 @@ function showTypingIndicator() {
     scrollToBottom();
 }
 
+/**
+ * 在打字指示器中显示排队位置和预计等待时间
+ */
+function updateTypingQueueStatus(queueInfo) {
+    const typingDiv = document.getElementById('typingIndicator');
+    if (!typingDiv) return;
+
+    let statusElement = typingDiv.querySelector('.typing-queue-status');
+    if (!statusElement) {
+        statusElement = document.createElement('div');
+        statusElement.className = 'typing-queue-status';
+        typingDiv.appendChild(statusElement);
+    }
+
+    let text = queueInfo.loading ? '模型加载中，请求已排队' : `排队中，第 ${queueInfo.position} 位`;
+    if (queueInfo.estimated_wait !== null && queueInfo.estimated_wait !== undefined) {
+        text += `，预计等待约 ${Math.ceil(queueInfo.estimated_wait)} 秒`;
+    }
+    statusElement.textContent = text;
+}
+
 /**
  * 隐藏打字指示器
  */
 function hideTypingIndicator() {
     isTyping = false;
+    removeTypingIndicatorElement();
+    updateSendButtonState();
+}
+
+/**
+ * 仅移除打字指示器元素（流式输出期间保持 isTyping 状态）
+ */
+function removeTypingIndicatorElement() {
     const typingIndicator = document.getElementById('typingIndicator');
     if (typingIndicator) {
         typingIndicator.remove();
     }
-    updateSendButtonState();
 }
 
 /**
@@ -598,10 +796,7 @@ function resetReportModal() {
         dynamicElements.forEach(element => element.remove());
     }
 
-    if (reportPollingInterval) {
-        clearInterval(reportPollingInterval);
-        reportPollingInterval = null;
-    }
+    stopReportUpdates();
     currentReportId = null;
 }
 
@@ -643,7 +838,7 @@ async function startReportGeneration() {
 
         if (response.ok && data.report_id) {
             currentReportId = data.report_id;
-            startPollingReportStatus();
+            startReportEventStream();
         } else {
             throw new Error(data.error || '开始生成报告失败');
         }
@@ -662,12 +857,77 @@ async function startReportGeneration() {
 }
 
 /**
- * 开始轮询报告状态
+ * 停止接收报告进度（关闭事件流并停止轮询）
  */
-function startPollingReportStatus() {
+function stopReportUpdates() {
+    if (reportEventSource) {
+        reportEventSource.close();
+        reportEventSource = null;
+    }
     if (reportPollingInterval) {
         clearInterval(reportPollingInterval);
+        reportPollingInterval = null;
     }
+}
+
+/**
+ * 通过服务器推送事件接收报告进度，不支持 EventSource 时回退为轮询
+ */
+function startReportEventStream() {
+    stopReportUpdates();
+
+    if (typeof EventSource === 'undefined') {
+        startPollingReportStatus();
+        return;
+    }
+
+    reportState = null;
+    reportEventSource = new EventSource(`${CONFIG.API_BASE}/report/events/${currentReportId}`);
+
+    // 连接建立（包括断线自动重连）时服务端先发送完整状态
+    reportEventSource.addEventListener('snapshot', event => {
+        reportState = JSON.parse(event.data);
+        updateReportProgress(reportState);
+    });
+
+    reportEventSource.addEventListener('progress', event => {
+        reportState = Object.assign({}, reportState, JSON.parse(event.data));
+        updateReportProgress(reportState);
+    });
+
+    reportEventSource.addEventListener('section', event => {
+        const data = JSON.parse(event.data);
+        if (!reportState) return;
+        const completedIds = reportState.completed_section_ids || [];
+        if (!completedIds.includes(data.section_id)) {
+            completedIds.push(data.section_id);
+        }
+        reportState.completed_section_ids = completedIds;
+        reportState.sections_completed = data.sections_completed;
+        updateReportProgress(reportState);
+    });
+
+    ['completed', 'failed'].forEach(eventType => {
+        reportEventSource.addEventListener(eventType, event => {
+            stopReportUpdates();
+            reportState = Object.assign({}, reportState, JSON.parse(event.data));
+            updateReportProgress(reportState);
+        });
+    });
+
+    reportEventSource.onerror = () => {
+        // 报告已结束时服务端会关闭连接，此时不再重连
+        if (reportState && (reportState.status === 'completed' || reportState.status === 'error')) {
+            stopReportUpdates();
+        }
+    };
+}
+
+/**
+ * 开始轮询报告状态
+ */
+function startPollingReportStatus() {
+    stopReportUpdates();
 
     reportPollingInterval = setInterval(async () => {
         if (!currentReportId) return;
@@ -737,22 +997,23 @@ function updateReportProgress(data) {
 
     // 显示章节进度
     if (data.outline && data.outline.sections) {
-        showSectionProgress(data.outline.sections, data.sections_completed);
+        showSectionProgress(data.outline.sections, data.completed_section_ids || []);
     }
 }
 
 /**
  * 显示章节进度
  */
-function showSectionProgress(sections, completedCount) {
+function showSectionProgress(sections, completedIds) {
     if (!domElements.progressSections) return;
 
     domElements.progressSections.style.display = 'block';
     domElements.progressSections.innerHTML = '<h4 style="margin-bottom: 0.5rem; font-size: 0.875rem;">章节进度:</h4>';
 
-    sections.forEach((section, index) => {
-        const isCompleted = index < completedCount;
-        const isGenerating = index === completedCount;
+    // 章节并行生成，完成顺序不固定，按章节ID判断完成状态
+    sections.forEach(section => {
+        const isCompleted = completedIds.includes(section.id);
+        const isGenerating = !isCompleted;
 
         const sectionDiv = document.createElement('div');
         sectionDiv.className = 'section-item';
@@ -773,10 +1034,7 @@ function showSectionProgress(sections, completedCount) {
  * 处理报告生成完成
  */
 function handleReportCompletion(data) {
-    if (reportPollingInterval) {
-        clearInterval(reportPollingInterval);
-        reportPollingInterval = null;
-    }
+    stopReportUpdates();
 
     if (domElements.startGeneration) {
         domElements.startGeneration.textContent = '生成完成';
@@ -884,6 +1142,11 @@ function showDownloadOptions() {
                download="report_${currentReportId}.docx">
                 📄 下载Word文档
             </a>
+            <a href="${CONFIG.API_BASE}/report/download/${currentReportId}/md"
+               class="download-btn secondary"
+               download="report_${currentReportId}.md">
+                📝 下载Markdown
+            </a>
             <button class="download-btn secondary" onclick="generateNewReport()">
                 🔄 生成新报告
             </button>
@@ -917,10 +1180,7 @@ function addCompletionMessageToChat(data) {
  */
 function handleReportError(data) {
 
-    if (reportPollingInterval) {
-        clearInterval(reportPollingInterval);
-        reportPollingInterval = null;
-    }
+    stopReportUpdates();
 
     if (domElements.startGeneration) {
         domElements.startGeneration.disabled = false;
@@ -1081,6 +1341,10 @@ function displayReportList(reports) {
             <h3 class="report-list-title">我的报告</h3>
             <div style="display: flex; align-items: center; gap: 1rem;">
                 <span class="report-list-stats">共 ${reports.length} 份报告</span>
+                ${completedReports.length > 0 ? `
+                <a class="refresh-btn" href="${CONFIG.API_BASE}/report/export?format=all" title="打包下载全部已完成报告">
+                    📦
+                </a>` : ''}
                 <button class="refresh-btn" onclick="loadReportList()" title="刷新列表">
                     ↻
                 </button>
@@ -1148,6 +1412,11 @@ function renderReportItem(report) {
                download="report_${report.id}.docx">
                 📄 下载Word
             </a>
+            <a href="${CONFIG.API_BASE}/report/download/${report.id}/md"
+               class="report-action-btn secondary"
+               download="report_${report.id}.md">
+                📝 Markdown
+            </a>
             <button class="report-action-btn secondary" onclick="copyReportInfo('${report.id}', '${report.topic}')">
                 📋 复制信息
             </button>
@@ -5,6 +5,7 @@
 
 from .document_utils import (
     create_word_document,
+    render_word_document,
     create_markdown_document,
     clean_text_for_word,
     set_font_style,
@@ -26,8 +27,17 @@ from .text_utils import (
     TextProcessor
 )
 
+from .security_scanner import (
+    SecurityScanner,
+    StreamScanner,
+    SecurityMatch,
+    DEFAULT_RULES,
+    load_rules
+)
+
 __all__ = [
     'create_word_document',
+    'render_word_document',
     'create_markdown_document',
     'clean_text_for_word',
     'set_font_style',
@@ -44,7 +54,13 @@ __all__ = [
     'normalize_whitespace',
     'escape_html',
     'count_words',
-    'TextProcessor'
+    'TextProcessor',
+
+    'SecurityScanner',
+    'StreamScanner',
+    'SecurityMatch',
+    'DEFAULT_RULES',
+    'load_rules'
 ]
 
 __version__ = '1.0.0'
\ No newline at end of file
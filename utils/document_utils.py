@@ -3,36 +3,35 @@
 中央财经大学经济学院 - 经济学大模型聊天助手
 """
 
+import io
 import re
 import logging
 from datetime import datetime
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.shared import OxmlElement, qn
-from docx.shared import RGBColor
+
+from .markdown_cleaner import clean_word_text
 
 logger = logging.getLogger(__name__)
 
+_EMPHASIS_QUOTES = re.compile(r'[「」]')
+
+# 章节数达到该值时直接流式生成 document.xml
+STREAMING_SECTION_THRESHOLD = 30
+
 
 def clean_text_for_word(text):
     """清理文本内容，移除特殊字符和格式"""
     if not text:
         return ""
 
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # 粗体
-    text = re.sub(r'\*(.*?)\*', r'\1', text)  # 斜体
-    text = re.sub(r'#{1,6}\s*', '', text)  # 标题符号
-    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)  # 代码块
-    text = re.sub(r'`([^`]*)`', r'\1', text)  # 行内代码
-
-    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
-
-    return text.strip()
+    # 粗体、斜体、标题符号、代码块、行内代码，依次处理后合并多余空行
+    return clean_word_text(text)
 
 
 def set_font_style(run, font_name="SimSun", font_size=12, bold=False, color=None):
     """设置字体样式"""
+    from docx.shared import Pt
+    from docx.oxml.shared import qn
+
     try:
         run.font.name = font_name
         run.font.size = Pt(font_size)
@@ -75,134 +74,129 @@ def add_table_with_style(doc, rows, cols, data=None):
         return None
 
 
-def create_word_document(report_data):
-    """创建Word文档"""
-    try:
-        doc = Document()
+def build_report_blocks(report_data, generated_at=None):
+    """将报告内容转换为渲染块（格式见 utils.docx_renderer），所有格式均通过样式引用"""
+    from .docx_renderer import sanitize_text
 
-        if not report_data.get('outline'):
-            raise ValueError("报告大纲数据缺失")
+    generated_at = generated_at or datetime.now()
 
-        outline = report_data['outline']
-        sections = report_data.get('sections', {})
+    if not report_data.get('outline'):
+        raise ValueError("报告大纲数据缺失")
 
-        style = doc.styles['Normal']
-        font = style.font
-        font.name = 'SimSun'
-        font.size = Pt(12)
+    outline = report_data['outline']
+    sections = report_data.get('sections', {})
+    blocks = []
 
-        if outline.get('title'):
-            title = doc.add_heading(outline['title'], 0)
-            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            for run in title.runs:
-                set_font_style(run, "SimSun", 18, bold=True)
-        else:
-            title = doc.add_heading('经济学报告', 0)
-            title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            for run in title.runs:
-                set_font_style(run, "SimSun", 18, bold=True)
+    def paragraph(style, text, char_style=None):
+        blocks.append(('paragraph', style, [(sanitize_text(text), char_style)]))
 
-        info_para = doc.add_paragraph()
-        info_run = info_para.add_run(f"生成时间：{datetime.now().strftime('%Y年%m月%d日 %H:%M')}")
-        set_font_style(info_run, "SimSun", 10)
-        info_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    paragraph('Title', outline.get('title') or '经济学报告')
+    paragraph('Report Info', f"生成时间：{generated_at.strftime('%Y年%m月%d日 %H:%M')}")
 
-        info_data = [
+    blocks.append(('table', 'Report Table Text', 'Report Strong', [
+        [sanitize_text(str(cell)) for cell in row] for row in (
             ('报告主题', report_data.get('topic', '未指定')),
             ('章节数量', str(len(sections))),
             ('生成系统', 'CUFE经济学大模型')
-        ]
-
-        info_table = add_table_with_style(doc, 3, 2, info_data)
-        doc.add_paragraph()
-
-        if outline.get('abstract'):
-            abstract_heading = doc.add_heading('摘要', level=1)
-            for run in abstract_heading.runs:
-                set_font_style(run, "SimSun", 16, bold=True)
-
-            abstract_content = clean_text_for_word(outline['abstract'])
-            abstract_paragraph = doc.add_paragraph()
-            abstract_run = abstract_paragraph.add_run(abstract_content)
-            set_font_style(abstract_run, "SimSun", 12)
-
-        if outline.get('sections'):
-            toc_heading = doc.add_heading('目录', level=1)
-            for run in toc_heading.runs:
-                set_font_style(run, "SimSun", 16, bold=True)
-
-            for section in outline['sections']:
-                toc_paragraph = doc.add_paragraph(f"{section.get('id', '')}. {section.get('title', '')}")
-                for run in toc_paragraph.runs:
-                    set_font_style(run, "SimSun", 12)
-
-            doc.add_page_break()
-
-
-        if outline.get('sections'):
-            for section in outline['sections']:
-                section_id = section.get('id')
-                section_title = section.get('title', '')
+        )
+    ]))
+    blocks.append(('paragraph', 'Normal', []))
+
+    if outline.get('abstract'):
+        paragraph('Heading 1', '摘要')
+        paragraph('Normal', clean_text_for_word(outline['abstract']))
+
+    if outline.get('sections'):
+        paragraph('Heading 1', '目录')
+        for section in outline['sections']:
+            paragraph('Normal', f"{section.get('id', '')}. {section.get('title', '')}")
+        blocks.append(('page_break',))
+
+        for section in outline['sections']:
+            section_id = section.get('id')
+            section_title = section.get('title', '')
+
+            if section_title:
+                paragraph('Heading 1', f"{section_id}. {section_title}")
+
+            if section_id in sections and sections[section_id].get('content'):
+                content = clean_text_for_word(sanitize_text(sections[section_id]['content']))
+
+                for para_text in content.split('\n\n'):
+                    para_text = para_text.strip()
+                    if not para_text:
+                        continue
+                    if '「' in para_text and '」' in para_text:
+                        # 「」之间的内容加粗
+                        parts = _EMPHASIS_QUOTES.split(para_text)
+                        blocks.append(('paragraph', 'Normal', [
+                            (part, 'Report Strong' if i % 2 == 1 else None) for i, part in enumerate(parts) if part
+                        ]))
+                    else:
+                        blocks.append(('paragraph', 'Normal', [(para_text, None)]))
+            else:
+                paragraph('Normal', "本章节内容正在完善中...")
+
+    blocks.append(('page_break',))
+    paragraph('Heading 1', '生成信息')
+    paragraph('Report Footer', f"""本报告由CUFE经济学大模型自动生成
+生成时间：{generated_at.strftime('%Y年%m月%d日 %H:%M:%S')}
+报告ID：{report_data.get('id', 'N/A')}
+中央财经大学经济学院出品""")
 
-                if section_title:
-                    section_heading = doc.add_heading(f"{section_id}. {section_title}", level=1)
-                    for run in section_heading.runs:
-                        set_font_style(run, "SimSun", 16, bold=True)
+    return blocks
 
-                if section_id in sections and sections[section_id].get('content'):
-                    content = clean_text_for_word(sections[section_id]['content'])
 
-                    paragraphs = content.split('\n\n')
-                    for para_text in paragraphs:
-                        para_text = para_text.strip()
-                        if para_text:
-                            paragraph = doc.add_paragraph()
+def _error_blocks(error):
+    return [
+        ('paragraph', 'Title', [('报告生成错误', None)]),
+        ('paragraph', 'Normal', [(f"报告生成时遇到错误：{error}", None)])
+    ]
 
-                            if '「' in para_text and '」' in para_text:
-                                parts = re.split(r'[「」]', para_text)
-                                for i, part in enumerate(parts):
-                                    if part:
-                                        run = paragraph.add_run(part)
 
-                                        set_font_style(run, "SimSun", 12, bold=(i % 2 == 1))
-                            else:
-                                para_run = paragraph.add_run(para_text)
-                                set_font_style(para_run, "SimSun", 12)
-                else:
+def create_word_document(report_data, generated_at=None):
+    """创建Word文档
 
-                    placeholder_paragraph = doc.add_paragraph()
-                    placeholder_run = placeholder_paragraph.add_run("本章节内容正在完善中...")
-                    set_font_style(placeholder_run, "SimSun", 12)
+    generated_at 为文档中显示的生成时间，默认取当前时间；传入报告完成时间可使同一报告的渲染结果保持一致。
+    """
+    from .docx_renderer import build_document
 
+    try:
+        doc = build_document(build_report_blocks(report_data, generated_at))
+        logger.info("Word文档创建完成")
+        return doc
 
-        doc.add_page_break()
-        footer_heading = doc.add_heading('生成信息', level=1)
-        for run in footer_heading.runs:
-            set_font_style(run, "SimSun", 16, bold=True)
+    except Exception as e:
+        logger.error(f"创建Word文档失败: {str(e)}", exc_info=True)
+        return build_document(_error_blocks(e))
 
-        footer_paragraph = doc.add_paragraph()
-        footer_text = f"""本报告由CUFE经济学大模型自动生成
-生成时间：{datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}
-报告ID：{report_data.get('id', 'N/A')}
-中央财经大学经济学院出品"""
 
-        footer_run = footer_paragraph.add_run(footer_text)
-        set_font_style(footer_run, "SimSun", 10)
-        footer_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+def render_word_document(report_data, generated_at=None, streaming_sections=None):
+    """渲染Word报告，返回docx文件的字节内容
 
-        logger.info("Word文档创建完成")
-        return doc
+    章节数达到 streaming_sections 时跳过 python-docx 对象模型，直接生成 document.xml 写入zip。
+    """
+    from .docx_renderer import build_document, write_document
 
+    streaming_sections = streaming_sections or STREAMING_SECTION_THRESHOLD
+    buffer = io.BytesIO()
+    try:
+        blocks = build_report_blocks(report_data, generated_at)
+        if len(report_data['outline'].get('sections') or []) >= streaming_sections:
+            write_document(blocks, buffer)
+        else:
+            build_document(blocks).save(buffer)
     except Exception as e:
         logger.error(f"创建Word文档失败: {str(e)}", exc_info=True)
-        doc = Document()
-        error_title = doc.add_heading('报告生成错误', 0)
-        error_para = doc.add_paragraph(f"报告生成时遇到错误：{str(e)}")
-        return doc
+        buffer = io.BytesIO()
+        write_document(_error_blocks(e), buffer)
+    return buffer.getvalue()
 
 
-def create_markdown_document(report_data):
+def create_markdown_document(report_data, generated_at=None):
     """创建Markdown文档"""
+    generated_at = generated_at or datetime.now()
+
     try:
         if not report_data.get('outline'):
             raise ValueError("报告大纲数据缺失")
@@ -215,7 +209,7 @@ def create_markdown_document(report_data):
         if outline.get('title'):
             markdown_content.append(f"# {outline['title']}\n")
 
-        markdown_content.append(f"**生成时间**: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}\n")
+        markdown_content.append(f"**生成时间**: {generated_at.strftime('%Y年%m月%d日 %H:%M')}\n")
         markdown_content.append(f"**生成系统**: CUFE经济学大模型\n")
         markdown_content.append(f"**报告主题**: {report_data.get('topic', '未指定')}\n\n")
 
@@ -246,7 +240,7 @@ def create_markdown_document(report_data):
 
         markdown_content.append("---\n\n")
         markdown_content.append("## 生成信息\n\n")
-        markdown_content.append(f"- **生成时间**: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}\n")
+        markdown_content.append(f"- **生成时间**: {generated_at.strftime('%Y年%m月%d日 %H:%M:%S')}\n")
         markdown_content.append(f"- **报告ID**: {report_data.get('id', 'N/A')}\n")
         markdown_content.append("- **出品方**: 中央财经大学经济学院\n")
 
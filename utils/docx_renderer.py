@@ -0,0 +1,250 @@
+"""
+基于样式的Word文档渲染
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+文档内容描述为块列表，字体、字号、加粗和对齐全部定义在模板的样式中，块只引用样式名：
+    ('paragraph', 样式, [(文本, 字符样式或None), ...])
+    ('page_break',)
+    ('table', 单元格段落样式, 表头字符样式, [[单元格文本, ...], ...])
+
+模板（含全部样式）每个进程只构建一次。渲染可以走 python-docx 对象模型（build_document），
+也可以直接生成 document.xml 并以流的方式写入zip（write_document），后者适合很长的报告。
+"""
+
+import io
+import logging
+import re
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+FONT_NAME = 'SimSun'
+
+# 样式名 -> (基础样式, 字号, 加粗, 对齐)；None 表示沿用基础样式
+PARAGRAPH_STYLES = {
+    'Normal': (None, 12, None, None),
+    'Title': (None, 18, True, 'center'),
+    'Heading 1': (None, 16, True, None),
+    'Report Info': ('Normal', 10, None, 'right'),
+    'Report Footer': ('Normal', 10, None, 'center'),
+    'Report Table Text': ('Normal', 11, None, None),
+}
+CHARACTER_STYLES = {
+    'Report Strong': (True,),
+}
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_LINE_BREAKS = re.compile('(\n|\t)')
+
+_template_lock = threading.Lock()
+_template = None
+
+
+def sanitize_text(text):
+    """移除XML中不允许出现的控制字符"""
+    return _INVALID_XML_CHARS.sub('', text or '')
+
+
+class _Template:
+    """已设置好样式的空白模板，以及直接写XML时需要的各部分"""
+
+    def __init__(self, data, style_ids, document_head, document_tail):
+        self.data = data
+        self.style_ids = style_ids
+        self.document_head = document_head
+        self.document_tail = document_tail
+
+
+def _apply_font(style, size, bold):
+    from docx.shared import Pt
+    from docx.oxml.shared import qn
+
+    style.font.name = FONT_NAME
+    if size:
+        style.font.size = Pt(size)
+    if bold is not None:
+        style.font.bold = bold
+
+    # 标题样式默认引用主题字体，主题字体优先于显式字体，需移除
+    rfonts = style.element.get_or_add_rPr().get_or_add_rFonts()
+    for attribute in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+        rfonts.attrib.pop(qn(attribute), None)
+    rfonts.set(qn('w:eastAsia'), FONT_NAME)
+
+
+def _build_template():
+    from docx import Document
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    alignments = {'center': WD_ALIGN_PARAGRAPH.CENTER, 'right': WD_ALIGN_PARAGRAPH.RIGHT}
+
+    doc = Document()
+    styles = doc.styles
+    style_ids = {}
+
+    for name, (base, size, bold, alignment) in PARAGRAPH_STYLES.items():
+        if name in [style.name for style in styles]:
+            style = styles[name]
+        else:
+            style = styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+            style.base_style = styles[base]
+            style.quick_style = True
+        _apply_font(style, size, bold)
+        if alignment:
+            style.paragraph_format.alignment = alignments[alignment]
+        style_ids[name] = style.style_id
+
+    for name, (bold,) in CHARACTER_STYLES.items():
+        style = styles.add_style(name, WD_STYLE_TYPE.CHARACTER)
+        style.font.bold = bold
+        style_ids[name] = style.style_id
+
+    style_ids['Table Grid'] = styles['Table Grid'].style_id
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    data = buffer.getvalue()
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        document_xml = archive.read('word/document.xml').decode('utf-8')
+    body_start = document_xml.index('<w:body>') + len('<w:body>')
+    body_end = document_xml.index('<w:sectPr')
+    return _Template(data, style_ids, document_xml[:body_start], document_xml[body_end:])
+
+
+def get_template():
+    """返回进程内缓存的模板"""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = _build_template()
+    return _template
+
+
+def build_document(blocks):
+    """用 python-docx 对象模型渲染块列表，返回 Document"""
+    from docx import Document
+
+    template = get_template()
+    doc = Document(io.BytesIO(template.data))
+
+    # python-docx 按样式对象赋值时每次都要遍历整个样式表查找默认样式，这里直接写入样式ID
+    style_ids = dict(template.style_ids, Normal=None)
+
+    for block in blocks:
+        kind = block[0]
+        if kind == 'paragraph':
+            _, style, runs = block
+            paragraph = doc.add_paragraph()
+            paragraph._p.style = style_ids[style]
+            for text, char_style in runs:
+                paragraph.add_run(text)._r.style = style_ids.get(char_style)
+        elif kind == 'page_break':
+            doc.add_page_break()
+        elif kind == 'table':
+            _, cell_style, header_style, rows = block
+            table = doc.add_table(rows=len(rows), cols=max(len(row) for row in rows))
+            table._tbl.tblPr.style = style_ids['Table Grid']
+            for i, row in enumerate(rows):
+                for j, text in enumerate(row):
+                    paragraph = table.cell(i, j).paragraphs[0]
+                    paragraph._p.style = style_ids[cell_style]
+                    paragraph.add_run(text)._r.style = style_ids[header_style] if i == 0 else None
+
+    return doc
+
+
+def _run_xml(text, char_style_id):
+    properties = f'<w:rPr><w:rStyle w:val="{char_style_id}"/></w:rPr>' if char_style_id else ''
+    parts = []
+    for piece in _LINE_BREAKS.split(text):
+        if piece == '\n':
+            parts.append('<w:br/>')
+        elif piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece:
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+    return f'<w:r>{properties}{"".join(parts)}</w:r>'
+
+
+def _paragraph_xml(style_id, runs, style_ids):
+    properties = f'<w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>' if style_id and style_id != 'Normal' else ''
+    content = ''.join(_run_xml(text, style_ids.get(char_style)) for text, char_style in runs)
+    return f'<w:p>{properties}{content}</w:p>'
+
+
+# 与 python-docx 的 add_table 一致：表格宽度为页面可用宽度，各列等分
+_TEXT_WIDTH_TWIPS = 12240 - 1800 * 2
+
+
+def _table_xml(cell_style, header_style, rows, style_ids):
+    cols = max(len(row) for row in rows)
+    width = _TEXT_WIDTH_TWIPS // cols
+    parts = [
+        f'<w:tbl><w:tblPr><w:tblStyle w:val="{style_ids["Table Grid"]}"/><w:tblW w:type="auto" w:w="0"/>'
+        '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" '
+        'w:noVBand="1" w:val="04A0"/></w:tblPr><w:tblGrid>',
+        f'<w:gridCol w:w="{width}"/>' * cols,
+        '</w:tblGrid>'
+    ]
+    for i, row in enumerate(rows):
+        parts.append('<w:tr>')
+        for j in range(cols):
+            text = row[j] if j < len(row) else ''
+            runs = [(text, header_style if i == 0 else None)] if text else []
+            parts.append(f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>'
+                         f'{_paragraph_xml(style_ids[cell_style], runs, style_ids)}</w:tc>')
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+
+def iter_document_xml(blocks):
+    """逐块生成 document.xml 的内容"""
+    template = get_template()
+    style_ids = template.style_ids
+
+    yield template.document_head
+    for block in blocks:
+        kind = block[0]
+        if kind == 'paragraph':
+            _, style, runs = block
+            yield _paragraph_xml(style_ids[style], runs, style_ids)
+        elif kind == 'page_break':
+            yield '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        elif kind == 'table':
+            _, cell_style, header_style, rows = block
+            yield _table_xml(cell_style, header_style, rows, style_ids)
+    yield template.document_tail
+
+
+def write_document(blocks, output):
+    """直接生成 document.xml 并流式写入zip，其余部分从模板原样复制
+
+    output 为可写的二进制文件对象；块列表可以是生成器，内存占用与文档长度无关。
+    """
+    template = get_template()
+
+    with zipfile.ZipFile(io.BytesIO(template.data)) as source, \
+            zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename == 'word/document.xml':
+                document_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                document_info.compress_type = zipfile.ZIP_DEFLATED
+                with target.open(document_info, 'w') as part:
+                    buffer = []
+                    size = 0
+                    for chunk in iter_document_xml(blocks):
+                        buffer.append(chunk)
+                        size += len(chunk)
+                        if size >= 64 * 1024:
+                            part.write(''.join(buffer).encode('utf-8'))
+                            buffer, size = [], 0
+                    part.write(''.join(buffer).encode('utf-8'))
+            else:
+                target.writestr(info, source.read(info.filename))
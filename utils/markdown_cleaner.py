@@ -0,0 +1,102 @@
+"""
+Markdown清理
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+clean_text_for_word 和 clean_markdown_for_word 共用的清理步骤。各步骤的顺序和正则与原实现一一对应，
+结果逐字符一致，只是：
+- 正则在导入时编译，且都改写成以字面量开头的等价形式，正则引擎可以直接跳到候选位置，
+  不必在每个字符处尝试匹配（原来的 #{1,6}\\s* 在 100KB 文本上比其余步骤加起来还慢）；
+- 强调和行内代码两步在能够证明“正则会删掉全部标记”时，改用 str.replace 一次删除，
+  不再逐个匹配、拼接分组内容。
+"""
+
+import re
+
+_BOLD = re.compile(r'\*\*(.*?)\*\*')
+_ITALIC = re.compile(r'\*(.*?)\*')
+
+# 等价于 #{1,6}\s*
+_HASH_MARKS = re.compile(r'##{0,5}\s*')
+# 等价于 ^#{1,6}\s*（MULTILINE）：后顾断言要求 # 前面是换行或文本开头
+_LINE_HEADING = re.compile(r'#(?<![^\n]#)#{0,5}\s*')
+
+_BULLET = re.compile(r'^\s*[-\*\+]\s*', re.MULTILINE)
+# 同一替换拆成“文本开头”和“换行之后”两种情况，后者以换行符开头，引擎只需在换行处尝试
+_BULLET_AT_START = re.compile(r'\s*[-\*\+]\s*')
+_BULLET_AFTER_NEWLINE = re.compile(r'\n\s*[-\*\+]\s*')
+# 空列表项后紧跟下一项（如 "-\n- a"）：上一次匹配吞掉了换行，下一项仍算行首，只能交给原正则
+_CHAINED_BULLETS = re.compile(r'[-\*\+]\s*\n[-\*\+]')
+_LINK = re.compile(r'\[([^\]]*)\]\([^\)]*\)')
+_CODE_BLOCK = re.compile(r'```.*?```', re.DOTALL)
+_INLINE_CODE = re.compile(r'`([^`]*)`')
+_BLANK_LINES = re.compile(r'\n\s*\n\s*\n')
+
+
+def _strip_emphasis(text):
+    """依次去掉粗体 \\*\\*(.*?)\\*\\* 和斜体 \\*(.*?)\\* 的标记
+
+    两条正则都不跨行：粗体每次在同一行删掉四个星号，斜体再把同一行剩下的星号两两配对删掉。
+    因此星号个数为偶数的行，两步的结果就是删掉该行全部星号；只有奇数行需要真正执行正则。
+    """
+    if '*' not in text:
+        return text
+    lines = text.split('\n')
+    if not any(line.count('*') % 2 for line in lines):
+        return text.replace('*', '')
+
+    return '\n'.join([
+        line if '*' not in line
+        else _ITALIC.sub(r'\1', _BOLD.sub(r'\1', line)) if line.count('*') % 2
+        else line.replace('*', '')
+        for line in lines
+    ])
+
+
+def _strip_code(text):
+    """依次删除代码块 ```.*?```（DOTALL）并去掉行内代码 `([^`]*)` 的标记
+
+    行内代码的正则可以跨行，剩余反引号从前往后两两配对；个数为偶数时即全部删掉。
+    """
+    if '`' not in text:
+        return text
+    text = _CODE_BLOCK.sub('', text)
+    if text.count('`') % 2 == 0:
+        return text.replace('`', '')
+    return _INLINE_CODE.sub(r'\1', text)
+
+
+def _replace_bullets(text):
+    """行首的列表符号换成圆点，对应 re.sub(r'^\\s*[-\\*\\+]\\s*', '• ', text, flags=re.MULTILINE)"""
+    if _CHAINED_BULLETS.search(text):
+        return _BULLET.sub('• ', text)
+    head = ''
+    match = _BULLET_AT_START.match(text)
+    if match:
+        head = '• '
+        text = text[match.end():]
+    return head + _BULLET_AFTER_NEWLINE.sub('\n• ', text)
+
+
+def _finish(text):
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+
+def clean_word_text(text):
+    """粗体、斜体、标题符号、代码块、行内代码，依次处理后合并多余空行"""
+    text = _strip_emphasis(text)
+    if '#' in text:
+        text = _HASH_MARKS.sub('', text)
+    text = _strip_code(text)
+    return _finish(text)
+
+
+def clean_markdown(text):
+    """行首标题、粗体、斜体、列表符号、链接、代码块、行内代码，依次处理后合并多余空行"""
+    if '#' in text:
+        text = _LINE_HEADING.sub('', text)
+    text = _strip_emphasis(text)
+    text = _replace_bullets(text)
+    if '[' in text:
+        text = _LINK.sub(r'\1', text)
+    text = _strip_code(text)
+    return _finish(text)
@@ -0,0 +1,363 @@
+"""
+运行指标（Prometheus 文本格式）
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+每个指标（含每组标签取值）在注册时分配固定的槽位，每个线程写入自己的一块数组（slab），
+记录时只做一次线程局部变量读取和原地加法，不加锁、不分配对象；采集时加锁把各线程的数组求和。
+已结束线程的数值在采集时或新线程取得数组时并入累计值，其数组清零后留给之后的线程复用，
+每请求一个线程的部署下数组数不随请求数增长。需要读取其他对象状态的指标（缓存命中、内存、队列长度）用回调在采集时计算。
+
+指标分为两个范围：inference（推理进程：调度器、模型侧缓存、GPU）和 app（Web 工作进程：HTTP、
+准入队列、报告、导出）。模型在独立进程中运行时，两部分分别在各自进程中采集后拼接输出。
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+
+SCOPE_APP = 'app'
+SCOPE_INFERENCE = 'inference'
+
+# 直方图桶边界
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+PHASE_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0)
+RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 300.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsRegistry:
+    """指标注册表，持有所有线程的计数数组"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._size = 0
+        self._slabs = []
+        # 已结束线程留下的数组（已清零），新线程优先复用
+        self._free = []
+        self._retired = []
+        self._families = {}
+
+    def register(self, family, replace=False):
+        with self._lock:
+            if family.name in self._families and not replace:
+                raise ValueError(f"指标已注册: {family.name}")
+            self._families[family.name] = family
+        return family
+
+    def _allocate(self, size):
+        with self._lock:
+            start = self._size
+            self._size += size
+            self._retired.extend([0.0] * size)
+            return start
+
+    def _thread_slab(self):
+        """当前线程的数组；首次使用时创建，注册了新槽位后补齐长度（只由所属线程修改）"""
+        slab = getattr(self._local, 'slab', None)
+        if slab is None:
+            with self._lock:
+                # 回收已结束线程的数组，数组数量不超过同时存活的线程数
+                self._sweep_locked()
+                slab = self._free.pop() if self._free else [0.0] * self._size
+                self._slabs.append((threading.current_thread(), slab))
+            self._local.slab = slab
+            if len(slab) < self._size:
+                slab.extend([0.0] * (self._size - len(slab)))
+        elif len(slab) < self._size:
+            slab.extend([0.0] * (self._size - len(slab)))
+        return slab
+
+    def _sweep_locked(self):
+        """已结束线程的数组不会再被写入：数值并入累计值，清零后放入空闲列表（调用方持有锁）"""
+        alive = []
+        for thread, slab in self._slabs:
+            if thread.is_alive():
+                alive.append((thread, slab))
+                continue
+            # 所属线程可能在补齐数组长度前结束，只读取已注册的槽位
+            for index, value in enumerate(slab[:len(self._retired)]):
+                self._retired[index] += value
+                slab[index] = 0.0
+            self._free.append(slab)
+        self._slabs = alive
+
+    def _snapshot(self):
+        """各槽位在所有线程上的合计值"""
+        with self._lock:
+            self._sweep_locked()
+            totals = list(self._retired)
+            for thread, slab in self._slabs:
+                # 所属线程可能正在补齐数组长度，只读取本次快照已知的槽位
+                for index, value in enumerate(slab[:len(totals)]):
+                    totals[index] += value
+            return totals
+
+    def render(self, scope=None):
+        """按 Prometheus 文本格式输出，scope 为 None 时输出全部指标"""
+        totals = self._snapshot()
+        with self._lock:
+            families = [family for family in self._families.values() if scope is None or family.scope == scope]
+        lines = []
+        for family in families:
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            family.render(totals, lines)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Family:
+    """同名指标的一组子指标（每组标签取值一个），子指标创建后应由调用方保存复用"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), scope=SCOPE_APP, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.scope = scope
+        self._registry = registry or REGISTRY
+        self._children = {}
+        self._children_lock = threading.Lock()
+        self._registry.register(self)
+        self._default = self.labels() if not self.labelnames else None
+
+    def labels(self, *values):
+        """取得（必要时创建）一组标签取值对应的子指标"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is not None:
+            return child
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签: {', '.join(self.labelnames)}")
+        with self._children_lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._new_child()
+                self._children[key] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self, totals, lines):
+        for key, child in list(self._children.items()):
+            child.render(self.name, self.labelnames, key, totals, lines)
+
+
+class _CounterChild:
+    __slots__ = ('_local', '_registry', '_slot')
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._local = registry._local
+        self._slot = registry._allocate(1)
+
+    def inc(self, amount=1.0):
+        try:
+            self._local.slab[self._slot] += amount
+        except (AttributeError, IndexError):
+            self._registry._thread_slab()[self._slot] += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def render(self, name, labelnames, key, totals, lines):
+        lines.append(f'{name}{_label_text(labelnames, key)} {_format_value(totals[self._slot])}')
+
+
+class Counter(_Family):
+    """只增不减的计数器，名称应以 _total 结尾"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(self._registry)
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+
+class Gauge(_Family):
+    """可增可减的数值（如进行中的请求数），各线程记录增量，采集时求和"""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _CounterChild(self._registry)
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount=1.0):
+        self._default.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('_local', '_registry', '_slot', '_sum_slot', '_bounds')
+
+    def __init__(self, registry, bounds):
+        self._registry = registry
+        self._local = registry._local
+        self._bounds = bounds
+        # 每个桶一个槽位（非累积）+ 超出最大边界的桶 + 总和
+        self._slot = registry._allocate(len(bounds) + 2)
+        self._sum_slot = self._slot + len(bounds) + 1
+
+    def observe(self, value):
+        index = self._slot + bisect_left(self._bounds, value)
+        try:
+            slab = self._local.slab
+            # 先写最后一个槽位：数组长度不足时在任何修改之前抛出 IndexError
+            slab[self._sum_slot] += value
+            slab[index] += 1
+        except (AttributeError, IndexError):
+            slab = self._registry._thread_slab()
+            slab[self._sum_slot] += value
+            slab[index] += 1
+
+    def render(self, name, labelnames, key, totals, lines):
+        cumulative = 0.0
+        for offset, bound in enumerate(self._bounds):
+            cumulative += totals[self._slot + offset]
+            labels = _label_text(labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f'{name}_bucket{labels} {_format_value(cumulative)}')
+        cumulative += totals[self._sum_slot - 1]
+        labels = _label_text(labelnames, key, 'le="+Inf"')
+        lines.append(f'{name}_bucket{labels} {_format_value(cumulative)}')
+        lines.append(f'{name}_sum{_label_text(labelnames, key)} {_format_value(totals[self._sum_slot])}')
+        lines.append(f'{name}_count{_label_text(labelnames, key)} {_format_value(cumulative)}')
+
+
+class Histogram(_Family):
+    """固定桶边界的直方图"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=(), scope=SCOPE_APP, registry=None):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, scope, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self._registry, self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+class CallbackMetric:
+    """采集时调用 callback 计算的指标
+
+    callback 返回数值，或 {标签取值元组: 数值}（有标签时）；返回 None 或抛出异常时不输出样本。
+    同名回调指标重复注册时替换旧的（应用重新创建时回调绑定新的对象）。
+    """
+
+    def __init__(self, name, documentation, kind, callback, labelnames=(), scope=SCOPE_APP, registry=None):
+        if kind not in ('counter', 'gauge'):
+            raise ValueError(f"不支持的回调指标类型: {kind}")
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.scope = scope
+        (registry or REGISTRY).register(self, replace=True)
+
+    def render(self, totals, lines):
+        try:
+            values = self.callback()
+        except Exception:
+            return
+        if values is None:
+            return
+        if not self.labelnames:
+            values = {(): values}
+        for key, value in values.items():
+            if value is not None:
+                lines.append(f'{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}')
+
+
+def process_memory_bytes():
+    """当前进程的常驻内存（RSS）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # 非Linux系统上只能取得峰值RSS（macOS单位为字节，其余为KB）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def process_cpu_seconds():
+    """当前进程累计占用的CPU时间（用户态 + 内核态）"""
+    times = os.times()
+    return times.user + times.system
+
+
+def gpu_memory_stats():
+    """各 CUDA 设备已分配和已预留的显存；未使用GPU时返回空字典"""
+    try:
+        import torch
+    except ImportError:
+        return {}
+    if not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return {}
+    return {
+        str(device): (torch.cuda.memory_allocated(device), torch.cuda.memory_reserved(device))
+        for device in range(torch.cuda.device_count())
+    }
+
+
+class Timer:
+    """with 语句计时，结束时把耗时（秒）记录到直方图子指标"""
+
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+_process_started = time.time()
+
+CallbackMetric('process_resident_memory_bytes', '进程常驻内存（字节）', 'gauge', process_memory_bytes)
+CallbackMetric('process_cpu_seconds_total', '进程累计CPU时间（秒）', 'counter', process_cpu_seconds)
+CallbackMetric('process_start_time_seconds', '进程启动时间（Unix时间戳）', 'gauge', lambda: _process_started)
+CallbackMetric('process_threads', '进程中的线程数', 'gauge', threading.active_count)
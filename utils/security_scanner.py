@@ -0,0 +1,180 @@
+"""
+安全扫描
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+全部规则合并成一条带命名分组的交替正则，一次扫描即可判断文本是否命中任意规则以及命中的是哪一条；
+模型输出逐token到达时，StreamScanner 保留上一段末尾的窗口，与新到的文本拼接后继续扫描，
+跨越分块边界的内容同样能被发现。
+"""
+
+import json
+import re
+
+# 规则名 -> 正则（不区分大小写）
+DEFAULT_RULES = {
+    'script_tag': r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>',
+    'javascript_url': r'javascript:',
+    'vbscript_url': r'vbscript:',
+    'onload_handler': r'onload\s*=',
+    'onerror_handler': r'onerror\s*=',
+    'eval_call': r'eval\s*\(',
+}
+
+# 流式扫描默认保留的字符数，即能跨分块边界识别的最长匹配
+DEFAULT_STREAM_WINDOW = 512
+
+_RULE_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_REGEX_META = set('.^$*+?{}[]\\|()')
+
+
+class SecurityMatch:
+    """一次命中"""
+
+    __slots__ = ('rule', 'start', 'end', 'text')
+
+    def __init__(self, rule, start, end, text):
+        self.rule = rule
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def to_dict(self):
+        return {'rule': self.rule, 'start': self.start, 'end': self.end, 'text': self.text}
+
+    def __repr__(self):
+        return f'SecurityMatch(rule={self.rule!r}, start={self.start}, end={self.end})'
+
+
+def _first_char(pattern):
+    """规则以普通字符开头（且该字符不可省略）时返回该字符，否则返回None"""
+    if not pattern or pattern[0] in _REGEX_META or '|' in pattern:
+        return None
+    if len(pattern) > 1 and pattern[1] in '*?{':
+        return None
+    return pattern[0]
+
+
+class SecurityScanner:
+    """由多条规则合并而成的扫描器"""
+
+    def __init__(self, rules=None):
+        rules = dict(DEFAULT_RULES if rules is None else rules)
+        if not rules:
+            raise ValueError("至少需要一条安全扫描规则")
+
+        branches = []
+        first_chars = set()
+        for name, pattern in rules.items():
+            if not _RULE_NAME.fullmatch(name):
+                raise ValueError(f"规则名不合法: {name!r}")
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"规则 {name} 的正则无效: {e}") from e
+            branches.append(f'(?P<{name}>{pattern})')
+            char = _first_char(pattern)
+            first_chars = first_chars | {char} if char is not None and first_chars is not None else None
+
+        combined = '|'.join(branches)
+        if first_chars:
+            # 各分支的首字符都已知时加上先行断言，引擎只在这些字符处尝试匹配（大小写折叠由 IGNORECASE 处理）
+            charset = ''.join(re.escape(char) for char in sorted(first_chars))
+            combined = f'(?=[{charset}])(?:{combined})'
+
+        self.rules = rules
+        try:
+            self.pattern = re.compile(combined, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"安全扫描规则无法合并: {e}") from e
+
+    def _to_match(self, match, offset=0):
+        return SecurityMatch(match.lastgroup, match.start() + offset, match.end() + offset, match.group())
+
+    def scan(self, text):
+        """返回第一处命中，未命中返回None"""
+        if not text:
+            return None
+        match = self.pattern.search(text)
+        return self._to_match(match) if match else None
+
+    def contains(self, text):
+        return bool(text) and self.pattern.search(text) is not None
+
+    def find_all(self, text):
+        """返回全部不重叠的命中"""
+        if not text:
+            return []
+        return [self._to_match(match) for match in self.pattern.finditer(text)]
+
+    def stream(self, window=DEFAULT_STREAM_WINDOW):
+        """创建一个增量扫描器"""
+        return StreamScanner(self, window)
+
+
+class StreamScanner:
+    """增量扫描逐段到达的文本
+
+    每次 feed() 只在“上次保留的窗口 + 新文本”上搜索，并只报告结束位置落在新文本中的命中，
+    已报告过的命中不会重复出现；命中位置是相对于全部已输入文本的偏移。
+    长度超过 window 的匹配（如很长的 <script> 块）在流式阶段可能漏掉，可在结束时对完整文本调用 scan()。
+    """
+
+    def __init__(self, scanner, window=DEFAULT_STREAM_WINDOW):
+        if window < 1:
+            raise ValueError("window 必须为正整数")
+        self.scanner = scanner
+        self.window = window
+        self._tail = ''
+        # _tail 第一个字符在全部文本中的偏移
+        self._offset = 0
+        # 已报告命中的最大结束位置，窗口内重新找到的同一段内容不再报告
+        self._reported_end = 0
+        self.total_chars = 0
+        self.matches = []
+
+    def feed(self, chunk):
+        """输入一段新文本，返回本段新出现的命中列表"""
+        if not chunk:
+            return []
+        buffer = self._tail + chunk
+        new_from = len(self._tail)
+        found = []
+        for match in self.scanner.pattern.finditer(buffer):
+            if match.end() > new_from and match.start() + self._offset >= self._reported_end:
+                found.append(self.scanner._to_match(match, self._offset))
+        if found:
+            self._reported_end = found[-1].end
+
+        self.total_chars += len(chunk)
+        if len(buffer) > self.window:
+            self._offset += len(buffer) - self.window
+            self._tail = buffer[-self.window:]
+        else:
+            self._tail = buffer
+        self.matches.extend(found)
+        return found
+
+    @property
+    def triggered(self):
+        return bool(self.matches)
+
+
+def load_rules(path=None, extra=None):
+    """默认规则与 JSON 文件 {"规则名": "正则"} 中的规则合并，值为空的规则表示禁用同名默认规则"""
+    rules = dict(DEFAULT_RULES)
+    overrides = {}
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides.update(json.load(f))
+    if extra:
+        overrides.update(extra)
+
+    for name, pattern in overrides.items():
+        if pattern:
+            rules[name] = pattern
+        else:
+            rules.pop(name, None)
+    return rules
+
+
+default_scanner = SecurityScanner()
@@ -7,10 +7,27 @@ import re
 import logging
 from typing import Optional, Dict, List
 
-logger = logging.getLogger(__name__)
+from .markdown_cleaner import clean_markdown
+from .security_scanner import default_scanner
 
+logger = logging.getLogger(__name__)
 
-def validate_input(text: str, max_length: Optional[int] = None, min_length: Optional[int] = None) -> Optional[str]:
+# 所有正则在导入时编译一次
+_NON_WORD = re.compile(r'[^\w\s]')
+_SENTENCE_END = re.compile(r'[。！？]')
+_WHITESPACE_RUN = re.compile(r'\s+')
+_WHITESPACE_CHAR = re.compile(r'\s')
+_CHINESE_CHAR = re.compile(r'[\u4e00-\u9fff]')
+_ENGLISH_CHAR = re.compile(r'[a-zA-Z]')
+_SENTENCE_MARKS = re.compile(r'[。！？.!?]+')
+_URL = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\s-]')
+_FILENAME_SEPARATORS = re.compile(r'[-\s]+')
+_HTML_TAG = re.compile(r'<[^>]*>')
+
+
+def validate_input(text: str, max_length: Optional[int] = None, min_length: Optional[int] = None,
+                   scanner=None) -> Optional[str]:
     """
     验证输入文本
 
@@ -18,6 +35,7 @@ def validate_input(text: str, max_length: Optional[int] = None, min_length: Opti
         text: 要验证的文本
         max_length: 最大长度限制
         min_length: 最小长度限制
+        scanner: 安全扫描器，默认使用内置规则
 
     Returns:
         错误消息，如果验证通过则返回None
@@ -36,36 +54,24 @@ def validate_input(text: str, max_length: Optional[int] = None, min_length: Opti
     if max_length and text_length > max_length:
         return f"长度不能超过{max_length}个字符"
 
-    if contains_malicious_content(text):
+    if contains_malicious_content(text, scanner):
         return "包含不允许的内容"
 
     return None
 
 
-def contains_malicious_content(text: str) -> bool:
+def contains_malicious_content(text: str, scanner=None) -> bool:
     """
     检查文本是否包含恶意内容
 
     Args:
         text: 要检查的文本
+        scanner: 安全扫描器，默认使用内置规则
 
     Returns:
         如果包含恶意内容返回True
     """
-    malicious_patterns = [
-        r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>',
-        r'javascript:',
-        r'vbscript:',
-        r'onload\s*=',
-        r'onerror\s*=',
-        r'eval\s*\(',
-    ]
-
-    for pattern in malicious_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-
-    return False
+    return (scanner or default_scanner).contains(text)
 
 
 def clean_markdown_for_word(text: str) -> str:
@@ -73,22 +79,7 @@ def clean_markdown_for_word(text: str) -> str:
     if not text:
         return text
 
-
-    text = re.sub(r'^#{1,6}\s*', '', text, flags=re.MULTILINE)
-
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-
-    text = re.sub(r'^\s*[-\*\+]\s*', '• ', text, flags=re.MULTILINE)
-
-    text = re.sub(r'\[([^\]]*)\]\([^\)]*\)', r'\1', text)
-    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
-    text = re.sub(r'`([^`]*)`', r'\1', text)
-
-    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
-
-    return text.strip()
+    return clean_markdown(text)
 
 
 def extract_key_phrases(text: str, max_phrases: int = 10) -> List[str]:
@@ -105,7 +96,7 @@ def extract_key_phrases(text: str, max_phrases: int = 10) -> List[str]:
     if not text:
         return []
 
-    cleaned_text = re.sub(r'[^\w\s]', ' ', text)
+    cleaned_text = _NON_WORD.sub(' ', text)
 
     words = cleaned_text.split()
 
@@ -137,7 +128,7 @@ def summarize_text(text: str, max_sentences: int = 3) -> str:
     if not text:
         return ""
 
-    sentences = re.split(r'[。！？]', text)
+    sentences = _SENTENCE_END.split(text)
     sentences = [s.strip() for s in sentences if s.strip()]
 
     if len(sentences) <= max_sentences:
@@ -160,7 +151,7 @@ def format_text_for_display(text: str, max_length: int = 100) -> str:
     if not text:
         return ""
 
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _WHITESPACE_RUN.sub(' ', text.strip())
 
     if len(text) <= max_length:
         return text
@@ -181,9 +172,9 @@ def detect_language(text: str) -> str:
     if not text:
         return "unknown"
 
-    chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
+    chinese_chars = len(_CHINESE_CHAR.findall(text))
 
-    english_chars = len(re.findall(r'[a-zA-Z]', text))
+    english_chars = len(_ENGLISH_CHAR.findall(text))
 
     total_chars = len(text)
 
@@ -208,9 +199,8 @@ def normalize_whitespace(text: str) -> str:
     if not text:
         return ""
 
-    text = re.sub(r'\s+', ' ', text)
-
-    return text.strip()
+    # 与 re.sub(r'\s+', ' ', text).strip() 等价：str.split() 与 \s 使用同一组空白字符
+    return ' '.join(text.split())
 
 
 def escape_html(text: str) -> str:
@@ -258,11 +248,11 @@ def count_words(text: str) -> Dict[str, int]:
 
     total_chars = len(text)
 
-    chars_no_spaces = len(re.sub(r'\s', '', text))
+    chars_no_spaces = len(_WHITESPACE_CHAR.sub('', text))
 
     words = len(text.split())
 
-    sentences = len(re.findall(r'[。！？.!?]+', text))
+    sentences = len(_SENTENCE_MARKS.findall(text))
 
     paragraphs = len([p for p in text.split('\n\n') if p.strip()])
 
@@ -288,8 +278,7 @@ def extract_urls(text: str) -> List[str]:
     if not text:
         return []
 
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    urls = re.findall(url_pattern, text)
+    urls = _URL.findall(text)
 
     return list(set(urls))  # 去重
 
@@ -329,8 +318,8 @@ def safe_filename(filename: str) -> str:
         return "untitled"
 
     # 移除或替换不安全的字符
-    safe_chars = re.sub(r'[^\w\s-]', '', filename)
-    safe_chars = re.sub(r'[-\s]+', '-', safe_chars)
+    safe_chars = _UNSAFE_FILENAME_CHARS.sub('', filename)
+    safe_chars = _FILENAME_SEPARATORS.sub('-', safe_chars)
 
     # 限制长度
     return safe_chars[:50].strip('-')
@@ -350,7 +339,7 @@ class TextProcessor:
 
             if contains_malicious_content(text):
                 self.logger.warning("检测到潜在恶意内容，已清理")
-                text = re.sub(r'<[^>]*>', '', text)
+                text = _HTML_TAG.sub('', text)
 
             return text
 
@@ -0,0 +1,188 @@
+"""
+执行时间线追踪（Chrome trace-event 格式）
+中央财经大学经济学院 - 经济学大模型聊天助手
+
+一次报告生成对应一个 Trace。当前所在的 Trace 和 span 保存在 contextvars 中，嵌套的 span 自动记为子 span；
+提交到线程池的任务需要用 contextvars.copy_context().run 执行才能继承。没有活动 Trace 时 trace_span 不做任何事。
+时间使用 Unix 时间戳，与推理调度器记录的时间点（可能在模型服务进程中）可直接比较。
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """一段已记录或正在进行的操作"""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'category', 'start', 'end', 'thread_id', 'thread_name', 'args')
+
+    def __init__(self, span_id, parent_id, name, category, start, args, thread=None):
+        thread = thread or threading.current_thread()
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = None
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.args = args
+
+    def to_dict(self):
+        return {
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'cat': self.category,
+            'start': self.start,
+            'end': self.end,
+            'tid': self.thread_id,
+            'thread': self.thread_name,
+            'args': self.args
+        }
+
+
+class Trace:
+    """一次任务的全部 span；各线程可并发写入"""
+
+    def __init__(self, trace_id, max_spans=None):
+        self.trace_id = trace_id
+        self.pid = os.getpid()
+        self.created_at = time.time()
+        self.max_spans = max_spans
+        self.dropped = 0
+        self._spans = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _new_span(self, name, category, start, args, thread=None):
+        current = _current.get()
+        parent_id = current[1].span_id if current is not None and current[0] is self else None
+        with self._lock:
+            self._next_id += 1
+            span_id = self._next_id
+        return Span(span_id, parent_id, name, category, start, args, thread)
+
+    def _record(self, span):
+        with self._lock:
+            if self.max_spans is not None and len(self._spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name, category='report', **args):
+        """记录 with 块的执行时间；块内抛出的异常记入 args['error'] 后继续抛出"""
+        span = self._new_span(name, category, time.time(), args)
+        token = _current.set((self, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.args['error'] = str(e) or type(e).__name__
+            raise
+        finally:
+            span.end = time.time()
+            _current.reset(token)
+            self._record(span)
+
+    def add_span(self, name, category, start, end, **args):
+        """补记一段已知起止时间的操作（记在当前线程、当前 span 之下）"""
+        if start is None or end is None or end < start:
+            return None
+        span = self._new_span(name, category, start, args)
+        span.end = end
+        self._record(span)
+        return span
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self._spans]
+        return {
+            'trace_id': self.trace_id,
+            'pid': self.pid,
+            'created_at': self.created_at,
+            'dropped_spans': self.dropped,
+            'spans': sorted(spans, key=lambda span: span['start'])
+        }
+
+
+def current_trace():
+    current = _current.get()
+    return current[0] if current is not None else None
+
+
+@contextmanager
+def trace_span(name, category='report', **args):
+    """在当前 Trace 中记录一个 span；没有活动 Trace 时 yield None"""
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, category, **args) as span:
+        yield span
+
+
+def record_generation(span, usage):
+    """把推理调用返回的 usage 写入 span 参数，并补记排队、预填充、解码三个子 span"""
+    if span is None or not usage:
+        return
+    trace = current_trace()
+    span.args.update({
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'cached_tokens': usage.get('cached_tokens'),
+        'generated_tokens': usage.get('generated_tokens'),
+        'compute_seconds': usage.get('compute_seconds'),
+        'decoding': usage.get('decoding')
+    })
+    if trace is None:
+        return
+    token = _current.set((trace, span))
+    try:
+        trace.add_span('scheduler_queue', 'inference', usage.get('submitted_at'), usage.get('started_at'))
+        trace.add_span('prefill', 'inference', usage.get('started_at'), usage.get('first_token_at'),
+                       prompt_tokens=usage.get('prompt_tokens'), cached_tokens=usage.get('cached_tokens'))
+        trace.add_span('decode', 'inference', usage.get('first_token_at'), usage.get('finished_at'),
+                       generated_tokens=usage.get('generated_tokens'))
+    finally:
+        _current.reset(token)
+
+
+def to_chrome_trace(data):
+    """把 Trace.to_dict() 的结果转换为 Chrome trace-event JSON（可在 Perfetto / chrome://tracing 中打开）"""
+    pid = data.get('pid', 0)
+    spans = data.get('spans', [])
+    origin = min((span['start'] for span in spans), default=data.get('created_at', 0))
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': f"trace {data.get('trace_id')}"}}]
+
+    thread_names = {}
+    for span in spans:
+        thread_names.setdefault(span['tid'], span.get('thread'))
+        end = span['end'] if span['end'] is not None else span['start']
+        args = dict(span.get('args') or {}, span_id=span['id'], parent_id=span['parent'])
+        events.append({
+            'name': span['name'],
+            'cat': span['cat'],
+            'ph': 'X',
+            'ts': round((span['start'] - origin) * 1e6, 1),
+            'dur': round((end - span['start']) * 1e6, 1),
+            'pid': pid,
+            'tid': span['tid'],
+            'args': args
+        })
+    for tid, name in thread_names.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+
+    return {
+        'traceEvents': events,
+        'displayTimeUnit': 'ms',
+        'otherData': {
+            'trace_id': data.get('trace_id'),
+            'started_at': origin,
+            'dropped_spans': data.get('dropped_spans', 0)
+        }
+    }
@@ -0,0 +1,59 @@
+"""
+流式ZIP输出
+中央财经大学经济学院 - 经济学大模型聊天助手
+"""
+
+import zipfile
+
+
+class _ChunkSink:
+    """只追加的输出缓冲；不支持seek，zipfile会改用数据描述符记录大小和CRC"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStream:
+    """边写边输出的ZIP归档
+
+    每次 add() 后调用 drain() 取走已压缩的数据，内存中只保留当前文件；close() 写入中央目录。
+    """
+
+    def __init__(self, compression=zipfile.ZIP_DEFLATED):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=compression)
+
+    def add(self, name, data, date_time=None):
+        """添加一个文件，date_time 为 (年, 月, 日, 时, 分, 秒)，默认当前时间"""
+        if date_time is None:
+            self._zip.writestr(name, data)
+        else:
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = self._zip.compression
+            self._zip.writestr(info, data)
+
+    def drain(self):
+        """取走目前已生成的归档数据"""
+        return self._sink.drain()
+
+    def close(self):
+        """结束归档，返回剩余数据（含中央目录）"""
+        self._zip.close()
+        return self._sink.drain()